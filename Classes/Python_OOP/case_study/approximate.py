@@ -0,0 +1,99 @@
+"""Approximate neighbor search for Hyperparameter(recall=...).classify.
+
+LSHIndex is a random-projection (p-stable) locality sensitive hash: each table projects the
+measurements onto a few random directions and cuts each projection into buckets of width cm.
+A query only measures the training rows that share a bucket with it in at least one table.
+More tables find more of the true neighbors (recall) and measure more rows (latency);
+LSHIndex.tune() adds tables until the recall measured on the testing samples reaches a target."""
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+import metrics
+from distance_calculations import Distance
+from neighbor_index import NeighborIndex, k_nearest
+
+
+def recall(found:np.ndarray, exact:np.ndarray) -> float:
+    """The fraction of the exact neighbors that were found, averaged over the queries."""
+    if exact.size == 0:
+        return 1.0
+    hits = sum(len(np.intersect1d(f, e)) for f, e in zip(found, exact))
+    return hits / exact.size
+
+
+class LSHIndex(NeighborIndex):
+    """Random-projection LSH tables over the training matrix.
+    The candidates are measured exactly and ordered by (distance, position) like the exact indexes,
+    so the answers only differ when a true neighbor shared no bucket with the query.
+    A query with fewer than k candidates measures every training row instead."""
+    def __init__(
+            self, matrix:np.ndarray, algorithm:Distance,
+            tables:int=8, bits:int=6, width:float=0.6, seed:int=0,
+    ) -> None:
+        super().__init__(matrix, algorithm)
+        self.bits = bits
+        self.width = width
+        self.rng = np.random.default_rng(seed)
+        self.recall: Optional[float] = None #set by tune()
+        self._projections: List[np.ndarray] = []
+        self._offsets: List[np.ndarray] = []
+        self._order: List[np.ndarray] = []
+        self._keys: List[np.ndarray] = []
+        self._mix = self.rng.integers(1, 1 << 31, size=bits, dtype=np.int64) | 1 #folds a table's codes into one key
+        for _ in range(tables):
+            self.add_table()
+
+    @property
+    def tables(self) -> int:
+        return len(self._keys)
+
+    def _hash(self, table:int, rows:np.ndarray) -> np.ndarray:
+        codes = np.floor((rows @ self._projections[table] + self._offsets[table]) / self.width).astype(np.int64)
+        return codes @ self._mix #colliding keys only merge buckets: more candidates, same answers
+
+    def add_table(self) -> None:
+        directions = self.rng.standard_normal((self.matrix.shape[1], self.bits))
+        self._projections.append(directions / np.linalg.norm(directions, axis=0)) #unit vectors: projections in cm
+        self._offsets.append(self.rng.uniform(0, self.width, self.bits))
+        keys = self._hash(self.tables, self.matrix)
+        order = np.argsort(keys, kind="stable")
+        self._order.append(order)
+        self._keys.append(keys[order])
+
+    def _buckets(self, queries:np.ndarray) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """(start, end) of every query's bucket in each table's sorted keys."""
+        buckets = []
+        for table in range(self.tables):
+            keys = self._hash(table, queries)
+            sorted_keys = self._keys[table]
+            buckets.append((np.searchsorted(sorted_keys, keys, "left"), np.searchsorted(sorted_keys, keys, "right")))
+        return buckets
+
+    def query(self, queries:np.ndarray, k:int) -> np.ndarray:
+        nearest = np.empty((len(queries), min(k, len(self.matrix))), dtype=np.intp)
+        buckets = self._buckets(queries)
+        for row, q in enumerate(queries):
+            found = [order[start[row] : end[row]] for order, (start, end) in zip(self._order, buckets)]
+            rows = np.unique(np.concatenate(found)) if found else np.empty(0, dtype=np.intp) #ascending
+            if len(rows) < nearest.shape[1]:
+                rows = np.arange(len(self.matrix))
+            metrics.count_distances(len(rows))
+            d = self.algorithm.one_to_many(q, self.matrix[rows])
+            nearest[row] = rows[k_nearest(d.reshape(1, -1), k)[0]]
+        return nearest
+
+    @classmethod
+    def tune(
+            cls, matrix:np.ndarray, algorithm:Distance, queries:np.ndarray, exact:np.ndarray,
+            target:float, max_tables:int=64, bits:int=6, width:float=0.6, seed:int=0,
+    ) -> "LSHIndex":
+        """Adds tables, one at a time, until the recall against the exact (queries, k) neighbors
+        reaches target, or there are max_tables. The measured recall is kept in .recall."""
+        index = cls(matrix, algorithm, tables=1, bits=bits, width=width, seed=seed)
+        k = exact.shape[1] if exact.ndim == 2 else 0
+        while True:
+            index.recall = recall(index.query(queries, k), exact)
+            if index.recall >= target or index.tables >= max_tables:
+                return index
+            index.add_table()
@@ -0,0 +1,176 @@
+"""Reproducible timings of the classifier paths, kept in a JSON history so runs can be compared.
+
+    python bench_runner.py run --sizes 150,10000,1000000 --history bench_history.json
+    python bench_runner.py compare --history bench_history.json --threshold 0.10
+
+run times load, partition, distance, test and tune for every Distance and k on seeded synthetic
+iris-like data (benchmarks.synthetic_rows), and appends one record to the history.
+compare checks the last two records (or two given by index) and exits with 1 when any timing got
+slower by more than the threshold. Each timing is the best of --repeat runs, to damp noise.
+Testing is cut to --max-testing samples so the test and tune paths stay feasible at 10M rows."""
+import argparse
+import itertools
+import json
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from benchmarks import synthetic_rows
+from classes import Hyperparameter, Purpose, SampleStore, TrainingData
+from data_handlers import partition_stream, training_80
+from distance_cache import NeighborOrderCache
+from distance_calculations import CD, ED, MD, SD, Distance
+
+distances: Tuple[Distance, ...] = (ED(), MD(), CD(), SD())
+default_sizes = (150, 1_000, 10_000, 100_000)
+max_size = 10_000_000
+
+Record = Dict[str, Any]
+
+
+def best_of(repeat:int, setup:Callable[[], Any], timed:Callable[[Any], object]) -> float:
+    """The fastest of repeat runs of timed(setup()), with setup() outside the timing."""
+    best = float("inf")
+    for _ in range(repeat):
+        state = setup()
+        start = time.perf_counter()
+        timed(state)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def loaded(rows:List[Dict[str, str]], max_testing:int) -> TrainingData:
+    data = TrainingData("bench", cache=NeighborOrderCache())
+    data.load(rows)
+    if len(data.testing) > max_testing:
+        data.testing = SampleStore(Purpose.Testing, data.testing[:max_testing])
+        data.invalidate()
+    return data
+
+
+def time_size(size:int, ks:Sequence[int], repeat:int, max_testing:int, workers:int) -> Dict[str, float]:
+    """Every timing for one dataset size, keyed like "test/ED/k=5/size=1000"."""
+    rows = list(synthetic_rows(size, seed=size))
+    timings: Dict[str, float] = {}
+    timings[f"load/size={size}"] = best_of(repeat, lambda: TrainingData("bench"), lambda data: data.load(rows))
+
+    data = loaded(rows, max_testing)
+    def route(sinks:Tuple[SampleStore, SampleStore]) -> None:
+        partition_stream(data.training, training_80, *sinks)
+    timings[f"partition/size={size}"] = best_of(
+        repeat, lambda: (SampleStore(Purpose.Training), SampleStore(Purpose.Testing)), route,
+    )
+
+    training = data.training_matrix().matrix
+    queries = data.testing_matrix()[:100]
+    for algorithm in distances:
+        name = type(algorithm).__name__
+        timings[f"distance/{name}/size={size}"] = best_of(
+            repeat, lambda: None, lambda _: algorithm.pairwise(queries, training),
+        )
+        for k in ks:
+            # a fresh cache each time: the first k of a sweep pays for the neighbor search
+            def fresh() -> Hyperparameter:
+                data.neighbor_cache = NeighborOrderCache()
+                return Hyperparameter(k, algorithm, data)
+            timings[f"test/{name}/k={k}/size={size}"] = best_of(repeat, fresh, lambda h: h.test())
+
+    grid = list(itertools.product(ks, distances))
+    timings[f"tune/size={size}"] = best_of(repeat, lambda: None, lambda _: data.tune(grid, workers=workers))
+    return timings
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(sizes:Sequence[int], ks:Sequence[int], repeat:int, max_testing:int, workers:int) -> Record:
+    timings: Dict[str, float] = {}
+    for size in sizes:
+        if not 150 <= size <= max_size:
+            raise ValueError(f"size {size} outside 150..{max_size}")
+        timings.update(time_size(size, ks, repeat, max_testing, workers))
+        print(f"size {size}: done", file=sys.stderr)
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "settings": {"sizes": list(sizes), "ks": list(ks), "repeat": repeat, "max_testing": max_testing, "workers": workers},
+        "timings": timings,
+    }
+
+
+def load_history(path:Path) -> List[Record]:
+    if not path.exists():
+        return []
+    return json.loads(path.read_text())
+
+def save_history(path:Path, history:List[Record]) -> None:
+    path.write_text(json.dumps(history, indent=1))
+
+
+def compare(base:Record, new:Record, threshold:float) -> List[Tuple[str, float, float]]:
+    """(timing, base seconds, new seconds) for every timing in both records that got slower by more than threshold."""
+    regressions = []
+    for key, seconds in sorted(new["timings"].items()):
+        before = base["timings"].get(key)
+        if before is not None and seconds > before * (1 + threshold):
+            regressions.append((key, before, seconds))
+    return regressions
+
+
+def main(argv:Sequence[str]=()) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--history", type=Path, default=Path("bench_history.json"))
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run")
+    run_parser.add_argument("--sizes", default=",".join(map(str, default_sizes)))
+    run_parser.add_argument("--ks", default="1,5,15")
+    run_parser.add_argument("--repeat", type=int, default=3)
+    run_parser.add_argument("--max-testing", type=int, default=1_000)
+    run_parser.add_argument("--workers", type=int, default=2)
+    compare_parser = commands.add_parser("compare")
+    compare_parser.add_argument("base", type=int, nargs="?", default=-2, help="history index, default the one before last")
+    compare_parser.add_argument("new", type=int, nargs="?", default=-1, help="history index, default the last")
+    compare_parser.add_argument("--threshold", type=float, default=0.10)
+    args = parser.parse_args(argv or None)
+
+    history = load_history(args.history)
+    if args.command == "run":
+        record = run(
+            [int(size) for size in args.sizes.split(",")], [int(k) for k in args.ks.split(",")],
+            args.repeat, args.max_testing, args.workers,
+        )
+        history.append(record)
+        save_history(args.history, history)
+        for key, seconds in record["timings"].items():
+            print(f"{key:40} {seconds * 1000:10.2f}ms")
+        return 0
+
+    if len(history) < 2:
+        print(f"{args.history} needs two runs to compare", file=sys.stderr)
+        return 2
+    base, new = history[args.base], history[args.new]
+    regressions = compare(base, new, args.threshold)
+    print(f"{base['commit']} ({base['time']}) -> {new['commit']} ({new['time']}), threshold {args.threshold:.0%}")
+    for key, before, after in regressions:
+        print(f"REGRESSION {key:40} {before * 1000:10.2f}ms -> {after * 1000:10.2f}ms ({after / before - 1:+.0%})")
+    if not regressions:
+        print("no regressions")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,278 @@
+"""Timing checks for the case study. Run from this directory: python benchmarks.py"""
+import asyncio
+import csv
+import random
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+
+from classes import (
+    Hyperparameter, Purpose, Sample, SampleStore, TrainingData, TrainingKnownSample, UnknownSample, as_matrix, k_nn_naive,
+    species,
+)
+import metrics
+from approximate import recall
+from classify_service import ClassifyService
+from data_handlers import SampleReader
+from sample_file import open_training_data, write_training_data
+from distance_calculations import CD, ED, MD, SD, Distance
+
+
+def synthetic_rows(n:int, seed:int=42) -> Iterator[dict[str, str]]:
+    """Iris-like rows in the SampleReader/TrainingData.load dict format, rounded to 0.1cm like bezdekIris.data."""
+    rng = random.Random(seed)
+    names = sorted(species)
+    for _ in range(n):
+        yield {
+            "sepal_length": f"{rng.uniform(4.3, 7.9):.1f}",
+            "sepal_width": f"{rng.uniform(2.0, 4.4):.1f}",
+            "petal_length": f"{rng.uniform(1.0, 6.9):.1f}",
+            "petal_width": f"{rng.uniform(0.1, 2.5):.1f}",
+            "species": rng.choice(names),
+        }
+
+
+def bench_classify(training_rows:int=125_000, queries:int=20, k:int=5) -> float:
+    """Naive per-sample k-NN against Hyperparameter.classify_batch. Returns the speedup."""
+    data = TrainingData("bench")
+    data.load(synthetic_rows(training_rows))
+    unknowns = [
+        UnknownSample(s.sepal_length, s.sepal_width, s.petal_length, s.petal_width)
+        for s in data.testing[:queries]
+    ]
+    h = Hyperparameter(k, ED(), data)
+    data.neighbor_index(h.algorithm) #packing and indexing happen once per load, keep them out of the timing
+
+    start = time.perf_counter()
+    expected = [k_nn_naive(k, h.algorithm, data.training, u) for u in unknowns]
+    naive = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = h.classify_batch(unknowns)
+    batch = time.perf_counter() - start
+
+    assert actual == expected
+    print(f"classify: {len(data.training)} training rows, {queries} queries, "
+          f"naive {naive:.3f}s, batch {batch:.4f}s, {naive / batch:.0f}x")
+    return naive / batch
+
+
+def bench_distances(queries:int=50, training_rows:int=2_000) -> dict[str, float]:
+    """Scalar Distance.distance calls against one_to_many and pairwise, per metric.
+    Checks the batch results against the scalar ones (within 1e-12). Returns the pairwise speedups."""
+    rng = np.random.default_rng(42)
+    a = [UnknownSample(*row) for row in np.round(rng.uniform(0.1, 7.9, (queries, 4)), 1).tolist()]
+    b = [UnknownSample(*row) for row in np.round(rng.uniform(0.1, 7.9, (training_rows, 4)), 1).tolist()]
+    A = as_matrix(a)
+    B = np.asfortranarray(as_matrix(b))
+    speedups = {}
+    algorithm: Distance
+    for algorithm in (ED(), MD(), CD(), SD()):
+        start = time.perf_counter()
+        scalar = np.array([[algorithm.distance(s1, s2) for s2 in b] for s1 in a])
+        scalar_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        rows = np.array([algorithm.one_to_many(x, B) for x in A])
+        one_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        block = algorithm.pairwise(A, B)
+        block_time = time.perf_counter() - start
+
+        assert np.allclose(rows, scalar, rtol=0, atol=1e-12) and np.allclose(block, scalar, rtol=0, atol=1e-12)
+        name = type(algorithm).__name__
+        speedups[name] = scalar_time / block_time
+        print(f"distance {name}: {queries}x{training_rows}, scalar {scalar_time:.3f}s, "
+              f"one_to_many {one_time * 1000:.2f}ms, pairwise {block_time * 1000:.2f}ms, "
+              f"{scalar_time / block_time:.0f}x")
+    return speedups
+
+
+def bench_approximate(training_rows:int=100_000, queries:int=1_000, k:int=5) -> None:
+    """Latency and recall of Hyperparameter(recall=target).classify_batch against the exact search,
+    measured on the first queries testing samples, one sample per call like the online endpoint."""
+    data = TrainingData("bench")
+    data.load(synthetic_rows(training_rows))
+    testing = data.testing[:queries]
+    for algorithm in (ED(), SD()):
+        name = type(algorithm).__name__
+        index = data.neighbor_index(algorithm)
+        start = time.perf_counter()
+        exact = np.concatenate([index.query(as_matrix([s]), k) for s in testing])
+        exact_time = (time.perf_counter() - start) / queries
+        print(f"approximate {name}: {len(data.training)} training rows, exact {exact_time * 1000:.2f}ms/query")
+        for target in (0.8, 0.9, 0.95, 0.99):
+            h = Hyperparameter(k, algorithm, data, recall=target)
+            approximate = data.approximate_index(algorithm, k, target)
+            start = time.perf_counter()
+            found = np.concatenate([approximate.query(as_matrix([s]), k) for s in testing])
+            approximate_time = (time.perf_counter() - start) / queries
+            expected = [data.training_matrix().vote(row) for row in exact]
+            agreement = np.mean([a == e for a, e in zip(h.classify_batch(testing), expected)])
+            print(f"    target {target}: {approximate.tables} tables, tuned recall {approximate.recall:.3f}, "
+                  f"measured recall {recall(found, exact):.3f}, same class {agreement:.3f}, "
+                  f"{approximate_time * 1000:.2f}ms/query, {exact_time / approximate_time:.1f}x")
+
+
+async def _load(service:ClassifyService, samples:list[UnknownSample], clients:int) -> list[float]:
+    """clients concurrent callers, each classifying its share of the samples one await at a time."""
+    latencies: list[float] = []
+    async def client(mine:list[UnknownSample]) -> None:
+        for sample in mine:
+            start = time.perf_counter()
+            await service.classify(sample)
+            latencies.append(time.perf_counter() - start)
+    await asyncio.gather(*(client(samples[n::clients]) for n in range(clients)))
+    return latencies
+
+
+def bench_service(training_rows:int=2_000, requests:int=20_000, clients:int=256, k:int=5) -> float:
+    """Throughput and p50/p99 latency of ClassifyService under a local load generator,
+    unbatched (max_batch=1) against micro-batched. Returns the throughput ratio."""
+    data = TrainingData("bench")
+    data.load(synthetic_rows(training_rows))
+    h = Hyperparameter(k, ED(), data)
+    data.neighbor_index(h.algorithm)
+    rng = np.random.default_rng(42)
+    throughput = {}
+    for max_batch in (1, 256):
+        samples = [UnknownSample(*row) for row in np.round(rng.uniform(0.1, 7.9, (requests, 4)), 1).tolist()]
+        async def run() -> tuple[list[float], dict[str, float]]:
+            async with ClassifyService(data, h, max_batch=max_batch) as service:
+                return await _load(service, samples, clients), service.stats()
+        start = time.perf_counter()
+        latencies, stats = asyncio.run(run())
+        elapsed = time.perf_counter() - start
+        p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+        throughput[max_batch] = requests / elapsed
+        print(f"service max_batch={max_batch}: {requests} requests, {clients} clients, {requests / elapsed:,.0f} req/s, "
+              f"p50 {p50:.1f}ms, p99 {p99:.1f}ms, mean batch {stats['mean_batch']:.0f}, max queue {stats['max_depth']}")
+    return throughput[256] / throughput[1]
+
+
+def bench_instrumentation(training_rows:int=2_000, calls:int=20_000, k:int=5) -> float:
+    """Cost of the metrics hooks on the cheapest instrumented call, a one-sample classify().
+    The disabled cost is measured on the hooks alone (the registry.enabled check and a count_distances()
+    per call), since the hooks can't be taken out of the code to compare against.
+    Returns the disabled overhead in percent."""
+    data = TrainingData("bench")
+    data.load(synthetic_rows(training_rows))
+    h = Hyperparameter(k, ED(), data)
+    unknown = UnknownSample(5.1, 3.5, 1.4, 0.2)
+    h.classify(unknown)
+
+    start = time.perf_counter()
+    for _ in range(calls):
+        h.classify(unknown)
+    classify_time = (time.perf_counter() - start) / calls
+
+    start = time.perf_counter()
+    for _ in range(calls):
+        if metrics.registry.enabled:
+            pass
+        metrics.count_distances(training_rows)
+    hook_time = (time.perf_counter() - start) / calls
+
+    metrics.registry.enable()
+    start = time.perf_counter()
+    for _ in range(calls):
+        h.classify(unknown)
+    enabled_time = (time.perf_counter() - start) / calls
+    metrics.registry.disable()
+    metrics.registry.reset()
+
+    overhead = 100 * hook_time / classify_time
+    print(f"instrumentation: classify {classify_time * 1e6:.1f}us, disabled hooks {hook_time * 1e6:.2f}us "
+          f"({overhead:.2f}%), enabled classify {enabled_time * 1e6:.1f}us "
+          f"({100 * (enabled_time - classify_time) / classify_time:+.1f}%)")
+    return overhead
+
+
+def bench_memory(rows:int=200_000) -> float:
+    """Bytes held by a list of TrainingKnownSample objects against a SampleStore. Returns the ratio."""
+    raw = [TrainingKnownSample.from_dict(row) for row in synthetic_rows(rows)]
+
+    tracemalloc.start()
+    objects = [TrainingKnownSample.from_dict(row) for row in synthetic_rows(rows)]
+    object_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objects
+
+    tracemalloc.start()
+    store = SampleStore(Purpose.Training, raw)
+    store_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print(f"memory: {rows} rows, objects {object_bytes / rows:.0f} bytes/row, "
+          f"SampleStore {store_bytes / rows:.0f} bytes/row, {object_bytes / store_bytes:.1f}x")
+    return object_bytes / store_bytes
+
+
+def write_bezdek(path:Path, rows:int) -> None:
+    """Writes synthetic rows in the bezdekIris.data layout: no header, species last."""
+    with path.open("w", newline="") as target:
+        writer = csv.writer(target)
+        for row in synthetic_rows(rows):
+            writer.writerow([row["sepal_length"], row["sepal_width"], row["petal_length"], row["petal_width"], row["species"]])
+
+
+def bench_reader(rows:int=500_000) -> float:
+    """Rows/sec of a DictReader + one Sample per row (the old sample_iter) against SampleReader.batch_iter."""
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "bezdekIris.data"
+        write_bezdek(path, rows)
+
+        start = time.perf_counter()
+        with path.open() as source_file:
+            for row in csv.DictReader(source_file, SampleReader.header):
+                Sample(
+                    sepal_length=float(row["sepal_length"]),
+                    sepal_width=float(row["sepal_width"]),
+                    petal_length=float(row["petal_length"]),
+                    petal_width=float(row["petal_width"]),
+                )
+        per_row = rows / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        count = sum(len(batch) for batch in SampleReader(path).batch_iter())
+        batched = count / (time.perf_counter() - start)
+
+    print(f"reader: {rows} rows, DictReader + Sample {per_row:,.0f} rows/s, "
+          f"batch_iter {batched:,.0f} rows/s, {batched / per_row:.1f}x")
+    return batched / per_row
+
+
+def bench_sample_file(rows:int=500_000) -> float:
+    """TrainingData.load from dict rows against open_training_data on the saved sample file."""
+    raw = list(synthetic_rows(rows))
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "iris.samples"
+        start = time.perf_counter()
+        data = TrainingData("bench")
+        data.load(raw)
+        loaded = time.perf_counter() - start
+        write_training_data(data, path)
+
+        start = time.perf_counter()
+        mapped = open_training_data(path, "bench")
+        mapped.training_matrix()
+        opened = time.perf_counter() - start
+
+    print(f"sample file: {rows} rows, load {loaded:.2f}s, mapped open {opened * 1000:.2f}ms")
+    return loaded / opened
+
+
+if __name__ == "__main__":
+    bench_distances()
+    bench_classify()
+    bench_approximate()
+    bench_service()
+    bench_instrumentation()
+    bench_memory()
+    bench_reader()
+    bench_sample_file()
@@ -1,11 +1,100 @@
+import datetime
+import enum
+import hashlib
+import itertools
+import os
+import weakref
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.shared_memory import SharedMemory
+from typing import (
+    TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple, Type, Union,
+    overload,
+)
+
+import numpy as np
+
+from approximate import LSHIndex
+import metrics
+from distance_cache import NeighborOrderCache, neighbor_cache
+from distance_calculations import Distance
+from exceptions import InvalidSampleError, OutlierError
+from incremental import NeighborHeaps
+from neighbor_index import NeighborIndex, build_index
+
+if TYPE_CHECKING:
+    from prediction_cache import PredictionCache
 
-from typing import Set
 class Domain(Set[str]):
     def validate(self, value:str) -> str:
         if value in self:
             return value
         raise ValueError(f"invalid {value!r}")
 species = Domain({"Iris-setosa", "Iris-versicolour", "Iris-virginica"})
+feature_names = ("sepal_length", "sepal_width", "petal_length", "petal_width")
+feature_bounds = { #cm, about twice the ranges seen in bezdekIris.data; anything outside is an OutlierError
+    "sepal_length": (2.0, 16.0),
+    "sepal_width": (1.0, 9.0),
+    "petal_length": (0.5, 14.0),
+    "petal_width": (0.05, 5.0),
+}
+
+class RowValidation(NamedTuple):
+    """validate_rows() for a block of raw rows. Invalid rows have NaN measurements, valid[n] False,
+    and their InvalidSampleError (or OutlierError) in errors[n]."""
+    measurements: np.ndarray #(n, 4) float64, one column per feature_names
+    species: List[Optional[str]]
+    valid: np.ndarray #(n,) bool
+    errors: Dict[int, InvalidSampleError]
+
+def _column(rows:Sequence[dict[str, str]], name:str, errors:Dict[int, InvalidSampleError]) -> np.ndarray:
+    """One feature of every row as float64, converted in one pass; only a column with a bad value
+    falls back to converting one value at a time, to find which rows are bad."""
+    values = [row.get(name) for row in rows]
+    try:
+        if None not in values:
+            return np.array(values, dtype=np.float64)
+    except ValueError:
+        pass
+    column = np.full(len(values), np.nan)
+    for n, value in enumerate(values):
+        if value is None:
+            errors.setdefault(n, InvalidSampleError(f"missing {name!r}"))
+            continue
+        try:
+            column[n] = float(value)
+        except (TypeError, ValueError):
+            errors.setdefault(n, InvalidSampleError(f"invalid {name} {value!r}"))
+    return column
+
+def validate_rows(rows:Sequence[dict[str, str]], known:bool=True) -> RowValidation:
+    """Validates a block of raw rows at once: the measurements are converted a column at a time,
+    checked against feature_bounds, and, for known samples, the species is looked up in the species Domain.
+    Each invalid row gets the first problem found with it."""
+    errors: Dict[int, InvalidSampleError] = {}
+    measurements = np.empty((len(rows), len(feature_names)))
+    for c, name in enumerate(feature_names):
+        column = measurements[:, c] = _column(rows, name, errors)
+        for n in np.flatnonzero(np.isnan(column)).tolist(): #"nan" converts, but isn't a measurement
+            errors.setdefault(n, InvalidSampleError(f"invalid {name} {rows[n].get(name)!r}"))
+        low, high = feature_bounds[name]
+        with np.errstate(invalid="ignore"):
+            outside = ~((column >= low) & (column <= high)) & ~np.isnan(column)
+        for n in np.flatnonzero(outside).tolist():
+            errors.setdefault(n, OutlierError(f"{name} {column[n]} outside {low}..{high}"))
+    names = [row.get("species") for row in rows]
+    if known:
+        categories = np.array(sorted(species))
+        given = np.array([name if isinstance(name, str) else "" for name in names])
+        found = np.searchsorted(categories, given).clip(0, len(categories) - 1)
+        for n in np.flatnonzero(categories[found] != given).tolist():
+            errors.setdefault(n, InvalidSampleError(f"invalid species {names[n]!r}"))
+    valid = np.ones(len(rows), dtype=bool)
+    invalid = sorted(errors)
+    valid[invalid] = False
+    measurements[invalid] = np.nan
+    return RowValidation(measurements, names, valid, {n: errors[n] for n in invalid})
 
 
 
@@ -67,19 +156,19 @@ class Sample:
         )
     @classmethod
     def from_dict(cls, row: dict[str,str]) -> "Sample":
-        """Builds an intermediate representation of a Sample, validating its measurement attributes."""
-        try:
-            return cls(
-                sepal_length=float(row["sepal_length"]),
-                sepal_width=float(row["sepal_width"]),
-                petal_length=float(row["petal_length"]),
-                petal_width=float(row["petal_width"]),
-                species = row["species"] #assign now and check in KnownSample class from_dict method
-            )
-        except ValueError as ex:
-            raise InvalidSampleError(f"invalid {row!r}")
-        except KeyError:
-            raise InvalidSampleError(f"invalid key")
+        """Builds an intermediate representation of a Sample, validating its measurement attributes.
+        A one-row validate_rows(); use that directly for blocks of rows."""
+        checked = validate_rows([row], known=False)
+        if not checked.valid[0]:
+            raise checked.errors[0]
+        sepal_length, sepal_width, petal_length, petal_width = checked.measurements[0].tolist()
+        return cls(
+            sepal_length=sepal_length,
+            sepal_width=sepal_width,
+            petal_length=petal_length,
+            petal_width=petal_width,
+            species = checked.species[0] #checked in KnownSample class from_dict method
+        )
         
 
 
@@ -110,13 +199,16 @@ class UnknownSample(Sample): #DO I PUT SPECIES IN THE INIT???
         )
     @classmethod
     def from_dict(cls, row: dict[str,str]) -> "UnknownSample":
-        sample = Sample.from_dict(row)
+        """A one-row validate_rows(); a species in the row is ignored, that's what classifying finds out."""
+        checked = validate_rows([row], known=False)
+        if not checked.valid[0]:
+            raise checked.errors[0]
+        sepal_length, sepal_width, petal_length, petal_width = checked.measurements[0].tolist()
         return cls(
-                species = None, #???? is this right?????
-                sepal_length = sample.sepal_length,
-                sepal_width = sample.sepal_width,
-                petal_length = sample.petal_length,
-                petal_width = sample.petal_width,
+                sepal_length = sepal_length,
+                sepal_width = sepal_width,
+                petal_length = petal_length,
+                petal_width = petal_width,
             )
 
 class KnownSample(Sample):
@@ -124,6 +216,7 @@ class KnownSample(Sample):
         purpose_enum = Purpose(purpose)
         if purpose_enum not in {Purpose.Training, Purpose.Testing}:
             raise ValueError(f"Invalid purpose: {purpose!r}: {purpose_enum}")
+        self.purpose = purpose_enum #set before super().__init__ so the classification setter can check it
         super().__init__(
             sepal_length=sepal_length,
             sepal_width=sepal_width,
@@ -131,8 +224,6 @@ class KnownSample(Sample):
             petal_width=petal_width
         )
         self.species = species
-        self.purpose = purpose_enum
-        self._classification: Optional[str] = None
 
     def __repr__(self) -> str:
         return (f"{self.__class__.__name__}("
@@ -152,38 +243,239 @@ class KnownSample(Sample):
             raise AttributeError(f"Training samples have no classification")
         
     @classification.setter
-    def classification(self, value:str) -> None:
-        if self.purpose == Purpose.Testing:
+    def classification(self, value:Optional[str]) -> None:
+        if self.purpose == Purpose.Testing or value is None:
             self._classification = value
         else:
             raise AttributeError(f"Training samples cannot be classified")
         
     @classmethod
-    def from_dict(cls, row: dict[str,str]) -> "KnownSample":
-        """Will build an instance of this class if it passes checks."""
-        sample = Sample.from_dict(row)
-        try:
-
-            return cls(
-                species = species.validate(sample.species),
-                sepal_length = sample.sepal_length,
-                sepal_width = sample.sepal_width,
-                petal_length = sample.petal_length,
-                petal_width = sample.petal_width,
-            )
-        except ValueError as ex:
-            raise InvalidSampleError(f"invalid {species!r}")
+    def from_dict(cls, row: dict[str,str], purpose:Optional[int]=None) -> "KnownSample":
+        """Will build an instance of this class if it passes checks (a one-row validate_rows()).
+        KnownSample itself needs the purpose; TrainingKnownSample and TestingKnownSample know theirs."""
+        if (cls is KnownSample) != (purpose is not None):
+            raise ValueError(f"{cls.__name__}.from_dict: purpose {'is required' if cls is KnownSample else 'is fixed'}")
+        checked = validate_rows([row])
+        if not checked.valid[0]:
+            raise checked.errors[0]
+        sepal_length, sepal_width, petal_length, petal_width = checked.measurements[0].tolist()
+        fixed = {} if purpose is None else {"purpose": purpose}
+        return cls(
+            **fixed,
+            species = checked.species[0],
+            sepal_length = sepal_length,
+            sepal_width = sepal_width,
+            petal_length = petal_length,
+            petal_width = petal_width,
+        )
         
-        #TODO keyerror, how to print which key is wrong
         #TODO handle extra keys
-        #TODO handle upper and lower bounds. 
         
 class TrainingKnownSample(KnownSample):
-    pass
+    def __init__(self, species:str, sepal_length:float, sepal_width:float, petal_length:float, petal_width:float) -> None:
+        super().__init__(
+            species=species,
+            purpose=Purpose.Training,
+            sepal_length=sepal_length,
+            sepal_width=sepal_width,
+            petal_length=petal_length,
+            petal_width=petal_width,
+        )
+
 class TestingKnownSample(KnownSample):
-    pass
+    def __init__(self, species:str, sepal_length:float, sepal_width:float, petal_length:float, petal_width:float) -> None:
+        super().__init__(
+            species=species,
+            purpose=Purpose.Testing,
+            sepal_length=sepal_length,
+            sepal_width=sepal_width,
+            petal_length=petal_length,
+            petal_width=petal_width,
+        )
         
 
+class SampleView:
+    """One row of a SampleStore, with the same attributes as a KnownSample.
+    Only holds the store and a row number, so views are cheap to hand out and throw away."""
+    __slots__ = ("store", "row")
+
+    def __init__(self, store:"SampleStore", row:int) -> None:
+        self.store = store
+        self.row = row
+
+    @property
+    def sepal_length(self) -> float:
+        return float(self.store.columns["sepal_length"][self.row])
+
+    @property
+    def sepal_width(self) -> float:
+        return float(self.store.columns["sepal_width"][self.row])
+
+    @property
+    def petal_length(self) -> float:
+        return float(self.store.columns["petal_length"][self.row])
+
+    @property
+    def petal_width(self) -> float:
+        return float(self.store.columns["petal_width"][self.row])
+
+    @property
+    def species(self) -> str:
+        return self.store.categories[self.store.species_codes[self.row]]
+
+    @property
+    def purpose(self) -> "Purpose":
+        return self.store.purpose
+
+    @property
+    def classification(self) -> Optional[str]:
+        if self.store.purpose != Purpose.Testing:
+            raise AttributeError(f"Training samples have no classification")
+        code = self.store.classification_codes[self.row]
+        return None if code == -1 else self.store.categories[code]
+
+    @classification.setter
+    def classification(self, value:Optional[str]) -> None:
+        if self.store.purpose != Purpose.Testing:
+            raise AttributeError(f"Training samples cannot be classified")
+        self.store.classification_codes[self.row] = -1 if value is None else self.store.code(value)
+
+    def classify(self, classification:str) -> None:
+        self.classification = classification
+
+    def matches(self) -> bool:
+        return self.species == self.classification
+
+    def __repr__(self) -> str:
+        return (f"{self.store.sample_class.__name__}("
+                f"sepal_length={self.sepal_length},"
+                f"sepal_width={self.sepal_width},"
+                f"petal_length={self.petal_length},"
+                f"petal_width={self.petal_width},"
+                f"species={self.species!r},"
+                f")"
+            )
+
+
+class SampleStore(Sequence[SampleView]):
+    """Columnar storage for the training or the testing samples.
+
+    Each measurement is one array('d') column and species is a small-int code into self.categories,
+    so a row costs 34 bytes instead of a KnownSample object with its own __dict__.
+    Indexing hands out SampleViews, which look like KnownSamples to Hyperparameter and the Distance classes."""
+    def __init__(self, purpose:"Purpose", samples:Iterable[Sample]=()) -> None:
+        self.purpose = Purpose(purpose)
+        self.sample_class = TestingKnownSample if self.purpose == Purpose.Testing else TrainingKnownSample
+        self.columns: Dict[str, Union[array, np.ndarray]] = {name: array("d") for name in feature_names}
+        self.categories: List[str] = sorted(species)
+        self._codes: Dict[str, int] = {name: code for code, name in enumerate(self.categories)}
+        self.species_codes: Union[array, np.ndarray] = array("b")
+        self.classification_codes: Union[array, np.ndarray] = array("b") #-1 means not classified yet
+        self._matrix: Optional[np.ndarray] = None #set when the columns are already one column-major block
+        self.extend(samples)
+
+    @classmethod
+    def from_buffers(
+            cls, purpose:"Purpose", matrix:np.ndarray, species_codes:np.ndarray, categories:List[str]
+    ) -> "SampleStore":
+        """A read-only store over existing numpy buffers, e.g. the memory-mapped columns of sample_file.py.
+        Nothing is copied: the columns are views of the column-major (n, 4) matrix."""
+        store = cls(purpose)
+        store.columns = {name: matrix[:, n] for n, name in enumerate(feature_names)}
+        store.categories = list(categories)
+        store._codes = {name: code for code, name in enumerate(store.categories)}
+        store.species_codes = species_codes
+        store.classification_codes = np.full(len(species_codes), -1, dtype=np.int8)
+        if matrix.dtype == np.float64 and matrix.flags.f_contiguous:
+            store._matrix = matrix
+        return store
+
+    @property
+    def readonly(self) -> bool:
+        return isinstance(self.species_codes, np.ndarray)
+
+    def code(self, name:str) -> int:
+        """The categorical code for a species name, adding a new category the first time it is seen."""
+        if name not in self._codes:
+            self._codes[name] = len(self.categories)
+            self.categories.append(name)
+        return self._codes[name]
+
+    def append(self, sample:Sample) -> None:
+        if self.readonly:
+            raise TypeError("SampleStore over numpy buffers is read-only")
+        for name, column in self.columns.items():
+            column.append(getattr(sample, name))
+        self.species_codes.append(self.code(sample.species))
+        self.classification_codes.append(-1)
+
+    def extend(self, samples:Iterable[Sample]) -> None:
+        for sample in samples:
+            self.append(sample)
+
+    def extend_rows(self, measurements:np.ndarray, names:Sequence[str]) -> None:
+        """Appends already validated rows, an (n, 4) matrix and their species, without making Sample objects."""
+        if self.readonly:
+            raise TypeError("SampleStore over numpy buffers is read-only")
+        for n, name in enumerate(feature_names):
+            self.columns[name].frombytes(np.ascontiguousarray(measurements[:, n], dtype=np.float64).tobytes())
+        self.species_codes.extend(self.code(name) for name in names)
+        self.classification_codes.frombytes(b"\xff" * len(names))
+
+    def clear(self) -> None:
+        if self.readonly:
+            raise TypeError("SampleStore over numpy buffers is read-only")
+        for column in self.columns.values():
+            del column[:]
+        del self.species_codes[:]
+        del self.classification_codes[:]
+
+    def __len__(self) -> int:
+        return len(self.species_codes)
+
+    def __iter__(self) -> Iterator[SampleView]:
+        return (SampleView(self, row) for row in range(len(self)))
+
+    @overload
+    def __getitem__(self, index:int) -> SampleView:
+        ...
+
+    @overload
+    def __getitem__(self, index:slice) -> List[SampleView]:
+        ...
+
+    def __getitem__(self, index:Union[int, slice]) -> Union[SampleView, List[SampleView]]:
+        if isinstance(index, slice):
+            return [SampleView(self, row) for row in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("SampleStore index out of range")
+        return SampleView(self, index)
+
+    def matrix(self) -> np.ndarray:
+        """The measurements as a column-major (n, 4) float64 matrix.
+        A store from from_buffers() hands back its own float64 block; otherwise each column is copied once."""
+        if self._matrix is not None:
+            return self._matrix
+        matrix = np.empty((len(self), len(feature_names)), order="F")
+        for n, name in enumerate(feature_names):
+            matrix[:, n] = self.columns[name]
+        return matrix
+
+    def packed(self) -> "PackedSamples":
+        if self.readonly:
+            codes = self.species_codes
+        else:
+            codes = np.array(self.species_codes, dtype=np.int8) #a copy: a view would stop the array from growing
+        return PackedSamples(self.matrix(), codes, list(self.categories))
+
+    @property
+    def nbytes(self) -> int:
+        arrays = [*self.columns.values(), self.species_codes, self.classification_codes]
+        return sum(a.itemsize * len(a) for a in arrays)
+
+
 @dataclass 
 class Hyperparameter:
     """A specific tuning parameter set with k and a distance algorithm."""
@@ -197,68 +489,334 @@ class Hyperparameter:
 
 
 
+def as_matrix(samples:Iterable[Sample]) -> np.ndarray:
+    """Packs the measurements of the samples into a contiguous (n, 4) float64 matrix, one row per sample."""
+    if isinstance(samples, SampleStore):
+        return samples.matrix()
+    matrix = np.array(
+        [[s.sepal_length, s.sepal_width, s.petal_length, s.petal_width] for s in samples],
+        dtype=np.float64,
+    )
+    return matrix.reshape(-1, len(feature_names))
+
+class PackedSamples(NamedTuple):
+    """Samples packed for the classifier: a column-major (n, 4) float64 matrix,
+    and each row's species as a small-int code into categories."""
+    matrix: np.ndarray
+    codes: np.ndarray
+    categories: List[str]
+
+    def vote(self, neighbors:np.ndarray) -> str:
+        """Majority vote over the species of these rows, nearest first."""
+        return self.categories[vote(self.codes[neighbors].tolist())]
+
+def pack(samples:Sequence[Sample]) -> PackedSamples:
+    if isinstance(samples, SampleStore):
+        return samples.packed()
+    lookup: Dict[str, int] = {}
+    codes = np.array([lookup.setdefault(s.species, len(lookup)) for s in samples], dtype=np.int32)
+    return PackedSamples(np.asfortranarray(as_matrix(samples)), codes, list(lookup))
+
+def species_codes(samples:Sequence[Sample], categories:List[str]) -> np.ndarray:
+    """Each sample's species as an index into categories, -1 when it isn't one of them."""
+    lookup = {name: code for code, name in enumerate(categories)}
+    if isinstance(samples, SampleStore):
+        translate = np.array([lookup.get(name, -1) for name in samples.categories], dtype=np.int32)
+        return translate[np.asarray(samples.species_codes, dtype=np.int8)]
+    return np.array([lookup.get(s.species, -1) for s in samples], dtype=np.int32)
+
+def vote(neighbors:Iterable[str]) -> str:
+    """Majority vote over the species of the neighbors, nearest first.
+    Counter keeps insertion order, so a tied vote goes to the species seen first (the nearer neighbor)."""
+    return Counter(neighbors).most_common(1)[0][0]
+
+def k_nn_naive(k:int, algorithm:Distance, training:Sequence[KnownSample], unknown:Sample) -> str:
+    """The reference k-NN: measure every training sample, sort by (distance, position), and vote.
+    The batch engine in Hyperparameter.classify_batch has to give exactly the same answers."""
+    metrics.count_distances(len(training))
+    distances = sorted(
+        (algorithm.distance(unknown, known), n) for n, known in enumerate(training)
+    )
+    return vote(training[n].species for _, n in distances[:k])
+
+
+# Process pool workers for TrainingData.tune(). The matrices live in shared memory:
+# each worker attaches to them once in _tune_init, instead of having them pickled into every task.
+SharedArray = Tuple[str, Tuple[int, ...], str] #shared memory name, shape, dtype
+
+def _share(values:np.ndarray) -> Tuple[SharedMemory, SharedArray]:
+    shm = SharedMemory(create=True, size=max(1, values.nbytes))
+    np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf, order="F")[...] = values
+    return shm, (shm.name, values.shape, values.dtype.str)
+
+def _attach(shared:SharedArray) -> Tuple[SharedMemory, np.ndarray]:
+    name, shape, dtype = shared
+    shm = SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf, order="F")
+
+_tune_state: Dict[str, Any] = {}
+
+def _tune_init(
+        index_factory:Callable[[np.ndarray, Distance], NeighborIndex],
+        training:SharedArray, training_codes:SharedArray, testing:SharedArray, testing_codes:SharedArray,
+) -> None:
+    attached = [_attach(shared) for shared in (training, training_codes, testing, testing_codes)]
+    _tune_state.update(
+        index_factory=index_factory,
+        shm=[shm for shm, _ in attached], #keep the segments open for the life of the worker
+        arrays=[values for _, values in attached],
+        indexes={},
+        cache=NeighborOrderCache(),
+    )
+
+def _tune_quality(k:int, algorithm:Distance) -> float:
+    """Quality of one (k, Distance) pair, as Hyperparameter.test computes it, voting on species codes."""
+    training, training_codes, testing, testing_codes = _tune_state["arrays"]
+    indexes: Dict[Type[Distance], NeighborIndex] = _tune_state["indexes"]
+    def search(depth:int) -> np.ndarray:
+        index = indexes.get(type(algorithm))
+        if index is None:
+            index = indexes[type(algorithm)] = _tune_state["index_factory"](training, algorithm)
+        return index.query(testing, depth)
+    nearest = _tune_state["cache"].nearest(type(algorithm), k, search)
+    pass_count = sum(
+        vote(training_codes[neighbors].tolist()) == expected
+        for neighbors, expected in zip(nearest, testing_codes.tolist())
+    )
+    return pass_count / len(testing_codes)
+
 class Hyperparameter:
-    """A hyperparameter value and the overall quality of the classification."""
-    def __init__(self, k:int, training:"TrainingData") -> None:
+    """A hyperparameter value and the overall quality of the classification.
+    With a recall target (0 < recall <= 1), classify() uses an approximate LSHIndex tuned to find that
+    fraction of the exact neighbors of the testing samples; test() always searches exactly.
+    With a PredictionCache, classify() answers repeated measurements from it (see prediction_cache.py)."""
+    def __init__(
+            self, k:int, algorithm:Distance, training:"TrainingData",
+            recall:Optional[float]=None, cache:Optional["PredictionCache"]=None,
+    ) -> None:
         self.k = k
+        self.algorithm = algorithm
+        self.recall = recall
+        self.cache = cache
         self.data: weakref.ReferenceType["TrainingData"] = weakref.ref(training)
         self.quality:float
 
-    def test(self) -> None:
-        """Run the entire test suite.
-        Creates a quality score and saves it to this Hyperparameter instance. """
+    def _training_data(self) -> "TrainingData":
         training_data: Optional["TrainingData"] = self.data()
         if not training_data:
             raise RuntimeError("Broken weak reference")
-        pass_count, fail_count = 0,0
-        for sample in training_data.testing:
-            sample.classification = self.classify(sample) #I dont understand where this classify() is coming from, what 'self' is calling it, and why it can pass in a "TrainingData" type
-            if sample.mathces():
-                pass_count += 1
-            else: 
-                fail_count += 1
-        self.quality = pass_count / (pass_count + fail_count)
-
-    def classify(self):
-        #TODO runs the nearest neighbors algorithm
-        pass
+        return training_data
 
+    def test(self) -> None:
+        """Run the entire test suite.
+        Creates a quality score and saves it to this Hyperparameter instance. """
+        training_data = self._training_data()
+        with metrics.stage("test", rows=len(training_data.testing)):
+            training = training_data.training_matrix()
+            if len(training.codes) == 0:
+                raise RuntimeError("No training data")
+            pass_count, fail_count = 0,0
+            nearest = training_data.testing_neighbors(self.algorithm, self.k) #shared with every other k for this Distance
+            for sample, neighbors in zip(training_data.testing, nearest):
+                sample.classification = training.vote(neighbors)
+                if sample.matches():
+                    pass_count += 1
+                else: 
+                    fail_count += 1
+            self.quality = pass_count / (pass_count + fail_count)
+
+    def classify(self, sample:Sample) -> str:
+        """The k-NN algorithm for a single sample."""
+        return self.classify_batch([sample])[0]
+
+    def classify_batch(self, samples:Sequence[Sample]) -> List[str]:
+        """The k-NN algorithm for a block of samples.
+        The neighbor search is done by the TrainingData's index for this Distance (see neighbor_index.py),
+        or its approximate index when this Hyperparameter has a recall target (see approximate.py)."""
+        if metrics.registry.enabled: #the hot path, so not even a do-nothing stage when disabled
+            with metrics.stage("classify", rows=len(samples)):
+                return self._classify(samples)
+        return self._classify(samples)
+
+    def _classify(self, samples:Sequence[Sample]) -> List[str]:
+        training_data = self._training_data()
+        training = training_data.training_matrix() #bumps training_data.version if the samples changed
+        if len(training.codes) == 0:
+            raise RuntimeError("No training data")
+        if self.cache is not None:
+            return self.cache.classify_batch(self, training_data.version, samples, self._search)
+        return self._search(samples)
+
+    def _search(self, samples:Sequence[Sample]) -> List[str]:
+        training_data = self._training_data()
+        training = training_data.training_matrix()
+        index: NeighborIndex
+        if self.recall is None:
+            index = training_data.neighbor_index(self.algorithm)
+        else:
+            index = training_data.approximate_index(self.algorithm, self.k, self.recall)
+        return [training.vote(nearest) for nearest in index.query(as_matrix(samples), self.k)]
 
-    
 
 class TrainingData:
     """
     A set of training data and testing data with methods to load and test the samples.
 
     Has lists with 2 subclasses of Sample objects: KnownSample and UnknownSample.
-    Also has a list with Hyperparameter instances. """
-
-    def __init__(self, name:str) -> None:
+    Also has a list with Hyperparameter instances.
+    The neighbor indexes are built by index_factory, once per Distance class, and thrown away by invalidate().
+    The testing samples' neighbors are kept in the NeighborOrderCache, keyed by fingerprint().
+    With incremental=True they are kept in NeighborHeaps instead, which add_training() updates
+    with only the new rows (see incremental.py). """
+    recall_sample = 1_000 #testing samples an approximate_index() is tuned on
+    load_block = 8_192 #rows validated at once by load()
+
+    def __init__(
+            self, name:str,
+            index_factory:Callable[[np.ndarray, Distance], NeighborIndex]=build_index,
+            cache:NeighborOrderCache=neighbor_cache,
+            incremental:bool=False,
+    ) -> None:
         self.name = name
+        self.index_factory = index_factory
+        self.neighbor_cache = cache
+        self.incremental = incremental
         self.uploaded: datetime.datetime
         self.tested: datetime.datetime
-        self.training: List[Sample] = []
-        self.testing: List[Sample] = []
+        self.training = SampleStore(Purpose.Training)
+        self.testing = SampleStore(Purpose.Testing)
         self.tuning: List[Hyperparameter] = []
+        self.version = 0 #bumped by invalidate() whenever the training data changes
+        self._training_matrix: Optional[PackedSamples] = None
+        self._testing_matrix: Optional[np.ndarray] = None
+        self._fingerprint: Optional[str] = None
+        self._indexes: Dict[Type[Distance], NeighborIndex] = {}
+        self._heaps: Dict[Type[Distance], NeighborHeaps] = {}
+        self._approximate: Dict[Tuple[Type[Distance], int, float], LSHIndex] = {}
 
     def load(self, raw_data_source: Iterable[dict[str,str]]) -> None:
         """Reads the raw data and partitions it into training and testing data, both instances of KnownSample."""
+        self.invalidate()
         bad_count = 0
-        for n, row in enumerate(raw_data_source):
-            try:
-                if n % 5 == 0:
-                    test = TestingKnownSample.from_dict(row)
-                    self.testing.append(test)
-                else:
-                    train = TrainingKnownSample.from_dict(row)
-                    self.training.append(train)
-            except InvalidSampleError as ex:
-                print(f"Row {n+1}: {ex}")
-                bad_count += 1
+        rows = iter(raw_data_source)
+        first = 0
+        with metrics.stage("load") as stage:
+            while block := list(itertools.islice(rows, self.load_block)):
+                checked = validate_rows(block)
+                for n, ex in checked.errors.items():
+                    print(f"Row {first+n+1}: {ex}")
+                bad_count += len(checked.errors)
+                testing = (np.arange(first, first + len(block)) % 5 == 0)
+                for store, chosen in ((self.testing, testing), (self.training, ~testing)):
+                    chosen = np.flatnonzero(chosen & checked.valid)
+                    store.extend_rows(checked.measurements[chosen], [checked.species[n] for n in chosen.tolist()])
+                first += len(block)
+            stage.add_rows(first)
         if bad_count != 0:
             print(f"{bad_count} invalid rows")
             return
-        self.uploaded = datetime.datetime.now(tz=datetime.timezone=utc)
+        self.uploaded = datetime.datetime.now(tz=datetime.timezone.utc)
+
+    def invalidate(self) -> None:
+        """Drops the packed matrix and the neighbor indexes. load() calls this;
+        call it yourself after changing self.training in place."""
+        self.version += 1
+        self._training_matrix = None
+        self._testing_matrix = None
+        self._fingerprint = None
+        self._indexes.clear()
+        self._heaps.clear()
+        self._approximate.clear()
+
+    def add_training(self, samples:Iterable[Sample]) -> None:
+        """Appends training samples without starting the testing samples' neighbor search over:
+        the NeighborHeaps of every Distance only measure the new rows, O(new x testing).
+        Call retest() afterwards to refresh the quality of self.tuning."""
+        new = list(samples)
+        first_row = len(self.training)
+        heaps = dict(self._heaps)
+        self.training.extend(new)
+        self.invalidate()
+        rows = as_matrix(new)
+        for distance, heap in heaps.items():
+            if heap.training_rows == first_row:
+                heap.add_training(rows)
+                self._heaps[distance] = heap
+
+    def retest(self) -> None:
+        """Tests every Hyperparameter in self.tuning again, e.g. after add_training()."""
+        for parameter in self.tuning:
+            parameter.test()
+        self.tested = datetime.datetime.now(tz=datetime.timezone.utc)
+
+    def training_matrix(self) -> PackedSamples:
+        """The training samples packed once into a column-major (n, 4) float64 matrix, plus their species codes.
+        Rebuilt on the next call after invalidate()."""
+        if self._training_matrix is not None and len(self._training_matrix.codes) != len(self.training):
+            self.invalidate() #the list was appended to or trimmed behind our back
+        if self._training_matrix is None:
+            self._training_matrix = pack(self.training)
+        return self._training_matrix
+
+    def testing_matrix(self) -> np.ndarray:
+        """The testing samples packed like training_matrix()."""
+        if self._testing_matrix is None or len(self._testing_matrix) != len(self.testing):
+            self._testing_matrix = np.asfortranarray(as_matrix(self.testing))
+            self._fingerprint = None
+        return self._testing_matrix
+
+    def fingerprint(self) -> str:
+        """A content hash of the training and testing measurements.
+        Two TrainingData objects with the same samples share neighbor_cache entries."""
+        training = self.training_matrix().matrix
+        testing = self.testing_matrix()
+        if self._fingerprint is None:
+            digest = hashlib.blake2b(digest_size=16)
+            for matrix in (training, testing):
+                digest.update(repr(matrix.shape).encode())
+                digest.update(matrix.tobytes(order="F"))
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    def testing_neighbors(self, algorithm:Distance, k:int) -> np.ndarray:
+        """The k nearest training rows of every testing sample, (testing, k), nearest first."""
+        testing = self.testing_matrix()
+        if self.incremental:
+            heaps = self._heaps.get(type(algorithm))
+            if (heaps is None or heaps.depth < k or len(heaps.testing) != len(testing)
+                    or heaps.training_rows != len(self.training)):
+                heaps = NeighborHeaps(algorithm, testing, max(k, self.neighbor_cache.depth))
+                heaps.add_training(self.training_matrix().matrix)
+                self._heaps[type(algorithm)] = heaps
+            return heaps.nearest(k)
+        return self.neighbor_cache.nearest(
+            (self.fingerprint(), type(algorithm)), k,
+            lambda depth: self.neighbor_index(algorithm).query(testing, depth),
+        )
+
+    def neighbor_index(self, algorithm:Distance) -> NeighborIndex:
+        """The neighbor index for this Distance, built on first use after a load."""
+        matrix = self.training_matrix().matrix
+        index = self._indexes.get(type(algorithm))
+        if index is None:
+            index = self._indexes[type(algorithm)] = self.index_factory(matrix, algorithm)
+        return index
+
+    def approximate_index(self, algorithm:Distance, k:int, recall:float) -> LSHIndex:
+        """An LSHIndex tuned until it finds at least this fraction of the testing samples' exact k nearest
+        neighbors. Recall is measured on up to recall_sample evenly spaced testing samples; it is kept in .recall,
+        and can fall short of the target when LSHIndex.tune reaches max_tables."""
+        key = (type(algorithm), k, recall)
+        index = self._approximate.get(key)
+        if index is None:
+            testing = self.testing_matrix()
+            sample = np.linspace(0, len(testing), min(len(testing), self.recall_sample), endpoint=False).astype(np.intp)
+            queries = testing[sample]
+            index = self._approximate[key] = LSHIndex.tune(
+                self.training_matrix().matrix, algorithm,
+                queries, self.neighbor_index(algorithm).query(queries, k), recall,
+            )
+        return index
 
     def test(self, parameter: Hyperparameter) -> None:
         """Test this Hyperparameter value"""
@@ -266,12 +824,53 @@ class TrainingData:
         self.tuning.append(parameter) #Stores the tested Hyperparameters into this list, so we can see how each parameter performed. 
         self.tested = datetime.datetime.now(tz=datetime.timezone.utc)
 
+    def tune(self, grid:Iterable[Tuple[int, Distance]], workers:Optional[int]=None) -> None:
+        """Test every (k, Distance) pair of the grid on a pool of worker processes.
+        EX: data.tune(itertools.product(range(1, 51), [ED(), MD(), CD(), SD()]), workers=8)
+
+        The training and testing matrices are put in shared memory once and every worker attaches to them.
+        Quality scores are collected as the workers finish, but the new Hyperparameters are appended
+        to self.tuning in grid order, so the result doesn't depend on scheduling.
+        Unlike test(), the testing samples' classification isn't updated."""
+        parameters = [Hyperparameter(k, algorithm, self) for k, algorithm in grid]
+        if not parameters:
+            return
+        training = self.training_matrix()
+        if len(training.codes) == 0 or len(self.testing) == 0:
+            raise RuntimeError("No training or testing data")
+        testing_codes = species_codes(self.testing, training.categories)
+        shared = [
+            _share(values)
+            for values in (training.matrix, training.codes, self.testing_matrix(), testing_codes)
+        ]
+        try:
+            with ProcessPoolExecutor(
+                max_workers=workers or os.cpu_count(),
+                initializer=_tune_init,
+                initargs=(self.index_factory, *(descriptor for _, descriptor in shared)),
+            ) as pool:
+                futures = {pool.submit(_tune_quality, p.k, p.algorithm): p for p in parameters}
+                for future in as_completed(futures):
+                    futures[future].quality = future.result()
+        finally:
+            for shm, _ in shared:
+                shm.close()
+                shm.unlink()
+        self.tuning.extend(parameters)
+        self.tested = datetime.datetime.now(tz=datetime.timezone.utc)
+
     def classify(self, parameter:Hyperparameter, sample:Sample) -> Sample:
         """Classify this sample"""
         classification = parameter.classify(sample) #yet to be defined
         sample.classify(classification) # simply stores the result of Hyperparameter's classify into the sample's attribute. This is a setter mthod. 
         return sample #PARAMETER.CLASSIFY IS BEING RUN TWICE. why don't we do sample.classify(classification) in the Hyperparameter.test()???????
 
+    def classify_batch(self, parameter:Hyperparameter, samples:Sequence[Sample]) -> Sequence[Sample]:
+        """classify() for a block of samples, with one neighbor search for all of them."""
+        for sample, classification in zip(samples, parameter.classify_batch(samples)):
+            sample.classify(classification)
+        return samples
+
 
 
 
@@ -0,0 +1,123 @@
+"""An asyncio front end that coalesces concurrent TrainingData.classify calls into micro-batches.
+
+    async with ClassifyService(data, parameter) as service:
+        sample = await service.classify(UnknownSample(5.1, 3.5, 1.4, 0.2))
+
+Callers wait on a bounded queue. One batcher task takes up to max_batch waiting samples, or as many as
+arrived within max_wait seconds of the first one, and runs TrainingData.classify_batch on a worker
+thread (the numpy kernels release the GIL). While a batch runs, the next one collects in the queue.
+When the queue is full, classify() waits for room: that is the backpressure."""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from classes import Hyperparameter, Sample, TrainingData
+
+Request = Tuple[Sample, "asyncio.Future[Sample]"]
+
+
+class ClassifyService:
+    """Micro-batching classifier for one Hyperparameter of a TrainingData."""
+    def __init__(
+            self, data:TrainingData, parameter:Hyperparameter,
+            max_batch:int=256, max_wait:float=0.002, max_queue:int=4096,
+    ) -> None:
+        self.data = data
+        self.parameter = parameter
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.batches = 0
+        self.classified = 0
+        self.max_depth = 0
+        self._queue: Optional["asyncio.Queue[Request]"] = None
+        self._batcher: Optional["asyncio.Task[None]"] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue(self.max_queue)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="classify")
+        self._batcher = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Finishes the queued requests, then stops the batcher and the worker thread."""
+        if self._queue is None or self._batcher is None or self._executor is None:
+            return
+        await self._queue.join()
+        self._batcher.cancel()
+        try:
+            await self._batcher
+        except asyncio.CancelledError:
+            pass
+        self._executor.shutdown()
+        self._queue = self._batcher = self._executor = None
+
+    async def __aenter__(self) -> "ClassifyService":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        await self.stop()
+
+    async def classify(self, sample:Sample) -> Sample:
+        """Classifies the sample, like TrainingData.classify, as part of the next micro-batch."""
+        if self._queue is None:
+            raise RuntimeError("ClassifyService is not started")
+        future: "asyncio.Future[Sample]" = asyncio.get_running_loop().create_future()
+        await self._queue.put((sample, future)) #waits while the queue is full
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+        return await future
+
+    @property
+    def queue_depth(self) -> int:
+        """Requests waiting for a batch."""
+        return 0 if self._queue is None else self._queue.qsize()
+
+    def stats(self) -> Dict[str, float]:
+        """Counters for monitoring."""
+        return {
+            "queue_depth": self.queue_depth,
+            "max_depth": self.max_depth,
+            "batches": self.batches,
+            "classified": self.classified,
+            "mean_batch": self.classified / self.batches if self.batches else 0.0,
+        }
+
+    async def _collect(self, queue:"asyncio.Queue[Request]") -> List[Request]:
+        loop = asyncio.get_running_loop()
+        batch = [await queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            if queue.empty():
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            else:
+                batch.append(queue.get_nowait())
+        return batch
+
+    async def _run(self) -> None:
+        assert self._queue is not None
+        queue = self._queue
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect(queue)
+            samples = [sample for sample, _ in batch]
+            try:
+                await loop.run_in_executor(self._executor, self.data.classify_batch, self.parameter, samples)
+            except Exception as ex:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(ex)
+            else:
+                for sample, future in batch:
+                    if not future.done(): #the caller may have been cancelled
+                        future.set_result(sample)
+            self.batches += 1
+            self.classified += len(batch)
+            for _ in batch:
+                queue.task_done()
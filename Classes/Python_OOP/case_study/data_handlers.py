@@ -1,3 +1,61 @@
+from __future__ import annotations
+import abc
+import csv
+import hashlib
+import itertools
+import struct
+from dataclasses import dataclass
+from pathlib import Path
+from typing import (
+    Any, Callable, Iterable, Iterator, List, NoReturn, Optional, Protocol, SupportsIndex, Tuple, Type, TypedDict, TypeVar, overload
+)
+
+import numpy as np
+
+import metrics
+from classes import KnownSample, Sample, TestingKnownSample, TrainingKnownSample
+from exceptions import BadSampleRow
+
+TrainingList = List[TrainingKnownSample]
+TestingList = List[TestingKnownSample]
+T = TypeVar("T", contravariant=True)
+K = TypeVar("K", bound=KnownSample)
+
+class Sink(Protocol[T]):
+    def append(self, item:T) -> None:
+        ...
+
+def as_sample(cls:Type[K], s:KnownSample) -> K:
+    """Rebuilds a KnownSample as a TrainingKnownSample or TestingKnownSample."""
+    return cls(
+        species=s.species,
+        sepal_length=s.sepal_length,
+        sepal_width=s.sepal_width,
+        petal_length=s.petal_length,
+        petal_width=s.petal_width,
+    )
+
+class SampleDict(TypedDict):
+    sepal_length: float
+    sepal_width: float
+    petal_length: float
+    petal_width: float
+    species: str
+
+
+@dataclass(frozen=True)
+class SampleBatch:
+    """A chunk of rows from SampleReader.batch_iter.
+    measurements is a column-major (n, 4) float64 matrix, so each measurement column is contiguous.
+    species is None when the file only has the four measurement columns."""
+    first_line: int
+    measurements: np.ndarray
+    species: Optional[List[str]]
+
+    def __len__(self) -> int:
+        return len(self.measurements)
+
+
 
 
 
@@ -10,25 +68,69 @@ class SampleReader:
         "sepal_length", "sepal_width", 
         "petal_length", "petal_width"
     ]
+    chunk_size = 65_536
 
     def __init__(self, source:Path) -> None:
         self.source = source
-    
+
+    def batch_iter(self, chunk_size:Optional[int]=None) -> Iterator[SampleBatch]:
+        """Reads the file chunk_size lines at a time. np.loadtxt's C parser converts a whole chunk of
+        measurements at once, so there is no dict and no Sample per row, and memory is bounded by
+        the chunk size, not the file size."""
+        chunk_size = chunk_size or self.chunk_size
+        with self.source.open() as source_file:
+            first_line = 1
+            while True:
+                lines = list(itertools.islice(source_file, chunk_size))
+                if not lines:
+                    return
+                batch = self._parse_chunk(first_line, lines)
+                first_line += len(lines)
+                if len(batch):
+                    yield batch
+
+    def _parse_chunk(self, first_line:int, lines:List[str]) -> SampleBatch:
+        width = len(self.header)
+        rows = [line for line in lines if not line.isspace()] #the blank lines at the end of bezdekIris.data
+        if not rows:
+            return SampleBatch(first_line, np.empty((0, width), order="F"), None)
+        if len({line.count(",") for line in rows}) > 1: #every row needs a species, or none does
+            self._raise_bad_row(first_line, list(csv.reader(lines)))
+        try:
+            measurements = np.loadtxt(rows, delimiter=",", usecols=range(width), ndmin=2, comments=None)
+        except ValueError:
+            self._raise_bad_row(first_line, list(csv.reader(lines)))
+        species = None
+        if rows[0].count(",") >= width:
+            species = [line.split(",", width + 1)[width].strip() for line in rows]
+        return SampleBatch(first_line, np.asfortranarray(measurements), species)
+
+    def _raise_bad_row(self, first_line:int, chunk:List[List[str]]) -> NoReturn:
+        """Finds the first bad row of a chunk that failed to convert, the slow way, to report its line number."""
+        width = next(len(row) for row in chunk if row)
+        for line, row in enumerate(chunk, start=first_line):
+            if not row:
+                continue
+            try:
+                if len(row) != width or len(row) < len(self.header):
+                    raise ValueError(f"expected {max(width, len(self.header))} columns")
+                for field in row[: len(self.header)]:
+                    float(field)
+            except ValueError as ex: #if the float raises the valueError, we map it to BadSampleError to distinguish from other parts in the code.
+                raise BadSampleRow(f"Line {line}: invalid {row!r}") from ex
+        raise BadSampleRow(f"Invalid rows in lines {first_line}-{first_line + len(chunk) - 1}")
+
     def sample_iter(self) -> Iterator[Sample]:
+        """One target_class object per row, built from batch_iter's columns."""
         target_class = self.target_class
-        with self.source.open() as source_file:
-            reader = csv.DictReader(source_file, self.header)
-            for row in header:
-                try:
-                    sample = target_class(
-                        sepal_length=float(row["sepal_length"]),
-                        sepal_width=float(row["sepal_width"]),
-                        petal_length=float(row["petal_length"]),
-                        petal_width=float(row["petal_width"]),
-                    )
-                except ValueError as ex: #if the float raises the valueError, we map it to BadSampleError to distinguish from other parts in the code.
-                    raise BadSampleRow(f"Invalid {row!r}") from ex
-                yield sample
+        for batch in self.batch_iter():
+            for sepal_length, sepal_width, petal_length, petal_width in batch.measurements.tolist():
+                yield target_class(
+                    sepal_length=sepal_length,
+                    sepal_width=sepal_width,
+                    petal_length=petal_length,
+                    petal_width=petal_width,
+                )
 
 
 class SamplePartition(List[SampleDict], abc.ABC):
@@ -50,49 +152,104 @@ class SamplePartition(List[SampleDict], abc.ABC):
         if iterable:
             super().__init__(iterable)
         else:
-            super().__init__
+            super().__init__()
 
-    @abc.abstractproperty
     @property
+    @abc.abstractmethod
     def training(self) -> List[TrainingKnownSample]:
         ...
 
-    @abc.abstractmethod
     @property
+    @abc.abstractmethod
     def testing(self) -> List[TestingKnownSample]:
         ...
 
-class SampleDict(TypedDict):
-    sepal_length: float
-    sepal_width: float
-    petal_length: float
-    petal_width: float
-    species: str
-
-
 import random
 
 
 class ShufflingSamplePartition(SamplePartition):
-    """separating the training and testing data by shuffling and then cutting."""
+    """separating the training and testing data by shuffling and then cutting.
+    The lists are built once, on first use, and kept until the list changes: every mutating list
+    method below forgets them."""
     def __init__(self, iterable:Optional[Iterable[SampleDict]]=None, *, training_subset:float=0.80) -> None:
         super().__init__(iterable, training_subset=training_subset)
         self.split: Optional[int] = None
+        self._training: Optional[List[TrainingKnownSample]] = None
+        self._testing: Optional[List[TestingKnownSample]] = None
 
     def _shuffle(self) -> None:
         if not self.split:
-            random.shuffle(self)
+            items = list(self)
+            random.shuffle(items)
+            super().__setitem__(slice(None), items) #not self[:] = items, which would forget the lists
             self.split = int(len(self) * self.training_subset)
 
+    def _changed(self) -> None:
+        self.split, self._training, self._testing = None, None, None
+
+    def append(self, item:SampleDict) -> None:
+        super().append(item)
+        self._changed()
+
+    def extend(self, items:Iterable[SampleDict]) -> None:
+        super().extend(items)
+        self._changed()
+
+    def __iadd__(self, items:Iterable[SampleDict]) -> "ShufflingSamplePartition": # type: ignore[override]
+        self.extend(items)
+        return self
+
+    def __imul__(self, n:int) -> "ShufflingSamplePartition": # type: ignore[override]
+        super().__imul__(n)
+        self._changed()
+        return self
+
+    def insert(self, index:SupportsIndex, item:SampleDict) -> None:
+        super().insert(index, item)
+        self._changed()
+
+    def __setitem__(self, index:Any, value:Any) -> None:
+        super().__setitem__(index, value)
+        self._changed()
+
+    def __delitem__(self, index:Any) -> None:
+        super().__delitem__(index)
+        self._changed()
+
+    def pop(self, index:SupportsIndex=-1) -> SampleDict:
+        item = super().pop(index)
+        self._changed()
+        return item
+
+    def remove(self, item:SampleDict) -> None:
+        super().remove(item)
+        self._changed()
+
+    def clear(self) -> None:
+        super().clear()
+        self._changed()
+
+    def sort(self, *args:Any, **kwargs:Any) -> None:
+        super().sort(*args, **kwargs)
+        self._changed()
+
+    def reverse(self) -> None:
+        super().reverse()
+        self._changed()
+
     @property
     def training(self) -> List[TrainingKnownSample]:
-        self.shuffle()
-        return [TrainingKnownSample(**sd) for sd in self[: self.split]]
+        if self._training is None:
+            self._shuffle()
+            self._training = [TrainingKnownSample(**sd) for sd in self[: self.split]]
+        return self._training
     
     @property
     def testing(self) -> List[TestingKnownSample]:
-        self.shuffle()
-        return [TestingKnownSample(**sd) for sd in self[self.split :]]
+        if self._testing is None:
+            self._shuffle()
+            self._testing = [TestingKnownSample(**sd) for sd in self[self.split :]]
+        return self._testing
     
 
 
@@ -152,6 +309,100 @@ class CountingDealingPartition(DealingPartition):
 
 
 
+class ReservoirDealingPartition(DealingPartition):
+    """Deals a random testing set of exactly testing_size rows out of a stream of any length, in one pass.
+
+    The testing rows are a reservoir sample (Algorithm R): row i replaces a random reservoir slot with
+    probability testing_size / (i + 1), and whatever it pushes out goes straight to training.
+    Only the reservoir is held back, so memory for the testing side is bounded by testing_size
+    no matter how big the input is. A seed makes the deal repeatable."""
+    def __init__(self, items:Optional[Iterable[SampleDict]], *, testing_size:int, seed:Optional[int]=None) -> None:
+        self.testing_size = testing_size
+        self.counter = 0
+        self._random = random.Random(seed)
+        self._reservoir: List[SampleDict] = []
+        self._training: List[TrainingKnownSample] = []
+        self._testing: Optional[List[TestingKnownSample]] = None
+        if items:
+            self.extend(items)
+
+    def extend(self, items:Iterable[SampleDict]) -> None:
+        for item in items:
+            self.append(item)
+
+    def append(self, item:SampleDict) -> None:
+        if self.counter < self.testing_size:
+            self._reservoir.append(item)
+            self._testing = None
+        else:
+            slot = self._random.randrange(self.counter + 1)
+            if slot < self.testing_size:
+                item, self._reservoir[slot] = self._reservoir[slot], item
+                self._testing = None
+            self._training.append(TrainingKnownSample(**item))
+        self.counter += 1
+
+    @property
+    def training(self) -> List[TrainingKnownSample]:
+        return self._training
+
+    @property
+    def testing(self) -> List[TestingKnownSample]:
+        if self._testing is None:
+            self._testing = [TestingKnownSample(**item) for item in self._reservoir]
+        return self._testing
+
+
+def content_hash(species:str, sepal_length:float, sepal_width:float, petal_length:float, petal_width:float) -> int:
+    """A 64 bit hash of a row's contents. Unlike hash(), it is the same in every process and on every run."""
+    key = struct.pack("<4d", sepal_length, sepal_width, petal_length, petal_width) + species.encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+
+class HashingDealingPartition(DealingPartition):
+    """Deals each row by a hash of its contents, not by its position in the stream.
+
+    A row with hash h goes to training when h % d < n, so the split doesn't depend on arrival order:
+    append() is O(1), a row never moves once dealt, and the same row (or a duplicate) always lands
+    on the same side, whatever order the days' files arrive in.
+    The lists only grow, so new_testing() can hand back just the testing rows added since the last
+    call; as long as training hasn't changed, those are the only ones that need classifying."""
+    def __init__(self, items:Optional[Iterable[SampleDict]], *, training_subset:Tuple[int, int]=(8, 10)) -> None:
+        self.training_subset = training_subset
+        self.counter = 0
+        self._training: List[TrainingKnownSample] = []
+        self._testing: List[TestingKnownSample] = []
+        self._reported = 0
+        if items:
+            self.extend(items)
+
+    def extend(self, items:Iterable[SampleDict]) -> None:
+        for item in items:
+            self.append(item)
+
+    def append(self, item:SampleDict) -> None:
+        n, d = self.training_subset
+        if content_hash(**item) % d < n:
+            self._training.append(TrainingKnownSample(**item))
+        else:
+            self._testing.append(TestingKnownSample(**item))
+        self.counter += 1
+
+    def new_testing(self) -> List[TestingKnownSample]:
+        """The testing rows appended since the previous call."""
+        new = self._testing[self._reported :]
+        self._reported = len(self._testing)
+        return new
+
+    @property
+    def training(self) -> List[TrainingKnownSample]:
+        return self._training
+
+    @property
+    def testing(self) -> List[TestingKnownSample]:
+        return self._testing
+
+
 # Yet another way, using a higher-order function:
 def training_80(s:KnownSample, i:int) -> bool:
     return i % 5 != 0
@@ -162,10 +413,31 @@ def training_75(s:KnownSample, i:int) -> bool:
 def training_67(s:KnownSample, i:int) -> bool:
     return i % 3 != 0
 
+def training_hashed_80(s:KnownSample, i:int) -> bool:
+    """Like training_80, but by content (see HashingDealingPartition), so it ignores i."""
+    return content_hash(s.species, s.sepal_length, s.sepal_width, s.petal_length, s.petal_width) % 5 != 0
+
+def partition_stream(
+        samples:Iterable[KnownSample], rule:Callable[[KnownSample, int], bool],
+        training:Sink[TrainingKnownSample], testing:Sink[TestingKnownSample],
+) -> None:
+    """The one-pass partition: each sample is routed to the training or the testing sink as it arrives,
+    so nothing is buffered and the input can be a generator. A sink is anything with append(),
+    e.g. a list or a classes.SampleStore."""
+    with metrics.stage("partition") as stage:
+        i = -1
+        for i, s in enumerate(samples):
+            if rule(s, i):
+                training.append(as_sample(TrainingKnownSample, s))
+            else:
+                testing.append(as_sample(TestingKnownSample, s))
+        stage.add_rows(i + 1)
+
 def partition(samples:Iterable[KnownSample], rule:Callable[[KnownSample, int], bool]) -> Tuple[TrainingList, TestingList]:
-    """this implementation is nice and succinct, however, it passes through the data twice. """
-    training_samples = [TrainingKnownSample(s) for i, s in enumerate(samples) if rule(s, i)]
-    test_samples = [TestingKnownSample(s) for i, s in enumerate(samples) if not rule(s, i)]
+    """this implementation is nice and succinct. It used to pass through the data twice; it's partition_stream now."""
+    training_samples: TrainingList = []
+    test_samples: TestingList = []
+    partition_stream(samples, rule, training_samples, test_samples)
     return training_samples, test_samples
 
 def partition_1(samples:Iterable[KnownSample], rule:Callable[[KnownSample, int], bool]) -> Tuple[TrainingList, TestingList]:
@@ -176,24 +448,18 @@ def partition_1(samples:Iterable[KnownSample], rule:Callable[[KnownSample, int],
     for i, s in enumerate(samples):
         training_use = rule(s, i)
         if training_use:
-            training.append(TrainingKnownSample(s))
+            training.append(as_sample(TrainingKnownSample, s))
         else:
-            testing.append(TestingKnownSample(s))
+            testing.append(as_sample(TestingKnownSample, s))
 
     return training, testing
 
 def partition_1p(samples:Iterable[KnownSample], rule:Callable[[KnownSample, int], bool]) -> Tuple[TrainingList, TestingList]:
     """I don't quite fully understand how the previous versions could potentially cause duplicate values.
     This one still would not garauntee no duplicates I guess. This algo will be revised further in Ch. 10, the Iterator Pattern.
-    This partition algorithm should be integrated with the SampleReader class."""
-    pools: defaultdict[bool, list[KnownSample]] = defaultdict(list)
-    partition = ((rule(s, i), s) for i, s in enumerate(samples))
-    for usage_pool, sample in partition:
-        pools[usage_pool].append(sample)
-
-    training = [TrainingKnownSample(s) for s in pools[True]]
-    testing = [TestingKnownSample(s) for s in pools[False]]
+    This partition algorithm should be integrated with the SampleReader class.
+    It used to collect defaultdict pools and convert them afterwards; partition_stream routes each sample directly."""
+    training: TrainingList = []
+    testing: TestingList = []
+    partition_stream(samples, rule, training, testing)
     return training, testing
-
-
-
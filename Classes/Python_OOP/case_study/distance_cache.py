@@ -0,0 +1,71 @@
+"""A cache of the testing samples' neighbor orderings, shared by every Hyperparameter that uses the same Distance.
+
+Only k changes between the Hyperparameters of a sweep, and the k nearest are a prefix of the K nearest
+(they are ordered by (distance, position)), so one neighbor search to depth K answers every k <= K."""
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Tuple
+
+import numpy as np
+
+
+class NeighborOrderCache:
+    """LRU cache of (testing samples, depth) neighbor index arrays, bounded by their total size in bytes."""
+    depth = 64 #the first search for a key goes at least this deep, so a k=1..64 sweep is one search
+
+    def __init__(self, max_bytes:int=256 * 1024 * 1024) -> None:
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, Tuple[int, np.ndarray]]" = OrderedDict() #key: (depth searched, nearest)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def nearest(self, key:Hashable, k:int, search:Callable[[int], np.ndarray]) -> np.ndarray:
+        """The (testing, k) nearest neighbor indices for this key.
+        search(depth) does the real neighbor search; it is only called on a miss, or when k is deeper
+        than the cached ordering, which then at least doubles."""
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] >= k:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[1][:, :k]
+        self.misses += 1
+        depth = max(k, self.depth if entry is None else 2 * entry[0])
+        found = search(depth) #fewer than depth columns when there are fewer training samples
+        if found.size and found.max() < np.iinfo(np.int32).max:
+            found = found.astype(np.int32) #half the bytes of intp
+        self._store(key, depth, found)
+        return found[:, :k]
+
+    def _store(self, key:Hashable, depth:int, found:np.ndarray) -> None:
+        if key in self._entries:
+            self.nbytes -= self._entries.pop(key)[1].nbytes
+        if found.nbytes > self.max_bytes:
+            return #would evict everything and still not fit
+        self._entries[key] = (depth, found)
+        self.nbytes += found.nbytes
+        while self.nbytes > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.nbytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        """Counters for monitoring."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+neighbor_cache = NeighborOrderCache() #the default cache, shared by every TrainingData
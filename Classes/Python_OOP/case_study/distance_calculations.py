@@ -1,46 +1,102 @@
-from math import hypot
+from __future__ import annotations
+from math import inf, sqrt
+from typing import TYPE_CHECKING, Optional
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from classes import Sample
 
 class Distance:
     """Definition of a distance computation"""
+    p: Optional[float] = None #Minkowski exponent, None when the distance isn't one (no KD-tree)
+
     def distance(self, s1:Sample, s2:Sample) -> float:
         pass
 
+    def pairwise(self, A:np.ndarray, B:np.ndarray) -> np.ndarray:
+        """Distances between every row of A and every row of B, both (n, 4) measurement matrices.
+        Returns a (len(A), len(B)) array. Each feature column is broadcast one at a time,
+        so the temporaries stay the size of the result. B is read a column at a time,
+        so a column-major (Fortran-order) B is fastest."""
+        raise NotImplementedError
+
+    def one_to_many(self, x:np.ndarray, B:np.ndarray) -> np.ndarray:
+        """Distances from one measurement vector x (4 floats) to every row of B, a (len(B),) array."""
+        return self.pairwise(np.asarray(x, dtype=float).reshape(1, -1), B)[0]
+
 
 class ED(Distance):
     """Euclidean distance."""
+    p = 2
+
     def distance(self, s1:Sample, s2:Sample) -> float:
-        return hypot(
+        #the squares are summed in column order, like pairwise, so both round the same way:
+        #hypot is more accurate but its last bit differs, which reorders the ties in 0.1cm data
+        total = 0.0
+        for d in (
             s1.sepal_length - s2.sepal_length,
             s1.sepal_width - s2.sepal_width,
             s1.petal_length - s2.petal_length,
             s1.petal_width - s2.petal_width,
-        )
-    
+        ):
+            total += d * d
+        return sqrt(total)
+
+    def pairwise(self, A:np.ndarray, B:np.ndarray) -> np.ndarray:
+        total = np.zeros((len(A), len(B)))
+        diff = np.empty_like(total)
+        for column in range(A.shape[1]):
+            np.subtract(A[:, column, None], B[:, column], out=diff)
+            np.multiply(diff, diff, out=diff)
+            total += diff
+        return np.sqrt(total, out=total)
+
 class MD(Distance):
     """Manhattan distance. Sums the total distance between all points."""
+    p = 1
+
     def distance(self, s1:Sample, s2:Sample) -> float:
         return sum(
             [
                 abs(s1.sepal_length - s2.sepal_length),
                 abs(s1.sepal_width - s2.sepal_width),
                 abs(s1.petal_length - s2.petal_length),
-                abs(s1.petal_wdith - s2.petal_width),
+                abs(s1.petal_width - s2.petal_width),
             ]
         )
-    
+
+    def pairwise(self, A:np.ndarray, B:np.ndarray) -> np.ndarray:
+        total = np.zeros((len(A), len(B)))
+        diff = np.empty_like(total)
+        for column in range(A.shape[1]):
+            np.subtract(A[:, column, None], B[:, column], out=diff)
+            total += np.abs(diff, out=diff)
+        return total
+
 class CD(Distance):
-    """Chebyshev distance. Minimizes the effects of multiple dimensions. 
+    """Chebyshev distance. Minimizes the effects of multiple dimensions.
     Emphasizes neighbors that are closer to each other."""
+    p = inf
+
     def distance(self, s1:Sample, s2:Sample) -> float:
         return max(
             [
                 abs(s1.sepal_length - s2.sepal_length),
                 abs(s1.sepal_width - s2.sepal_width),
                 abs(s1.petal_length - s2.petal_length),
-                abs(s1.petal_wdith - s2.petal_width),
+                abs(s1.petal_width - s2.petal_width),
             ]
         )
-    
+
+    def pairwise(self, A:np.ndarray, B:np.ndarray) -> np.ndarray:
+        total = np.zeros((len(A), len(B)))
+        diff = np.empty_like(total)
+        for column in range(A.shape[1]):
+            np.subtract(A[:, column, None], B[:, column], out=diff)
+            np.maximum(total, np.abs(diff, out=diff), out=total)
+        return total
+
 class SD(Distance):
     """Sorensen (aka Bray-Curtis) distance. Reduces the importance of measures that are further away from the origin."""
     def distance(self, s1:Sample, s2:Sample) -> float:
@@ -49,13 +105,24 @@ class SD(Distance):
                 abs(s1.sepal_length - s2.sepal_length),
                 abs(s1.sepal_width - s2.sepal_width),
                 abs(s1.petal_length - s2.petal_length),
-                abs(s1.petal_wdith - s2.petal_width),
+                abs(s1.petal_width - s2.petal_width),
             ]
         ) / sum(
-            s1.sepal_length + s2.sepal_length,
-            s1.sepal_width + s2.sepal_width,
-            s1.petal_length + s2.petal_length,
-            s1.petal_width + s2.petal_width,
+            [
+                s1.sepal_length + s2.sepal_length,
+                s1.sepal_width + s2.sepal_width,
+                s1.petal_length + s2.petal_length,
+                s1.petal_width + s2.petal_width,
+            ]
         )
 
-        )
\ No newline at end of file
+    def pairwise(self, A:np.ndarray, B:np.ndarray) -> np.ndarray:
+        numerator = np.zeros((len(A), len(B)))
+        denominator = np.zeros_like(numerator)
+        diff = np.empty_like(numerator)
+        for column in range(A.shape[1]):
+            np.subtract(A[:, column, None], B[:, column], out=diff)
+            numerator += np.abs(diff, out=diff)
+            np.add(A[:, column, None], B[:, column], out=diff)
+            denominator += diff
+        return np.divide(numerator, denominator, out=numerator)
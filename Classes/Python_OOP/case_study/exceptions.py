@@ -1,7 +1,7 @@
 class InvalidSampleError(ValueError):
     """Source data file has invalid data representation"""
 
-class OutlierError(ValueError):
+class OutlierError(InvalidSampleError):
     """Value lies outside the expected range."""
 
 class BadSampleRow(ValueError):
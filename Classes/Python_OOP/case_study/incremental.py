@@ -0,0 +1,51 @@
+"""Neighbor heaps that are updated, not recomputed, when training rows are appended.
+
+TrainingData(incremental=True) keeps one NeighborHeaps per Distance class. After add_training(),
+only the new rows are measured against the testing samples, so refreshing every Hyperparameter's
+quality costs O(new x testing) distance evaluations instead of O(training x testing)."""
+import numpy as np
+
+import metrics
+from distance_calculations import Distance
+from neighbor_index import k_nearest
+
+
+class NeighborHeaps:
+    """The depth nearest training rows of every testing sample, with their distances, ordered by (distance, row).
+    The first add_training() call is the full computation; each later call merges in rows numbered from
+    training_rows on. New rows always have higher numbers than the old ones, so ties merge exactly as a
+    full recomputation would break them."""
+    block_cells = 1 << 22 #upper bound on a (testing x new rows) distance block
+
+    def __init__(self, algorithm:Distance, testing:np.ndarray, depth:int) -> None:
+        self.algorithm = algorithm
+        self.testing = testing
+        self.depth = depth
+        self.training_rows = 0
+        self.distances = np.empty((len(testing), 0))
+        self.indices = np.empty((len(testing), 0), dtype=np.intp)
+
+    def add_training(self, rows:np.ndarray) -> None:
+        """Merges these training rows into the heaps, a block at a time."""
+        block = max(1, self.block_cells // max(1, len(self.testing)))
+        for start in range(0, len(rows), block):
+            chunk = rows[start : start + block]
+            metrics.count_distances(len(self.testing) * len(chunk))
+            distances = self.algorithm.pairwise(self.testing, chunk)
+            indices = np.broadcast_to(np.arange(self.training_rows, self.training_rows + len(chunk)), distances.shape)
+            self._merge(distances, indices)
+            self.training_rows += len(chunk)
+
+    def _merge(self, distances:np.ndarray, indices:np.ndarray) -> None:
+        # old columns first: k_nearest breaks ties by column, which is then the same as by row number
+        distances = np.concatenate((self.distances, distances), axis=1)
+        indices = np.concatenate((self.indices, indices), axis=1)
+        keep = k_nearest(distances, self.depth)
+        self.distances = np.take_along_axis(distances, keep, axis=1)
+        self.indices = np.take_along_axis(indices, keep, axis=1)
+
+    def nearest(self, k:int) -> np.ndarray:
+        """The (testing, k) nearest training rows, nearest first."""
+        if k > self.depth:
+            raise ValueError(f"heaps are only {self.depth} deep, k={k}")
+        return self.indices[:, :k]
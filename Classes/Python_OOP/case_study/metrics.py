@@ -0,0 +1,148 @@
+"""Opt-in instrumentation of the k-NN pipeline stages: load, partition, test and classify.
+
+    metrics.registry.enable()              #allocations=True also traces memory, which is much slower
+    data.load(rows); data.test(h)
+    print(metrics.registry.to_prometheus())
+
+Each stage records its calls, wall time, rows and the distance evaluations done inside it.
+While disabled, stage() hands back one shared do-nothing context manager and count_distances()
+returns after one attribute check. The per-sample hot path, Hyperparameter.classify, checks
+registry.enabled itself and skips the with statement altogether."""
+import json
+import threading
+import time
+import tracemalloc
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Optional
+
+
+@dataclass
+class StageMetrics:
+    calls: int = 0
+    seconds: float = 0.0
+    rows: int = 0
+    distance_evaluations: int = 0
+    allocated_bytes: int = 0 #net growth of traced memory, only with enable(allocations=True)
+
+
+class _Disabled:
+    def __enter__(self) -> "_Disabled":
+        return self
+
+    def add_rows(self, n:int) -> None:
+        pass
+
+    def __exit__(self, *exc_info:object) -> None:
+        pass
+
+_disabled = _Disabled()
+
+_active: ContextVar[Optional["_Stage"]] = ContextVar("active_stage", default=None)
+
+
+class _Stage:
+    def __init__(self, registry:"MetricsRegistry", name:str, rows:int) -> None:
+        self.registry = registry
+        self.name = name
+        self.rows = rows
+        self.distance_evaluations = 0
+
+    def add_rows(self, n:int) -> None:
+        """For stages that only know their row count at the end."""
+        self.rows += n
+
+    def __enter__(self) -> "_Stage":
+        self.token = _active.set(self)
+        self.allocated = tracemalloc.get_traced_memory()[0] if self.registry.allocations else 0
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info:object) -> None:
+        seconds = time.perf_counter() - self.start
+        allocated = tracemalloc.get_traced_memory()[0] - self.allocated if self.registry.allocations else 0
+        _active.reset(self.token)
+        outer = _active.get()
+        if outer is not None:
+            outer.distance_evaluations += self.distance_evaluations
+        with self.registry.lock:
+            stage = self.registry.stages.setdefault(self.name, StageMetrics())
+            stage.calls += 1
+            stage.seconds += seconds
+            stage.rows += self.rows
+            stage.distance_evaluations += self.distance_evaluations
+            stage.allocated_bytes += max(0, allocated)
+
+
+class MetricsRegistry:
+    """Per-stage totals, since the last reset()."""
+    def __init__(self) -> None:
+        self.enabled = False
+        self.allocations = False
+        self._started_tracing = False #disable() only stops tracemalloc when enable() started it
+        self.lock = threading.Lock()
+        self.stages: Dict[str, StageMetrics] = {}
+
+    def enable(self, allocations:bool=False) -> None:
+        if allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self.allocations = allocations
+        self.enabled = True
+
+    def disable(self) -> None:
+        if self._started_tracing: #someone else's tracing (python -X tracemalloc) keeps running
+            tracemalloc.stop()
+            self._started_tracing = False
+        self.enabled = self.allocations = False
+
+    def reset(self) -> None:
+        with self.lock:
+            self.stages.clear()
+
+    def stage(self, name:str, rows:int=0) -> Any:
+        """A context manager timing one call of a stage."""
+        if not self.enabled:
+            return _disabled
+        return _Stage(self, name, rows)
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        with self.lock:
+            return {name: asdict(stage) for name, stage in self.stages.items()}
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2, sort_keys=True)
+
+    def to_prometheus(self, prefix:str="knn") -> str:
+        """The totals in the Prometheus text exposition format, one counter per field."""
+        stages = self.to_dict()
+        lines = []
+        for field, help_text in (
+                ("calls", "Calls of a k-NN pipeline stage."),
+                ("seconds", "Wall time spent in a k-NN pipeline stage."),
+                ("rows", "Rows processed by a k-NN pipeline stage."),
+                ("distance_evaluations", "Distances computed in a k-NN pipeline stage."),
+                ("allocated_bytes", "Net traced memory growth in a k-NN pipeline stage."),
+        ):
+            metric = f"{prefix}_stage_{field}_total"
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} counter")
+            for name, stage in sorted(stages.items()):
+                lines.append(f'{metric}{{stage="{name}"}} {stage[field]}')
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry() #the registry every stage hook reports to
+
+def stage(name:str, rows:int=0) -> Any:
+    """registry.stage(); EX: with metrics.stage("test", rows=len(testing)): ..."""
+    if not registry.enabled:
+        return _disabled
+    return _Stage(registry, name, rows)
+
+def count_distances(n:int) -> None:
+    """Adds n distance evaluations to the innermost running stage."""
+    if registry.enabled:
+        current = _active.get()
+        if current is not None:
+            current.distance_evaluations += n
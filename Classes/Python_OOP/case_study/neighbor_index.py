@@ -0,0 +1,171 @@
+"""Neighbor search structures behind Hyperparameter.classify_batch.
+
+Every index answers the same question as k_nn_naive: the k nearest training rows for each query,
+ordered by (distance, position). They only differ in how many training rows they have to measure."""
+import abc
+import math
+from typing import List, Tuple
+
+import numpy as np
+
+import metrics
+from distance_calculations import Distance
+
+
+def k_nearest(distances:np.ndarray, k:int) -> np.ndarray:
+    """Indices of the k nearest columns for each row of a (queries, training) distance block,
+    ordered by (distance, index) like k_nn_naive.
+    argpartition finds the k-th smallest distance in O(n); only the rows tied at that bound get sorted."""
+    if k >= distances.shape[1]:
+        return np.argsort(distances, axis=1, kind="stable")
+    candidates = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    bounds = np.take_along_axis(distances, candidates, axis=1).max(axis=1)
+    nearest = np.empty((distances.shape[0], k), dtype=np.intp)
+    for row, (d, bound) in enumerate(zip(distances, bounds)):
+        index = np.flatnonzero(d <= bound) #ascending, so a stable sort breaks ties by position
+        nearest[row] = index[np.argsort(d[index], kind="stable")[:k]]
+    return nearest
+
+
+class NeighborIndex(abc.ABC):
+    """A search structure over a packed (n, 4) training matrix for one Distance."""
+    def __init__(self, matrix:np.ndarray, algorithm:Distance) -> None:
+        self.matrix = matrix
+        self.algorithm = algorithm
+
+    def __len__(self) -> int:
+        return len(self.matrix)
+
+    @abc.abstractmethod
+    def query(self, queries:np.ndarray, k:int) -> np.ndarray:
+        """A (len(queries), min(k, n)) array of training row indices, nearest first."""
+        ...
+
+
+class BruteForceIndex(NeighborIndex):
+    """Measures every training row, a block of queries at a time. Works for any Distance."""
+    block_cells = 1 << 22 #upper bound on a (queries x training) distance block, about 32MB of float64
+
+    def query(self, queries:np.ndarray, k:int) -> np.ndarray:
+        block = max(1, self.block_cells // max(1, len(self.matrix)))
+        metrics.count_distances(len(queries) * len(self.matrix))
+        nearest = [
+            k_nearest(self.algorithm.pairwise(queries[start : start + block], self.matrix), k)
+            for start in range(0, len(queries), block)
+        ]
+        if not nearest:
+            return np.empty((0, min(k, len(self.matrix))), dtype=np.intp)
+        return np.concatenate(nearest)
+
+
+class KDTreeIndex(NeighborIndex):
+    """A KD-tree for the Minkowski distances (ED, MD, CD), which have a p exponent.
+
+    Each node keeps the bounding box of its rows. A node is skipped when the distance from the query
+    to its box is already larger than the k-th best distance found so far, so a query only measures
+    the few leaves near it: O(log n) on the 4-D iris measurements.
+    The box bound is computed with the same floating point steps as Distance.pairwise and can never
+    exceed a real distance, so the answers are identical to BruteForceIndex, ties included."""
+    leaf_size = 64
+
+    def __init__(self, matrix:np.ndarray, algorithm:Distance) -> None:
+        if algorithm.p is None:
+            raise ValueError(f"{algorithm.__class__.__name__} is not a Minkowski distance")
+        super().__init__(matrix, algorithm)
+        self.p: float = algorithm.p
+        self.order = np.arange(len(matrix))
+        # node i covers self.order[start[i]:end[i]]; leaves have left[i] == -1
+        self.start: List[int] = []
+        self.end: List[int] = []
+        self.left: List[int] = []
+        self.right: List[int] = []
+        self.lo: List[Tuple[float, ...]] = []
+        self.hi: List[Tuple[float, ...]] = []
+        if len(matrix):
+            self._build(0, len(matrix))
+        self.points = np.asfortranarray(matrix[self.order]) #leaves become contiguous slices
+
+    def _build(self, start:int, end:int) -> int:
+        node = len(self.start)
+        rows = self.matrix[self.order[start:end]]
+        lo, hi = rows.min(axis=0), rows.max(axis=0)
+        self.start.append(start)
+        self.end.append(end)
+        self.lo.append(tuple(lo.tolist()))
+        self.hi.append(tuple(hi.tolist()))
+        self.left.append(-1)
+        self.right.append(-1)
+        if end - start > self.leaf_size:
+            axis = int(np.argmax(hi - lo))
+            middle = (end - start) // 2
+            split = np.argpartition(rows[:, axis], middle)
+            self.order[start:end] = self.order[start:end][split]
+            self.left[node] = self._build(start, start + middle)
+            self.right[node] = self._build(start + middle, end)
+        return node
+
+    def _box_distance(self, q:Tuple[float, ...], node:int) -> float:
+        """Distance from q to the nearest point of the node's box, summed in pairwise column order."""
+        total = 0.0
+        for x, lo, hi in zip(q, self.lo[node], self.hi[node]):
+            if x < lo:
+                gap = lo - x
+            elif x > hi:
+                gap = x - hi
+            else:
+                continue
+            if self.p == 2:
+                total += gap * gap
+            elif self.p == 1:
+                total += gap
+            else:
+                total = max(total, gap)
+        return math.sqrt(total) if self.p == 2 else total
+
+    def _query_one(self, q:np.ndarray, k:int) -> np.ndarray:
+        q_tuple = tuple(q.tolist())
+        q_row = q.reshape(1, -1)
+        found_d = np.empty(0)
+        found_i = np.empty(0, dtype=np.intp)
+        kth = math.inf
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            if self._box_distance(q_tuple, node) > kth:
+                continue
+            left = self.left[node]
+            if left != -1:
+                right = self.right[node]
+                # visit the nearer child first so kth shrinks sooner
+                if self._box_distance(q_tuple, left) <= self._box_distance(q_tuple, right):
+                    stack.extend((right, left))
+                else:
+                    stack.extend((left, right))
+                continue
+            start, end = self.start[node], self.end[node]
+            metrics.count_distances(end - start)
+            d = self.algorithm.pairwise(q_row, self.points[start:end])[0]
+            found_d = np.concatenate((found_d, d))
+            found_i = np.concatenate((found_i, self.order[start:end]))
+            if len(found_d) >= k:
+                kth = np.partition(found_d, k - 1)[k - 1]
+                keep = found_d <= kth #keep the ties, position decides them at the end
+                found_d, found_i = found_d[keep], found_i[keep]
+        return found_i[np.lexsort((found_i, found_d))[:k]]
+
+    def query(self, queries:np.ndarray, k:int) -> np.ndarray:
+        nearest = np.empty((len(queries), min(k, len(self.matrix))), dtype=np.intp)
+        for row, q in enumerate(queries):
+            nearest[row] = self._query_one(q, k)
+        return nearest
+
+
+kd_tree_threshold = 10_000 #measured crossover: ~0.3ms a query either way
+
+def build_index(matrix:np.ndarray, algorithm:Distance) -> NeighborIndex:
+    """Picks the index for this training set size and Distance.
+    Brute force wins on small sets, where one broadcast beats walking a tree; SD (Sorensen) is not
+    a Minkowski distance, so a box can't bound it and it always uses brute force."""
+    if algorithm.p is not None and len(matrix) >= kd_tree_threshold:
+        return KDTreeIndex(matrix, algorithm)
+    return BruteForceIndex(matrix, algorithm)
@@ -0,0 +1,102 @@
+"""A cache of classifications in front of Hyperparameter.classify.
+
+The instruments measure to 0.1cm, so two requests whose measurements round to the same 0.1cm grid
+point are the same request. Entries are keyed by (Hyperparameter, grid point) and remember the
+TrainingData.version they were computed from: after a load(), add_training() or invalidate()
+they are stale and get recomputed."""
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, List, Optional, Sequence, Tuple, cast
+
+import numpy as np
+
+from classes import Hyperparameter, Sample, as_matrix
+
+Entry = Tuple[int, float, str] #TrainingData.version, expiry time, classification
+
+
+class PredictionCache:
+    """LRU cache of classifications, bounded by entry count, with an optional time to live in seconds.
+    EX: Hyperparameter(5, ED(), data, cache=PredictionCache(max_entries=100_000, ttl=3600))"""
+    def __init__(
+            self, max_entries:int=10_000, ttl:Optional[float]=None, resolution:float=0.1,
+            clock:Callable[[], float]=time.monotonic,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.resolution = resolution
+        self.clock = clock
+        self._entries: "OrderedDict[Hashable, Entry]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0 #dropped to stay under max_entries
+        self.expirations = 0 #older than ttl
+        self.invalidations = 0 #computed from an older TrainingData.version
+
+    def keys(self, parameter:Hyperparameter, samples:Sequence[Sample]) -> List[Tuple[Hyperparameter, Tuple[int, ...]]]:
+        """The cache keys: the measurements rounded to multiples of resolution."""
+        grid = np.rint(as_matrix(samples) / self.resolution).astype(np.int64)
+        return [(parameter, point) for point in map(tuple, grid.tolist())]
+
+    def classify_batch(
+            self, parameter:Hyperparameter, version:int, samples:Sequence[Sample],
+            classify:Callable[[Sequence[Sample]], List[str]],
+    ) -> List[str]:
+        """The classification of every sample; classify() is only called for the misses, in one batch."""
+        now = self.clock()
+        keys = self.keys(parameter, samples)
+        results: List[Optional[str]] = [None] * len(samples)
+        missing: Dict[Hashable, List[int]] = {} #near-duplicates within a batch are classified once
+        for n, key in enumerate(keys):
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] != version:
+                    self.invalidations += 1
+                    entry = None
+                elif entry[1] < now:
+                    self.expirations += 1
+                    entry = None
+                if entry is None:
+                    del self._entries[key]
+            if entry is None:
+                self.misses += 1
+                missing.setdefault(key, []).append(n)
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                results[n] = entry[2]
+        if missing:
+            found = classify([samples[rows[0]] for rows in missing.values()])
+            expires = now + self.ttl if self.ttl is not None else float("inf")
+            for (key, rows), classification in zip(missing.items(), found):
+                for n in rows:
+                    results[n] = classification
+                self._store(key, (version, expires, classification))
+        return cast(List[str], results)
+
+    def _store(self, key:Hashable, entry:Entry) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, float]:
+        """Counters for monitoring."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+        }
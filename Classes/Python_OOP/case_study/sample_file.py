@@ -0,0 +1,99 @@
+"""A binary, memory-mapped file format for a loaded TrainingData.
+
+Parsing and validating bezdekIris.data on every start is slow. write_training_data() saves the
+validated training and testing SampleStores once; open_training_data() maps the file back in
+without parsing anything. The pages are read-only and backed by the file, so every process that
+opens the same file shares them.
+
+Layout, little-endian, each block starting on a 64 byte boundary:
+    header      magic, feature itemsize (4 or 8), feature count, training rows, testing rows,
+                category count, category bytes
+    categories  the species names, utf-8, newline separated
+    training    the feature columns one after the other (a column-major (n, 4) matrix)
+    training    species codes, int8
+    testing     feature columns
+    testing     species codes, int8
+"""
+import datetime
+import mmap
+import struct
+from pathlib import Path
+from typing import BinaryIO, List, Tuple
+
+import numpy as np
+
+from classes import Purpose, SampleStore, TrainingData, feature_names, species_codes
+
+MAGIC = b"IRISCOL1"
+HEADER = struct.Struct("<8sB3xIQQII")
+ALIGN = 64
+
+
+def _aligned(offset:int) -> int:
+    return -(-offset // ALIGN) * ALIGN
+
+def _pad(target:BinaryIO) -> None:
+    target.write(b"\0" * (_aligned(target.tell()) - target.tell()))
+
+
+def write_training_data(data:TrainingData, path:Path, dtype:type=np.float64) -> None:
+    """Saves the training and testing samples. Only a clean load (one that set data.uploaded) can be saved.
+    float32 halves the file, but the classifier then needs a float64 copy of the training matrix."""
+    if not hasattr(data, "uploaded"):
+        raise RuntimeError(f"{data.name} has no validated load to save")
+    dtype = np.dtype(dtype)
+    if dtype not in (np.dtype(np.float32), np.dtype(np.float64)):
+        raise ValueError(f"Features must be float32 or float64, not {dtype}")
+    training = data.training_matrix()
+    categories = list(training.categories)
+    if isinstance(data.testing, SampleStore):
+        testing_names = data.testing.categories
+    else:
+        testing_names = sorted({s.species for s in data.testing})
+    categories.extend(name for name in testing_names if name not in categories)
+    testing_codes = species_codes(data.testing, categories)
+    names = "\n".join(categories).encode("utf-8")
+
+    with path.open("wb") as target:
+        target.write(HEADER.pack(
+            MAGIC, dtype.itemsize, len(feature_names),
+            len(training.codes), len(testing_codes), len(categories), len(names),
+        ))
+        target.write(names)
+        for matrix, codes in ((training.matrix, training.codes), (data.testing_matrix(), testing_codes)):
+            _pad(target)
+            target.write(np.asfortranarray(matrix, dtype=dtype).tobytes(order="F"))
+            _pad(target)
+            target.write(np.asarray(codes, dtype=np.int8).tobytes())
+
+
+def map_sample_stores(path:Path) -> Tuple[SampleStore, SampleStore]:
+    """The (training, testing) SampleStores of a file, as read-only views of its memory map."""
+    with path.open("rb") as source:
+        buffer = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, itemsize, features, training_rows, testing_rows, category_count, names_size = HEADER.unpack_from(buffer)
+    if magic != MAGIC or features != len(feature_names) or itemsize not in (4, 8):
+        raise ValueError(f"{path} is not a sample file")
+    dtype = np.dtype(f"<f{itemsize}")
+    offset = HEADER.size
+    categories: List[str] = buffer[offset : offset + names_size].decode("utf-8").split("\n")[:category_count]
+    offset += names_size
+
+    stores = []
+    for purpose, rows in ((Purpose.Training, training_rows), (Purpose.Testing, testing_rows)):
+        offset = _aligned(offset)
+        matrix = np.ndarray((rows, features), dtype=dtype, buffer=buffer, offset=offset, order="F")
+        offset = _aligned(offset + matrix.nbytes)
+        codes = np.ndarray((rows,), dtype=np.int8, buffer=buffer, offset=offset)
+        offset += codes.nbytes
+        stores.append(SampleStore.from_buffers(purpose, matrix, codes, categories))
+    return stores[0], stores[1]
+
+
+def open_training_data(path:Path, name:str) -> TrainingData:
+    """A TrainingData whose samples are mapped from a file written by write_training_data()."""
+    data = TrainingData(name)
+    data.training, data.testing = map_sample_stores(path)
+    data.invalidate()
+    data.uploaded = datetime.datetime.fromtimestamp(path.stat().st_mtime, tz=datetime.timezone.utc)
+    return data
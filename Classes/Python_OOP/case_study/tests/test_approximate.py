@@ -0,0 +1,55 @@
+import unittest
+
+import numpy as np
+
+from approximate import LSHIndex, recall
+from classes import Hyperparameter, TrainingData
+from distance_calculations import ED, SD
+from neighbor_index import BruteForceIndex
+from test_classes import iris_like_rows
+
+
+class TestLSHIndex(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(5)
+        self.training = np.asfortranarray(np.round(rng.uniform(0, 8, (3000, 4)), 1))
+        self.queries = np.round(rng.uniform(0, 8, (200, 4)), 1)
+
+    def test_recall(self):
+        exact = np.array([[1, 2, 3], [4, 5, 6]])
+        self.assertEqual(recall(exact, exact), 1.0)
+        self.assertEqual(recall(np.array([[3, 2, 9], [7, 8, 9]]), exact), 2 / 6)
+
+    def test_tune_reaches_target(self):
+        for algorithm in (ED(), SD()):
+            exact = BruteForceIndex(self.training, algorithm).query(self.queries, 5)
+            index = LSHIndex.tune(self.training, algorithm, self.queries, exact, 0.95)
+            with self.subTest(algorithm=type(algorithm).__name__):
+                self.assertGreaterEqual(index.recall, 0.95)
+                self.assertEqual(recall(index.query(self.queries, 5), exact), index.recall)
+
+    def test_found_neighbors_are_ordered(self):
+        algorithm = SD()
+        index = LSHIndex(self.training, algorithm, tables=2)
+        for q, found in zip(self.queries, index.query(self.queries, 7)):
+            d = algorithm.one_to_many(q, self.training[found])
+            self.assertEqual(sorted(zip(d.tolist(), found.tolist())), list(zip(d.tolist(), found.tolist())))
+
+    def test_too_few_candidates_measures_everything(self):
+        index = LSHIndex(self.training[:50], ED(), tables=1, width=0.01)
+        exact = BruteForceIndex(self.training[:50], ED()).query(self.queries, 5)
+        np.testing.assert_array_equal(index.query(self.queries, 5), exact)
+
+
+class TestApproximateClassify(unittest.TestCase):
+    def test_recall_target(self):
+        data = TrainingData("approximate")
+        data.load(iris_like_rows(2000))
+        exact = Hyperparameter(5, ED(), data).classify_batch(data.testing)
+        h = Hyperparameter(5, ED(), data, recall=0.99)
+        approximate = h.classify_batch(data.testing)
+        index = data.approximate_index(ED(), 5, 0.99)
+        self.assertGreaterEqual(index.recall, 0.99)
+        self.assertGreaterEqual(np.mean([a == e for a, e in zip(approximate, exact)]), 0.95)
+        data.invalidate()
+        self.assertIsNot(data.approximate_index(ED(), 5, 0.99), index)
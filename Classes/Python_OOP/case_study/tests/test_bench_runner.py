@@ -0,0 +1,34 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import bench_runner
+
+
+class TestBenchRunner(unittest.TestCase):
+    def test_compare_flags_regressions(self):
+        base = {"timings": {"load/size=150": 1.0, "tune/size=150": 2.0, "gone": 1.0}}
+        new = {"timings": {"load/size=150": 1.05, "tune/size=150": 2.5, "added": 9.0}}
+        self.assertEqual(bench_runner.compare(base, new, 0.10), [("tune/size=150", 2.0, 2.5)])
+        self.assertEqual(bench_runner.compare(base, new, 0.30), [])
+
+    def test_run_and_compare(self):
+        with tempfile.TemporaryDirectory() as directory:
+            history = Path(directory) / "history.json"
+            args = ["--history", str(history), "run", "--sizes", "150", "--ks", "1,3", "--repeat", "1", "--workers", "1"]
+            self.assertEqual(bench_runner.main(args), 0)
+            self.assertEqual(bench_runner.main(args), 0)
+            records = bench_runner.load_history(history)
+            self.assertEqual(len(records), 2)
+            keys = set(records[0]["timings"])
+            self.assertIn("load/size=150", keys)
+            self.assertIn("partition/size=150", keys)
+            self.assertIn("distance/SD/size=150", keys)
+            self.assertIn("test/ED/k=3/size=150", keys)
+            self.assertIn("tune/size=150", keys)
+            self.assertEqual(len(keys), 2 + 4 + 4 * 2 + 1)
+            self.assertEqual(bench_runner.main(["--history", str(history), "compare", "--threshold", "1000"]), 0)
+
+    def test_size_limits(self):
+        with self.assertRaises(ValueError):
+            bench_runner.run([100], [1], 1, 10, 1)
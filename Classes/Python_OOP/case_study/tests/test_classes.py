@@ -0,0 +1,197 @@
+import random
+import unittest
+
+import classes
+from classes import (
+    Hyperparameter, Purpose, Sample, SampleStore, TrainingData, TrainingKnownSample, k_nn_naive, species, validate_rows
+)
+from distance_cache import NeighborOrderCache
+from distance_calculations import CD, ED, MD, SD
+from exceptions import InvalidSampleError, OutlierError
+from neighbor_index import BruteForceIndex
+
+
+def iris_like_rows(n, seed=42):
+    """Rows rounded to 0.1cm like bezdekIris.data, so there are plenty of distance ties."""
+    rng = random.Random(seed)
+    names = sorted(species)
+    rows = []
+    for _ in range(n):
+        rows.append({
+            "sepal_length": f"{rng.uniform(4.3, 7.9):.1f}",
+            "sepal_width": f"{rng.uniform(2.0, 4.4):.1f}",
+            "petal_length": f"{rng.uniform(1.0, 6.9):.1f}",
+            "petal_width": f"{rng.uniform(0.1, 2.5):.1f}",
+            "species": rng.choice(names),
+        })
+    return rows
+
+
+class SmallBlockIndex(BruteForceIndex):
+    block_cells = 7 * 500
+
+
+class TestBatchClassify(unittest.TestCase):
+    def setUp(self):
+        self.data = TrainingData("test")
+        self.data.load(iris_like_rows(600))
+
+    def test_matches_naive_reference(self):
+        for algorithm in (ED(), MD(), CD(), SD()):
+            for k in (1, 3, 5, 8):
+                h = Hyperparameter(k, algorithm, self.data)
+                expected = [k_nn_naive(k, algorithm, self.data.training, s) for s in self.data.testing]
+                with self.subTest(algorithm=type(algorithm).__name__, k=k):
+                    self.assertEqual(h.classify_batch(self.data.testing), expected)
+
+    def test_matches_naive_reference_across_seeds(self):
+        #1000 rows at 0.1cm are full of near-ties; a distance rounded differently from pairwise
+        #(math.hypot did) flips some of them, on most of these seeds
+        for seed in range(8):
+            data = TrainingData("ties")
+            data.load(iris_like_rows(1000, seed=seed))
+            for k in (2, 4, 6):
+                h = Hyperparameter(k, ED(), data)
+                expected = [k_nn_naive(k, ED(), data.training, s) for s in data.testing]
+                with self.subTest(seed=seed, k=k):
+                    self.assertEqual(h.classify_batch(data.testing), expected)
+
+    def test_small_blocks(self):
+        h = Hyperparameter(5, ED(), self.data)
+        expected = h.classify_batch(self.data.testing)
+        self.data.invalidate()
+        self.data.index_factory = SmallBlockIndex
+        self.assertEqual(h.classify_batch(self.data.testing), expected)
+
+    def test_sweep_searches_once(self):
+        cache = NeighborOrderCache()
+        self.data.neighbor_cache = cache
+        for k in range(1, 11):
+            h = Hyperparameter(k, SD(), self.data)
+            h.test()
+            expected = h.classify_batch(self.data.testing)
+            self.assertEqual([s.classification for s in self.data.testing], expected)
+        self.assertEqual((cache.misses, cache.hits), (1, 9))
+
+    def test_tune_matches_serial_test(self):
+        grid = [(k, algorithm) for k in (1, 3, 6) for algorithm in (ED(), MD(), CD(), SD())]
+        self.data.tune(grid, workers=2)
+        self.assertEqual([(h.k, h.algorithm) for h in self.data.tuning], grid)
+        for tuned in self.data.tuning:
+            h = Hyperparameter(tuned.k, tuned.algorithm, self.data)
+            h.test()
+            self.assertEqual(tuned.quality, h.quality)
+
+    def test_invalidated_by_load(self):
+        h = Hyperparameter(3, MD(), self.data)
+        h.classify_batch(self.data.testing)
+        version = self.data.version
+        self.data.load(iris_like_rows(100, seed=7))
+        self.assertGreater(self.data.version, version)
+        self.assertEqual(len(self.data.neighbor_index(MD())), len(self.data.training))
+
+    def test_quality(self):
+        h = Hyperparameter(1, ED(), self.data)
+        self.data.test(h)
+        self.assertEqual(self.data.tuning, [h])
+        self.assertTrue(0.0 <= h.quality <= 1.0)
+
+
+class TestSampleStore(unittest.TestCase):
+    def setUp(self):
+        self.rows = iris_like_rows(50)
+
+    def test_views_match_samples(self):
+        samples = [TrainingKnownSample.from_dict(row) for row in self.rows]
+        store = SampleStore(Purpose.Training, samples)
+        self.assertEqual(len(store), len(samples))
+        for view, sample in zip(store, samples):
+            self.assertEqual(repr(view), repr(sample))
+            self.assertEqual(view.species, sample.species)
+        self.assertEqual(store[-1].petal_width, samples[-1].petal_width)
+        self.assertEqual(store.matrix().shape, (50, 4))
+
+    def test_training_views_cannot_be_classified(self):
+        store = SampleStore(Purpose.Training, [TrainingKnownSample.from_dict(self.rows[0])])
+        with self.assertRaises(AttributeError):
+            store[0].classification = "Iris-setosa"
+
+    def test_testing_views_classification(self):
+        store = SampleStore(Purpose.Testing, [classes.TestingKnownSample.from_dict(row) for row in self.rows])
+        view = store[3]
+        self.assertIsNone(view.classification)
+        view.classification = view.species
+        self.assertTrue(store[3].matches())
+        self.assertFalse(store[4].matches())
+
+
+class TestValidateRows(unittest.TestCase):
+    def setUp(self):
+        self.rows = iris_like_rows(20)
+        self.rows[2] = dict(self.rows[2], sepal_width="wide")
+        self.rows[5] = dict(self.rows[5], species="Iris-nonesuch")
+        self.rows[7] = dict(self.rows[7], petal_width="40.0")
+        self.rows[11] = {k: v for k, v in self.rows[11].items() if k != "petal_length"}
+        self.rows[13] = dict(self.rows[13], sepal_length="nan")
+
+    def test_mask_and_errors(self):
+        checked = validate_rows(self.rows)
+        self.assertEqual(sorted(checked.errors), [2, 5, 7, 11, 13])
+        self.assertEqual(checked.valid.tolist(), [n not in checked.errors for n in range(20)])
+        self.assertIsInstance(checked.errors[7], OutlierError)
+        self.assertIn("'wide'", str(checked.errors[2]))
+        self.assertIn("'Iris-nonesuch'", str(checked.errors[5]))
+        self.assertIn("'petal_length'", str(checked.errors[11]))
+        for n in range(20):
+            if checked.valid[n]:
+                self.assertEqual(checked.measurements[n].tolist(), [float(self.rows[n][f]) for f in classes.feature_names])
+
+    def test_from_dict_wraps_validate_rows(self):
+        for n, row in enumerate(self.rows):
+            with self.subTest(row=n):
+                if n in (2, 5, 7, 11, 13):
+                    with self.assertRaises(InvalidSampleError):
+                        TrainingKnownSample.from_dict(row)
+                else:
+                    sample = TrainingKnownSample.from_dict(row)
+                    self.assertEqual((sample.species, sample.petal_width), (row["species"], float(row["petal_width"])))
+        self.assertIsNone(Sample.from_dict(self.rows[5]).classification) #species isn't checked for unknown samples
+
+    def test_every_from_dict(self):
+        row = self.rows[0]
+        measurements = [float(row[f]) for f in classes.feature_names]
+        built = [
+            Sample.from_dict(row),
+            classes.UnknownSample.from_dict(row),
+            classes.KnownSample.from_dict(row, Purpose.Training),
+            classes.KnownSample.from_dict(row, purpose=Purpose.Testing),
+            TrainingKnownSample.from_dict(row),
+            classes.TestingKnownSample.from_dict(row),
+        ]
+        for sample in built:
+            with self.subTest(cls=type(sample).__name__):
+                self.assertEqual([getattr(sample, f) for f in classes.feature_names], measurements)
+        self.assertIsInstance(built[1], classes.UnknownSample)
+        self.assertIsNone(built[1].species)
+        self.assertEqual([s.purpose for s in built[2:]], [Purpose.Training, Purpose.Testing] * 2)
+        self.assertEqual(built[2].species, row["species"])
+        with self.assertRaises(InvalidSampleError):
+            classes.UnknownSample.from_dict(self.rows[2])
+        with self.assertRaises(InvalidSampleError):
+            classes.KnownSample.from_dict(self.rows[5], Purpose.Testing)
+        with self.assertRaises(ValueError):
+            classes.KnownSample.from_dict(row) #no purpose
+        with self.assertRaises(ValueError):
+            TrainingKnownSample.from_dict(row, Purpose.Testing)
+
+    def test_load_skips_invalid_rows(self):
+        data = TrainingData("validate")
+        data.load_block = 6
+        data.load(self.rows)
+        self.assertEqual(len(data.training) + len(data.testing), 15)
+        self.assertEqual(len(data.testing), 3) #rows 0, 10 and 15; 5 is invalid
+        self.assertFalse(hasattr(data, "uploaded"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import asyncio
+import unittest
+
+from classes import Hyperparameter, TrainingData, UnknownSample
+from classify_service import ClassifyService
+from distance_calculations import MD
+from test_classes import iris_like_rows
+
+
+class TestClassifyService(unittest.TestCase):
+    def setUp(self):
+        self.data = TrainingData("service")
+        self.data.load(iris_like_rows(500))
+        self.h = Hyperparameter(3, MD(), self.data)
+        self.unknowns = [
+            UnknownSample(s.sepal_length, s.sepal_width, s.petal_length, s.petal_width) for s in self.data.testing
+        ]
+
+    def test_matches_classify_batch(self):
+        expected = self.h.classify_batch(self.unknowns)
+        async def run():
+            async with ClassifyService(self.data, self.h, max_batch=16, max_queue=8) as service:
+                results = await asyncio.gather(*(service.classify(u) for u in self.unknowns))
+                return results, service.stats()
+        results, stats = asyncio.run(run())
+        self.assertEqual([s.classification for s in results], expected)
+        self.assertIs(results[0], self.unknowns[0])
+        self.assertEqual(stats["classified"], len(self.unknowns))
+        self.assertLess(stats["batches"], len(self.unknowns))
+        self.assertLessEqual(stats["max_depth"], 8)
+        self.assertEqual(stats["queue_depth"], 0)
+
+    def test_errors_reach_callers(self):
+        empty = TrainingData("empty")
+        async def run():
+            async with ClassifyService(empty, Hyperparameter(3, MD(), empty)) as service:
+                await service.classify(self.unknowns[0])
+        with self.assertRaises(RuntimeError):
+            asyncio.run(run())
+
+    def test_not_started(self):
+        with self.assertRaises(RuntimeError):
+            asyncio.run(ClassifyService(self.data, self.h).classify(self.unknowns[0]))
@@ -0,0 +1,144 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from classes import Purpose, SampleStore, TrainingKnownSample
+from data_handlers import (
+    HashingDealingPartition, ReservoirDealingPartition, SampleReader, ShufflingSamplePartition,
+    partition, partition_stream, training_80, training_hashed_80,
+)
+from exceptions import BadSampleRow
+from test_classes import iris_like_rows
+
+BEZDEK = """5.1,3.5,1.4,0.2,Iris-setosa
+4.9,3.0,1.4,0.2,Iris-setosa
+7.0,3.2,4.7,1.4,Iris-versicolor
+6.3,3.3,6.0,2.5,Iris-virginica
+5.8,2.7,5.1,1.9,Iris-virginica
+
+"""
+
+
+class TestSampleReader(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name) / "bezdekIris.data"
+        self.path.write_text(BEZDEK)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_batches(self):
+        batches = list(SampleReader(self.path).batch_iter(chunk_size=2))
+        self.assertEqual([b.first_line for b in batches], [1, 3, 5])
+        self.assertEqual([len(b) for b in batches], [2, 2, 1])
+        self.assertEqual(batches[1].measurements[:, 2].tolist(), [4.7, 6.0])
+        self.assertTrue(batches[1].measurements.flags.f_contiguous)
+        self.assertEqual(batches[2].species, ["Iris-virginica"])
+
+    def test_sample_iter_adapter(self):
+        samples = list(SampleReader(self.path).sample_iter())
+        self.assertEqual(len(samples), 5)
+        self.assertEqual(
+            (samples[2].sepal_length, samples[2].sepal_width, samples[2].petal_length, samples[2].petal_width),
+            (7.0, 3.2, 4.7, 1.4),
+        )
+
+    def test_bad_row_line_number(self):
+        self.path.write_text(BEZDEK.replace("6.3,3.3", "6.3,x3.3"))
+        with self.assertRaisesRegex(BadSampleRow, "Line 4"):
+            list(SampleReader(self.path).batch_iter(chunk_size=3))
+
+    def test_missing_column(self):
+        self.path.write_text(BEZDEK.replace("7.0,3.2,", "7.0,"))
+        with self.assertRaisesRegex(BadSampleRow, "Line 3"):
+            list(SampleReader(self.path).sample_iter())
+
+    def test_species_missing_on_a_later_row(self):
+        self.path.write_text(BEZDEK.replace("7.0,3.2,4.7,1.4,Iris-versicolor", "7.0,3.2,4.7,1.4"))
+        with self.assertRaisesRegex(BadSampleRow, "Line 3"):
+            list(SampleReader(self.path).batch_iter())
+
+    def test_species_only_on_a_later_row(self):
+        self.path.write_text(BEZDEK.replace("5.1,3.5,1.4,0.2,Iris-setosa", "5.1,3.5,1.4,0.2"))
+        with self.assertRaisesRegex(BadSampleRow, "Line 2"):
+            list(SampleReader(self.path).batch_iter())
+
+
+class TestPartitions(unittest.TestCase):
+    def setUp(self):
+        self.rows = iris_like_rows(100)
+        self.items = [
+            {"species": row["species"], **{k: float(row[k]) for k in row if k != "species"}} for row in self.rows
+        ]
+
+    def test_partition_one_pass(self):
+        samples = (TrainingKnownSample.from_dict(row) for row in self.rows) #a generator can only be read once
+        training, testing = partition(samples, training_80)
+        self.assertEqual((len(training), len(testing)), (80, 20))
+        self.assertEqual(testing[1].sepal_length, float(self.rows[5]["sepal_length"]))
+
+    def test_partition_stream_into_stores(self):
+        training, testing = SampleStore(Purpose.Training), SampleStore(Purpose.Testing)
+        partition_stream((TrainingKnownSample.from_dict(row) for row in self.rows), training_80, training, testing)
+        self.assertEqual((len(training), len(testing)), (80, 20))
+
+    def test_reservoir(self):
+        first = ReservoirDealingPartition(self.items, testing_size=15, seed=1)
+        second = ReservoirDealingPartition(iter(self.items), testing_size=15, seed=1)
+        self.assertEqual((len(first.training), len(first.testing)), (85, 15))
+        self.assertEqual([repr(s) for s in first.testing], [repr(s) for s in second.testing])
+        measurements = lambda s: (s.sepal_length, s.sepal_width, s.petal_length, s.petal_width, s.species)
+        self.assertEqual(
+            sorted(map(measurements, first.training + first.testing)),
+            sorted((d["sepal_length"], d["sepal_width"], d["petal_length"], d["petal_width"], d["species"]) for d in self.items),
+        )
+
+    def test_hashing_is_stable_under_appends(self):
+        everything = HashingDealingPartition(self.items)
+        daily = HashingDealingPartition(self.items[:60])
+        first_testing = daily.new_testing()
+        first_training = list(daily.training)
+        daily.extend(self.items[60:])
+        self.assertEqual(daily.training[: len(first_training)], first_training)
+        self.assertEqual(len(first_testing) + len(daily.new_testing()), len(everything.testing))
+        self.assertEqual(daily.new_testing(), [])
+        shuffled = HashingDealingPartition(reversed(self.items))
+        self.assertEqual(
+            sorted(repr(s) for s in shuffled.testing), sorted(repr(s) for s in everything.testing)
+        )
+
+    def test_hashed_rule(self):
+        samples = [TrainingKnownSample.from_dict(row) for row in self.rows]
+        training, testing = partition(samples, training_hashed_80)
+        again, _ = partition(reversed(samples), training_hashed_80)
+        self.assertEqual(sorted(map(repr, training)), sorted(map(repr, again)))
+        self.assertEqual(len(training) + len(testing), 100)
+
+    def test_shuffling_lists_are_cached(self):
+        shuffled = ShufflingSamplePartition(self.items)
+        self.assertIs(shuffled.training, shuffled.training)
+        self.assertEqual(len(shuffled.testing), 20)
+        shuffled.append(self.items[0])
+        self.assertEqual(len(shuffled.training) + len(shuffled.testing), 101)
+
+    def test_shuffling_lists_follow_every_change(self):
+        changes = [
+            ("+=", lambda p: p.__iadd__(self.items[:50])),
+            ("insert", lambda p: p.insert(0, self.items[0])),
+            ("setitem", lambda p: p.__setitem__(slice(0, 10), [])),
+            ("del", lambda p: p.__delitem__(0)),
+            ("pop", lambda p: p.pop()),
+            ("remove", lambda p: p.remove(p[0])),
+            ("clear", lambda p: p.clear()),
+        ]
+        for name, change in changes:
+            shuffled = ShufflingSamplePartition(self.items)
+            self.assertEqual(len(shuffled.training) + len(shuffled.testing), 100)
+            change(shuffled)
+            with self.subTest(change=name):
+                self.assertEqual(len(shuffled.training) + len(shuffled.testing), len(shuffled))
+
+
+if __name__ == "__main__":
+    unittest.main()
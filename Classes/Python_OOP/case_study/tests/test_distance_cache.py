@@ -0,0 +1,50 @@
+import unittest
+
+import numpy as np
+
+from distance_cache import NeighborOrderCache
+
+
+class TestNeighborOrderCache(unittest.TestCase):
+    def setUp(self):
+        self.searches = []
+
+    def search(self, depth):
+        self.searches.append(depth)
+        return np.tile(np.arange(min(depth, 100)), (10, 1))
+
+    def test_prefix_hits(self):
+        cache = NeighborOrderCache()
+        for k in range(1, 65):
+            self.assertEqual(cache.nearest("key", k, self.search).shape, (10, k))
+        self.assertEqual(self.searches, [64])
+        self.assertEqual((cache.hits, cache.misses), (63, 1))
+
+    def test_deeper_k_doubles(self):
+        cache = NeighborOrderCache()
+        cache.nearest("key", 3, self.search)
+        cache.nearest("key", 65, self.search)
+        self.assertEqual(self.searches, [64, 128])
+
+    def test_fewer_training_rows_than_k(self):
+        cache = NeighborOrderCache()
+        self.assertEqual(cache.nearest("key", 200, self.search).shape, (10, 100))
+        cache.nearest("key", 200, self.search)
+        self.assertEqual(cache.stats()["hits"], 1)
+
+    def test_evicts_least_recently_used(self):
+        cache = NeighborOrderCache(max_bytes=2 * 10 * 64 * 4) #room for two int32 entries
+        cache.nearest("a", 1, self.search)
+        cache.nearest("b", 1, self.search)
+        cache.nearest("a", 1, self.search)
+        cache.nearest("c", 1, self.search)
+        self.assertEqual(cache.evictions, 1)
+        self.assertLessEqual(cache.nbytes, cache.max_bytes)
+        cache.nearest("a", 1, self.search)
+        self.assertEqual(len(self.searches), 3) #"a" survived, "b" was evicted
+        cache.nearest("b", 1, self.search)
+        self.assertEqual(len(self.searches), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,29 @@
+import unittest
+
+import numpy as np
+
+from classes import UnknownSample, as_matrix
+from distance_calculations import CD, ED, MD, SD
+
+
+class TestBatchKernels(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(11)
+        self.a = [UnknownSample(*row) for row in rng.uniform(0.1, 8, (40, 4)).tolist()]
+        self.b = [UnknownSample(*row) for row in rng.uniform(0.1, 8, (70, 4)).tolist()]
+        self.A = as_matrix(self.a)
+        self.B = np.asfortranarray(as_matrix(self.b))
+
+    def test_pairwise_matches_scalar(self):
+        for algorithm in (ED(), MD(), CD(), SD()):
+            expected = np.array([[algorithm.distance(s1, s2) for s2 in self.b] for s1 in self.a])
+            with self.subTest(algorithm=type(algorithm).__name__):
+                np.testing.assert_allclose(algorithm.pairwise(self.A, self.B), expected, rtol=0, atol=1e-12)
+
+    def test_one_to_many_matches_scalar(self):
+        for algorithm in (ED(), MD(), CD(), SD()):
+            expected = np.array([algorithm.distance(self.a[0], s2) for s2 in self.b])
+            with self.subTest(algorithm=type(algorithm).__name__):
+                actual = algorithm.one_to_many(self.A[0], self.B)
+                self.assertEqual(actual.shape, (len(self.b),))
+                np.testing.assert_allclose(actual, expected, rtol=0, atol=1e-12)
@@ -0,0 +1,67 @@
+import unittest
+
+import numpy as np
+
+from classes import Hyperparameter, TrainingData, TrainingKnownSample
+from distance_calculations import CD, ED, MD, SD
+from incremental import NeighborHeaps
+from neighbor_index import k_nearest
+from test_classes import iris_like_rows
+
+
+class TestNeighborHeaps(unittest.TestCase):
+    def test_appends_match_full_search(self):
+        rng = np.random.default_rng(3)
+        training = np.round(rng.uniform(0, 8, (700, 4)), 1) #0.1cm steps, so lots of ties
+        testing = np.round(rng.uniform(0, 8, (90, 4)), 1)
+        for algorithm in (ED(), MD(), CD(), SD()):
+            heaps = NeighborHeaps(algorithm, testing, depth=12)
+            heaps.block_cells = 90 * 50
+            for start, end in ((0, 5), (5, 300), (300, 301), (301, 700)):
+                heaps.add_training(training[start:end])
+            expected = k_nearest(algorithm.pairwise(testing, training), 12)
+            with self.subTest(algorithm=type(algorithm).__name__):
+                np.testing.assert_array_equal(heaps.nearest(12), expected)
+                np.testing.assert_array_equal(heaps.nearest(4), expected[:, :4])
+
+
+class TestIncrementalTrainingData(unittest.TestCase):
+    def test_retest_matches_full_recomputation(self):
+        rows = iris_like_rows(900)
+        grid = [(k, algorithm) for k in (1, 5, 9) for algorithm in (ED(), MD(), CD(), SD())]
+
+        data = TrainingData("incremental", incremental=True)
+        data.load(rows[:600])
+        for k, algorithm in grid:
+            data.test(Hyperparameter(k, algorithm, data))
+        data.add_training(TrainingKnownSample.from_dict(row) for row in rows[600:])
+        data.retest()
+
+        full = TrainingData("full")
+        full.load(rows[:600])
+        full.training.extend(TrainingKnownSample.from_dict(row) for row in rows[600:])
+        full.invalidate()
+        for (k, algorithm), tuned in zip(grid, data.tuning):
+            h = Hyperparameter(k, algorithm, full)
+            h.test()
+            with self.subTest(k=k, algorithm=type(algorithm).__name__):
+                self.assertEqual(tuned.quality, h.quality)
+                self.assertEqual(
+                    data.testing_neighbors(algorithm, k).tolist(), full.testing_neighbors(algorithm, k).tolist()
+                )
+
+    def test_add_training_only_measures_new_rows(self):
+        data = TrainingData("incremental", incremental=True)
+        data.load(iris_like_rows(300))
+        data.test(Hyperparameter(3, ED(), data))
+        heaps = data._heaps[ED]
+        data.add_training(TrainingKnownSample.from_dict(row) for row in iris_like_rows(20, seed=9))
+        self.assertIs(data._heaps[ED], heaps)
+        self.assertEqual(heaps.training_rows, len(data.training))
+
+    def test_load_drops_heaps(self):
+        data = TrainingData("incremental", incremental=True)
+        data.load(iris_like_rows(300))
+        data.test(Hyperparameter(3, MD(), data))
+        data.load(iris_like_rows(50, seed=5))
+        self.assertEqual(data._heaps, {})
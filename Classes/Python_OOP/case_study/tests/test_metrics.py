@@ -0,0 +1,78 @@
+import json
+import tracemalloc
+import unittest
+
+import metrics
+from classes import Hyperparameter, TrainingData, TrainingKnownSample
+from data_handlers import partition, training_80
+from distance_cache import NeighborOrderCache
+from distance_calculations import SD
+from test_classes import iris_like_rows
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        metrics.registry.reset()
+        self.rows = iris_like_rows(250)
+
+    def tearDown(self):
+        metrics.registry.disable()
+        metrics.registry.reset()
+
+    def run_pipeline(self):
+        data = TrainingData("metrics", cache=NeighborOrderCache())
+        data.load(self.rows)
+        h = Hyperparameter(3, SD(), data)
+        data.test(h)
+        h.classify_batch(data.testing[:10])
+        partition((TrainingKnownSample.from_dict(row) for row in self.rows), training_80)
+        return data
+
+    def test_disabled_records_nothing(self):
+        self.run_pipeline()
+        self.assertEqual(metrics.registry.to_dict(), {})
+
+    def test_stages(self):
+        metrics.registry.enable()
+        data = self.run_pipeline()
+        stages = metrics.registry.to_dict()
+        self.assertEqual(set(stages), {"load", "partition", "test", "classify"})
+        self.assertEqual(stages["load"]["rows"], 250)
+        self.assertEqual(stages["partition"]["rows"], 250)
+        self.assertEqual(stages["test"]["rows"], 50)
+        self.assertEqual(stages["classify"]["rows"], 10)
+        self.assertEqual(stages["test"]["distance_evaluations"], 50 * 200) #SD is always brute force
+        self.assertEqual(stages["classify"]["distance_evaluations"], 10 * 200)
+        self.assertEqual(stages["load"]["distance_evaluations"], 0)
+        self.assertTrue(all(stage["calls"] == 1 and stage["seconds"] > 0 for stage in stages.values()))
+        self.assertEqual(json.loads(metrics.registry.to_json()), stages)
+
+    def test_prometheus(self):
+        metrics.registry.enable()
+        self.run_pipeline()
+        text = metrics.registry.to_prometheus()
+        self.assertIn("# TYPE knn_stage_rows_total counter\n", text)
+        self.assertIn('knn_stage_rows_total{stage="load"} 250\n', text)
+        self.assertIn('knn_stage_calls_total{stage="test"} 1\n', text)
+
+    def test_allocations(self):
+        metrics.registry.enable(allocations=True)
+        with metrics.stage("classify"):
+            held = [bytearray(1000) for _ in range(100)]
+        self.assertGreaterEqual(metrics.registry.to_dict()["classify"]["allocated_bytes"], 100_000)
+        del held
+
+    def test_disable_leaves_outside_tracing_running(self):
+        was_tracing = tracemalloc.is_tracing()
+        tracemalloc.start()
+        try:
+            metrics.registry.enable(allocations=True)
+            metrics.registry.disable()
+            self.assertTrue(tracemalloc.is_tracing())
+        finally:
+            if not was_tracing:
+                tracemalloc.stop()
+        if not was_tracing:
+            metrics.registry.enable(allocations=True)
+            metrics.registry.disable()
+            self.assertFalse(tracemalloc.is_tracing())
@@ -0,0 +1,35 @@
+import unittest
+
+import numpy as np
+
+from distance_calculations import CD, ED, MD, SD
+from neighbor_index import BruteForceIndex, KDTreeIndex, build_index
+
+
+class TestKDTreeIndex(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        # 0.1cm resolution, like the iris data, so ties are common
+        self.training = np.round(rng.uniform(0.0, 8.0, (5000, 4)), 1)
+        self.queries = np.round(rng.uniform(-1.0, 9.0, (200, 4)), 1)
+
+    def test_same_as_brute_force(self):
+        for algorithm in (ED(), MD(), CD()):
+            brute = BruteForceIndex(self.training, algorithm)
+            tree = KDTreeIndex(self.training, algorithm)
+            for k in (1, 4, 9):
+                with self.subTest(algorithm=type(algorithm).__name__, k=k):
+                    np.testing.assert_array_equal(tree.query(self.queries, k), brute.query(self.queries, k))
+
+    def test_k_larger_than_training(self):
+        tree = KDTreeIndex(self.training[:10], ED())
+        brute = BruteForceIndex(self.training[:10], ED())
+        np.testing.assert_array_equal(tree.query(self.queries, 25), brute.query(self.queries, 25))
+
+    def test_sorensen_is_brute_force(self):
+        self.assertRaises(ValueError, KDTreeIndex, self.training, SD())
+        self.assertIsInstance(build_index(self.training, SD()), BruteForceIndex)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+
+from classes import Hyperparameter, TrainingData, TrainingKnownSample, UnknownSample
+from distance_calculations import ED
+from prediction_cache import PredictionCache
+from test_classes import iris_like_rows
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestPredictionCache(unittest.TestCase):
+    def setUp(self):
+        self.data = TrainingData("cache")
+        self.data.load(iris_like_rows(400))
+        self.clock = Clock()
+        self.cache = PredictionCache(max_entries=50, ttl=10, clock=self.clock)
+        self.h = Hyperparameter(3, ED(), self.data, cache=self.cache)
+        self.unknowns = [
+            UnknownSample(s.sepal_length, s.sepal_width, s.petal_length, s.petal_width) for s in self.data.testing[:40]
+        ]
+
+    def test_same_answers(self):
+        expected = Hyperparameter(3, ED(), self.data).classify_batch(self.unknowns)
+        self.assertEqual(self.h.classify_batch(self.unknowns), expected)
+        self.assertEqual(self.h.classify_batch(self.unknowns), expected)
+        self.assertEqual([self.h.classify(u) for u in self.unknowns], expected)
+        stats = self.cache.stats()
+        distinct = {(u.sepal_length, u.sepal_width, u.petal_length, u.petal_width) for u in self.unknowns}
+        self.assertEqual(stats["misses"], len(distinct))
+        self.assertEqual(stats["hits"] + stats["misses"], 3 * len(self.unknowns))
+
+    def test_quantized_key(self):
+        u = self.unknowns[0]
+        self.h.classify(u)
+        near = UnknownSample(u.sepal_length + 0.01, u.sepal_width - 0.02, u.petal_length, u.petal_width + 0.04)
+        self.h.classify(near)
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_ttl(self):
+        self.h.classify(self.unknowns[0])
+        self.clock.now = 11
+        self.h.classify(self.unknowns[0])
+        self.assertEqual((self.cache.hits, self.cache.expirations), (0, 1))
+
+    def test_invalidated_by_training_change(self):
+        self.h.classify(self.unknowns[0])
+        self.data.add_training([TrainingKnownSample.from_dict(iris_like_rows(1, seed=3)[0])])
+        self.h.classify(self.unknowns[0])
+        self.assertEqual((self.cache.hits, self.cache.invalidations), (0, 1))
+
+    def test_bounded(self):
+        self.h.classify_batch(self.data.testing)
+        self.assertEqual(len(self.cache), 50)
+        self.assertGreater(self.cache.evictions, 0)
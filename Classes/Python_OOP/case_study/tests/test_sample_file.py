@@ -0,0 +1,57 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from classes import Hyperparameter, TrainingData
+from distance_calculations import ED, SD
+from sample_file import map_sample_stores, open_training_data, write_training_data
+from test_classes import iris_like_rows
+
+
+class TestSampleFile(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name) / "iris.samples"
+        self.data = TrainingData("source")
+        self.data.load(iris_like_rows(300))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        write_training_data(self.data, self.path)
+        mapped = open_training_data(self.path, "mapped")
+        self.assertEqual([repr(s) for s in mapped.training], [repr(s) for s in self.data.training])
+        self.assertEqual([repr(s) for s in mapped.testing], [repr(s) for s in self.data.testing])
+        for algorithm in (ED(), SD()):
+            for data in (self.data, mapped):
+                Hyperparameter(5, algorithm, data).test()
+            self.assertEqual(
+                [s.classification for s in mapped.testing], [s.classification for s in self.data.testing]
+            )
+
+    def test_training_matrix_is_not_copied(self):
+        write_training_data(self.data, self.path)
+        training, _ = map_sample_stores(self.path)
+        matrix = training.packed().matrix
+        self.assertFalse(matrix.flags.owndata)
+        self.assertFalse(matrix.flags.writeable)
+        self.assertIs(training.matrix(), matrix)
+        with self.assertRaises(TypeError):
+            training.append(self.data.training[0])
+
+    def test_float32(self):
+        write_training_data(self.data, self.path, dtype=np.float32)
+        training, _ = map_sample_stores(self.path)
+        np.testing.assert_allclose(training.matrix(), self.data.training_matrix().matrix, rtol=1e-6)
+
+    def test_unvalidated_load(self):
+        data = TrainingData("bad")
+        data.load([{"sepal_length": "x"}])
+        self.assertRaises(RuntimeError, write_training_data, data, self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
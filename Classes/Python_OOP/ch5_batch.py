@@ -0,0 +1,88 @@
+"""Rewrites many archives with one ZipBatch. Run from this directory:
+    python ch5_batch.py "archives/**/*.zip" --pattern "*.md" --find xyzzy --replace "plover's egg"
+    python ch5_batch.py archives/ --pattern "*.jpg" --resize 640x960 --quality 85 --cache ~/.cache/zips
+A directory stands for every .zip under it. Exits with 1 when any archive failed
+or any source matched no archive."""
+from __future__ import annotations
+import argparse
+import glob
+import os
+import sys
+from pathlib import Path
+from typing import List, Sequence, Tuple
+
+from ch5_managers import ImageTransformer, TextTransformer, TransformCache, Transformer, ZipBatch
+
+
+def archive_paths(sources: Sequence[str]) -> Tuple[List[Path], List[str]]:
+    """Every archive named by sources, which are globs, directories or files, each path once and sorted;
+    and the sources that named none, a mistyped glob or directory."""
+    found = set()
+    unmatched = []
+    for source in sources:
+        path = Path(source).expanduser()
+        if path.is_dir():
+            matches = set(path.rglob("*.zip"))
+        else:
+            matches = {Path(name) for name in glob.glob(str(path), recursive=True)}
+        if not matches:
+            unmatched.append(source)
+        found.update(matches)
+    return sorted(found), unmatched
+
+
+def size(text: str) -> Tuple[int, int]:
+    """--resize's WIDTHxHEIGHT; EX: size("640x960") == (640, 960)"""
+    try:
+        width, height = (int(side) for side in text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected WIDTHxHEIGHT, like 640x960, not {text!r}") from None
+    if width < 1 or height < 1:
+        raise argparse.ArgumentTypeError(f"width and height must be positive, not {text!r}")
+    return width, height
+
+
+def transformer(args: argparse.Namespace) -> Transformer:
+    if args.resize:
+        return ImageTransformer(args.resize, quality=args.quality)
+    return TextTransformer(args.find, args.replace)
+
+
+def main(argv: Sequence[str] = ()) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("archives", nargs="+", help="globs (quote them), directories or archives")
+    parser.add_argument("--pattern", required=True, help='members to transform, e.g. "*.jpg"')
+    kind = parser.add_mutually_exclusive_group(required=True)
+    kind.add_argument("--find", help="regular expression; needs --replace")
+    kind.add_argument("--resize", type=size, help="WIDTHxHEIGHT")
+    parser.add_argument("--replace", help='what --find matches become; "" deletes them')
+    parser.add_argument("--quality", type=int, default=75)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--writers", type=int, default=4, help="archives written at the same time")
+    parser.add_argument("--cache", type=Path, help="TransformCache directory")
+    parser.add_argument("--cache-max-mb", type=int, default=1024)
+    parser.add_argument("--quiet", action="store_true", help="no line per archive")
+    args = parser.parse_args(argv or None)
+    if args.find is not None and args.replace is None: #rather than silently deleting every match
+        parser.error("--find needs --replace")
+
+    archives, unmatched = archive_paths(args.archives)
+    for source in unmatched: #a nightly job mustn't read "0 archives" as success
+        print(f"{source}: no archives found", file=sys.stderr)
+    cache = TransformCache(args.cache.expanduser(), args.cache_max_mb * 2**20) if args.cache else None
+    batch = ZipBatch(
+        archives, transformer(args), args.pattern,
+        workers=args.workers, writers=args.writers, cache=cache, progress=not args.quiet,
+    )
+    stats = batch.process_files()
+    print(f"{stats['archives']} archives ({stats['failed']} failed), {stats['members']} members: "
+          f"{stats['transformed']} transformed, {stats['cached']} cached, {stats['copied']} copied")
+    print(f"{stats['seconds']:.1f}s: {stats['archives_per_second']:.1f} archives/s, "
+          f"{stats['members_per_second']:.1f} members/s, {stats['mb_per_second']:.1f} MB/s")
+    if "cache_hit_rate" in stats:
+        print(f"cache hit rate {stats['cache_hit_rate']:.0%}")
+    return 1 if batch.failed or unmatched else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""Timing checks for the ch5_managers ZipProcessor. Run from this directory:
+    python ch5_benchmarks.py [archive size in MB, default 1024] [images, default 2000]"""
+from __future__ import annotations
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+from contextlib import redirect_stdout
+from pathlib import Path
+
+from PIL import Image
+
+from ch5_managers import ImageTransformer, TextTransformer, Transformer, ZipProcessor
+
+
+def noise_jpegs(count: int = 8, size: tuple[int, int] = (1200, 1600)) -> list[bytes]:
+    """A few noisy JPEGs, mixed per archive member, so generating archives stays fast."""
+    tiles = []
+    for _ in range(count):
+        tile = Image.effect_noise(size, 64).convert("RGB")
+        buffer = io.BytesIO()
+        tile.save(buffer, format="JPEG", quality=90)
+        tiles.append(buffer.getvalue())
+    return tiles
+
+
+def synthetic_archive(path: Path, size_mb: int, seed: int = 42) -> tuple[int, int]:
+    """An archive with about size_mb of member data: stored noisy 1200x1600 JPEGs, and deflated
+    log-like .txt members with "xyzzy" in them, alternating. Returns (images, texts)."""
+    rng = random.Random(seed)
+    words = ["alpha", "beta", "gamma", "delta", "xyzzy", "error", "ok", "GET", "/index.html", "200"]
+    tiles = noise_jpegs()
+    images = texts = 0
+    written = 0
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        while written < size_mb * 1024 * 1024:
+            if images <= texts:
+                data = tiles[rng.randrange(len(tiles))]
+                archive.writestr(zipfile.ZipInfo(f"images/{images:06}.jpg"), data) #JPEGs are stored, not deflated
+                images += 1
+            else:
+                lines = (" ".join(rng.choices(words, k=12)) for _ in range(20_000))
+                data = "\n".join(lines).encode()
+                archive.writestr(f"logs/{texts:06}.txt", data)
+                texts += 1
+            written += len(data)
+    return images, texts
+
+
+def timed_run(source: Path, work: Path, transformer: Transformer, pattern: str, workers: int) -> float:
+    shutil.copyfile(source, work)
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        ZipProcessor(work, transformer, pattern, workers=workers).process_files()
+    return time.perf_counter() - start
+
+
+def bench_workers(size_mb: int = 1024) -> None:
+    """Serial ZipProcessor against workers=cpu_count, for images (process pool) and text (thread pool)."""
+    workers = os.cpu_count() or 1
+    with tempfile.TemporaryDirectory() as directory:
+        source = Path(directory) / "synthetic.zip"
+        images, texts = synthetic_archive(source, size_mb)
+        work = Path(directory) / "work.zip"
+        print(f"archive: {source.stat().st_size / 2**20:.0f}MB, {images} images, {texts} text members")
+        for transformer, pattern, count in (
+                (ImageTransformer(), "*.jpg", images),
+                (TextTransformer("xyzzy", "plover's egg"), "*.txt", texts),
+        ):
+            serial = timed_run(source, work, transformer, pattern, 0)
+            parallel = timed_run(source, work, transformer, pattern, workers)
+            print(f"{type(transformer).__name__} {pattern}: serial {serial:.1f}s ({count / serial:.1f}/s), "
+                  f"workers={workers} {parallel:.1f}s ({count / parallel:.1f}/s), {serial / parallel:.2f}x")
+
+
+def bench_images(count: int = 2000, size: tuple[int, int] = (3000, 4000)) -> None:
+    """Images/sec resizing count camera sized JPEGs to 640x960: the old path (full size decode and
+    resample, one at a time) against draft/reduce, serial and batched on a process pool of cpu_count.
+    draft only helps when size is at least twice 640x960."""
+    workers = os.cpu_count() or 1
+    with tempfile.TemporaryDirectory() as directory:
+        source = Path(directory) / "images.zip"
+        tiles = noise_jpegs(4, size)
+        with zipfile.ZipFile(source, "w") as archive:
+            for n in range(count):
+                archive.writestr(f"images/{n:06}.jpg", tiles[n % len(tiles)])
+        work = Path(directory) / "work.zip"
+        for label, transformer, pool in (
+                ("full size resample", ImageTransformer(draft=False, reducing_gap=None), 0),
+                ("draft + reduce", ImageTransformer(), 0),
+                (f"draft + reduce, workers={workers}", ImageTransformer(), workers),
+        ):
+            elapsed = timed_run(source, work, transformer, "*.jpg", pool)
+            print(f"{label:32} {elapsed:6.1f}s {count / elapsed:8.1f} images/s")
+
+
+if __name__ == "__main__":
+    bench_workers(int(sys.argv[1]) if len(sys.argv) > 1 else 1024)
+    bench_images(int(sys.argv[2]) if len(sys.argv) > 2 else 2000)
@@ -62,6 +62,8 @@ if __name__ == "__main__":
 ################################################
 #Refactored code for more modularity:
 from abc import ABC, abstractmethod
+import shutil
+import tempfile
 
 class ZipProcessor(ABC):
     def __init__(self, archive:Path) -> None:
@@ -69,151 +71,923 @@ class ZipProcessor(ABC):
             self._pattern:str
 
     def process_files(self, pattern:str) -> None:
+        """Writes the new archive to a temporary file that replaces the original once it's complete
+        (see atomic_output): a failure leaves the original as it was, and there's no .old backup."""
         self._pattern = pattern
-        input_path, output_path = self.make_backup()
-        with zipfile.ZipFile(output_path, 'w') as output: 
-            with zipfile.ZipFile(input_path) as input:  
-                self.copy_and_transform(input, output)
-
-    def _make_backup(self) -> tuple[Path, Path]:
-        input_path = self.archive_path.with_suffix(f"{self.archive_path.suffix}.old")
-        output_path = self.archive_path
-        self.archive_path.rename(input_path)
-        return input_path, output_path
-    
+        with atomic_output(self.archive_path) as output_file:
+            with zipfile.ZipFile(output_file, 'w') as output:
+                with zipfile.ZipFile(self.archive_path) as input:
+                    self._copy_and_transform(input, output)
+
     def _copy_and_transform(self, input:zipfile.ZipFile, output:zipfile.ZipFile) -> None:
+        """Only matching members are extracted, one at a time into a temporary directory, for _transform;
+        the rest are copied still compressed (see copy_member_raw)."""
         for item in input.infolist():
-            extracted = Path(input.extract(item))
-            if self.matches(item):
+            if self._matches(item):
                 print(f"Transform {item}")
-                self.transform(extracted)
+                with tempfile.TemporaryDirectory() as directory:
+                    extracted = Path(input.extract(item, directory))
+                    self._transform(extracted)
+                    self._write(output, item, extracted)
             else:
                 print(f"Ignore    {item}")
-            output.write(extracted, item.filename)
-            self.remove_under_cwd(extracted)
+                copy_member_raw(input, output, item)
+
+    def _write(self, output:zipfile.ZipFile, item:zipfile.ZipInfo, extracted:Path) -> None:
+        """Writes the transformed file under the member's name, date, attributes and compression."""
+        zinfo = zipfile.ZipInfo(item.filename, item.date_time)
+        zinfo.compress_type = item.compress_type
+        zinfo.external_attr = item.external_attr
+        zinfo.file_size = extracted.stat().st_size
+        with extracted.open("rb") as source, output.open(zinfo, 'w', force_zip64=zinfo.file_size > zipfile.ZIP64_LIMIT) as target:
+            shutil.copyfileobj(source, target, 1 << 20)
 
     def _matches(self, item:zipfile.ZipInfo) -> bool:
         return (not item.is_dir() and fnmatch.fnmatch(item.filename, self._pattern))
-    
-    def _remove_under_cwd(self, extracted:Path) -> None:
-        extracted.unlink()
-        for parent in extracted.parents:
-            if parent in extracted.parents:
-                if parent == Path.cwd():
-                    break
-                parent.rmdir()
 
     @abstractmethod
-    def transform(self, extracted:Path) -> None:
+    def _transform(self, extracted:Path) -> None:
          ...
 
 
+# Streaming find and replace, shared by TextTweaker and TextTransformer.
+# re.sub needs the whole text in memory; stream_sub only ever holds about buffer_size characters.
+import io
+import os
+from typing import Optional, TextIO
+try:
+    from re import _parser as sre_parse #the parser behind re.compile; it knows how wide a match can be
+except ImportError: #Python < 3.11
+    import sre_parse # type: ignore[no-redef]
+
+def _has_lookaround(tree:sre_parse.SubPattern) -> bool:
+    stack: list = [tree]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, sre_parse.SubPattern):
+            node = node.data
+        if isinstance(node, (list, tuple)):
+            if len(node) == 2 and node[0] in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+                return True
+            stack.extend(node)
+    return False
+
+def match_width(pattern:re.Pattern[str]) -> Optional[int]:
+    """The most characters one match can span, or None when that is unbounded (e.g. "a+")
+    or a lookahead/lookbehind can look past the match."""
+    tree = sre_parse.parse(pattern.pattern, pattern.flags)
+    width = tree.getwidth()[1]
+    if width >= int(sre_parse.MAXREPEAT) or _has_lookaround(tree):
+        return None
+    return width
+
+def stream_sub(
+        pattern:re.Pattern[str], replace:str, source:TextIO, target:TextIO,
+        max_match:Optional[int], buffer_size:int=1 << 20,
+) -> None:
+    """Writes pattern.sub(replace, source.read()) to target, reading buffer_size characters at a time.
+    A position is only settled when max_match + 1 characters after it have been read (the +1 is for
+    $ and \\b), so a match across two reads is found the same as in the whole text. Every restart
+    is where a non-empty match ended, or past a stretch where nothing matched; that's the same state
+    re.sub's own scan would be in. With max_match None the whole text is read at once."""
+    if max_match is None:
+        target.write(pattern.sub(replace, source.read()))
+        return
+    literal = "\\" not in replace #re.sub takes the same shortcut
+    buffer = ""
+    pos = 0 #buffer[:pos] is written out, or only kept for \\b and lookbehind context
+    while True:
+        chunk = source.read(buffer_size)
+        buffer += chunk
+        done = not chunk
+        safe = len(buffer) - max_match - 1
+        if not done and safe <= pos:
+            continue
+        out = []
+        for m in pattern.finditer(buffer, pos):
+            if not done and m.start() >= safe:
+                break
+            out.append(buffer[pos:m.start()])
+            out.append(replace if literal else m.expand(replace))
+            pos = m.end()
+        if done:
+            out.append(buffer[pos:])
+            target.write("".join(out))
+            return
+        restart = max(safe, pos)
+        out.append(buffer[pos:restart])
+        target.write("".join(out))
+        keep = min(restart, max_match + 1)
+        buffer = buffer[restart - keep:]
+        pos = keep
+
+
 class TextTweaker(ZipProcessor):
     """EX: TextTweaker(zip_data).find_and_replace("xyzzy", "plover's egg").process_files("*.md")"""
-    def __init__(self, archive:Path) -> None:
+    def __init__(self, archive:Path, buffer_size:int=1 << 20) -> None:
         super().__init__(archive)
-        self.find: str
+        self.find: re.Pattern[str]
         self.replace: str
+        self.max_match: Optional[int]
+        self.buffer_size = buffer_size
 
     def find_and_replace(self, find:str, replace:str) -> "TextTweaker":
-        """updates the state of the object"""
-        self.find = find
+        """updates the state of the object; the pattern is compiled here, once, not per file"""
+        self.find = re.compile(find)
         self.replace = replace
+        self.max_match = match_width(self.find)
         return self
     
     def _transform(self, extracted:Path) -> None:
-        input_text = extracted.read_text()
-        output_text = re.sub(self.find, self.replace, input_text)
-        extracted.write_text(output_text)
+        transformed = extracted.with_name(f"{extracted.name}.new")
+        with extracted.open(encoding="utf-8", newline="") as source, transformed.open("w", encoding="utf-8", newline="") as target:
+            stream_sub(self.find, self.replace, source, target, self.max_match, self.buffer_size)
+        os.replace(transformed, extracted)
 
 from PIL import Image
+
+def scaled_image(image:Image.Image, size:tuple[int, int], draft:bool=True, reducing_gap:Optional[float]=2.0) -> Image.Image:
+    """image resized to size. draft=True lets a JPEG decode at 1/2, 1/4 or 1/8 scale straight from
+    the DCT data (never below size), and reducing_gap has resize() shrink by whole factors with the
+    cheap Image.reduce() first; both are much faster than resampling from full size."""
+    if draft and image.format == "JPEG":
+        image.draft(image.mode, size)
+    return image.resize(size, reducing_gap=reducing_gap)
+
 class ImgTweaker(ZipProcessor):
     """EX: ImgTweaker(zip_data).process_files("*.jpg")"""
+    size = (640, 960)
+    quality = 75 #JPEG and WebP; Pillow's default
+
     def _transform(self, extracted:Path) -> None:
-         image = Image.open(extracted)
-         scaled = image.resize(size=(640, 960))
-         scaled.save(extracted)
+         with Image.open(extracted) as image:
+             scaled = scaled_image(image, self.size)
+             image_format = image.format
+         scaled.save(extracted, format=image_format, quality=self.quality)
 
 #######################################################
 #######################################################
 #######################################################
 ## Refactored to use composition instead of inheritance
+## Streams the members instead of extracting them to a temporary directory (see ZipProcessor._copy_and_transform)
 
 from pathlib import Path
+import copy
+import hashlib
+import io
+import json
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
 import zipfile
+import zlib
 import fnmatch
 import re
 from abc import ABC, abstractmethod
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import IO, Deque, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
 from PIL import Image
 
 # Define a transformer interface that declares a transform method.
 class Transformer(ABC):
+    pool = "thread" #ZipProcessor(workers=N) runs transform_stream on a "thread" or a "process" pool
+    batch_size = 1 #members per pool task; more amortizes the per-task cost when members are small
+    tuning: Tuple[str, ...] = ("pool", "batch_size") #attributes that change how fast, never what comes out
+
     @abstractmethod
     def transform(self, extracted: Path) -> None:
         pass
 
+    def transform_stream(self, source: IO[bytes], target: IO[bytes]) -> None:
+        """Transforms one member's bytes from source into target.
+        The default goes through a temporary file for transformers that only know transform(Path);
+        the concrete transformers below override it to work on the bytes directly."""
+        with tempfile.TemporaryDirectory() as directory:
+            extracted = Path(directory) / "member"
+            with extracted.open("wb") as temp:
+                shutil.copyfileobj(source, temp)
+            self.transform(extracted)
+            with extracted.open("rb") as temp:
+                shutil.copyfileobj(temp, target)
+
+    def cache_identity(self) -> str:
+        """What TransformCache keys on besides the member: the class and every parameter but the tuning ones.
+        Change the class name, or add a parameter, when a change to transform makes old results wrong."""
+        cls = type(self)
+        parameters = sorted((name, repr(value)) for name, value in vars(self).items() if name not in self.tuning)
+        return f"{cls.__module__}.{cls.__qualname__}{parameters}"
+
 # Concrete transformer for text files.
 class TextTransformer(Transformer):
-    def __init__(self, find: str, replace: str) -> None:
+    """Streams each member through stream_sub, so memory stays around buffer_size characters
+    however big the member is, as long as the pattern has a bounded match width (see match_width);
+    other patterns are applied to the whole member at once."""
+    tuning = Transformer.tuning + ("buffer_size",)
+
+    def __init__(self, find: str, replace: str, encoding: str = "utf-8", buffer_size: int = 1 << 20) -> None:
         self.find = find
         self.replace = replace
+        self.encoding = encoding
+        self.buffer_size = buffer_size
+        self.pattern = re.compile(find) #once per processor, not per member
+        self.max_match = match_width(self.pattern)
 
-    def _transform(self, extracted: Path) -> None:
-        input_text = extracted.read_text()
-        output_text = re.sub(self.find, self.replace, input_text)
-        extracted.write_text(output_text)
+    def transform(self, extracted: Path) -> None:
+        with extracted.open("rb") as source, tempfile.SpooledTemporaryFile() as target:
+            self.transform_stream(source, target)
+            target.seek(0)
+            with extracted.open("wb") as rewritten:
+                shutil.copyfileobj(target, rewritten)
+
+    def transform_stream(self, source: IO[bytes], target: IO[bytes]) -> None:
+        text_source = io.TextIOWrapper(source, encoding=self.encoding, newline="")
+        text_target = io.TextIOWrapper(target, encoding=self.encoding, newline="")
+        stream_sub(self.pattern, self.replace, text_source, text_target, self.max_match, self.buffer_size)
+        text_target.flush()
+        text_target.detach() #leave target open for the caller
+        text_source.detach()
 
 # Concrete transformer for images.
 class ImageTransformer(Transformer):
-    def _transform(self, extracted: Path) -> None:
-        image = Image.open(extracted)
-        scaled = image.resize((640, 960))
-        scaled.save(extracted)
+    """Resizes to size and re-encodes in the image's own format, see scaled_image.
+    draft=False, reducing_gap=None resamples from the full size image, the way it used to."""
+    pool = "process" #resizing is CPU bound Python + C, so it needs its own interpreters
+    batch_size = 8 #each task pickles the transformer and a result; images are a few hundred KB
+
+    def __init__(
+            self, size: Tuple[int, int] = (640, 960), quality: int = 75,
+            draft: bool = True, reducing_gap: Optional[float] = 2.0,
+    ) -> None:
+        self.size = size
+        self.quality = quality #JPEG and WebP; other formats ignore it
+        self.draft = draft
+        self.reducing_gap = reducing_gap
+
+    def transform(self, extracted: Path) -> None:
+        with extracted.open("rb") as source:
+            data = source.read()
+        with extracted.open("wb") as target:
+            self.transform_stream(io.BytesIO(data), target)
+
+    def transform_stream(self, source: IO[bytes], target: IO[bytes]) -> None:
+        with Image.open(io.BytesIO(source.read())) as image: #seeking inside a compressed member means decompressing again
+            scaled = scaled_image(image, self.size, self.draft, self.reducing_gap)
+            scaled.save(target, format=image.format, quality=self.quality)
+
+
+def write_member_raw(output_zip: zipfile.ZipFile, zinfo: zipfile.ZipInfo, chunks: Iterable[bytes]) -> None:
+    """Appends a member whose bytes are already compressed, with zinfo's CRC and sizes.
+    zipfile has no public API for this, so it writes the local header itself, the way
+    ZipFile._open_to_write does, and then registers the member for the central directory."""
+    zinfo.flag_bits &= ~0x08 #sizes and CRC go in the local header, no data descriptor
+    output_zip.fp.seek(output_zip.start_dir)
+    zinfo.header_offset = output_zip.fp.tell()
+    output_zip._writecheck(zinfo)
+    output_zip._didModify = True
+    output_zip.fp.write(zinfo.FileHeader())
+    for chunk in chunks:
+        output_zip.fp.write(chunk)
+    output_zip.start_dir = output_zip.fp.tell()
+    output_zip.filelist.append(zinfo)
+    output_zip.NameToInfo[zinfo.filename] = zinfo
+
+def _seek_to_data(fp: IO[bytes], item: zipfile.ZipInfo) -> None:
+    """Moves fp past the member's local header, to its compressed bytes."""
+    fp.seek(item.header_offset)
+    header = fp.read(zipfile.sizeFileHeader)
+    if header[:4] != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile(f"Bad local header for {item.filename}")
+    name_length, extra_length = struct.unpack("<HH", header[26:30])
+    fp.seek(item.header_offset + zipfile.sizeFileHeader + name_length + extra_length)
+
+def _compressed_chunks(input_zip: zipfile.ZipFile, item: zipfile.ZipInfo) -> Iterable[bytes]:
+    _seek_to_data(input_zip.fp, item)
+    remaining = item.compress_size
+    while remaining:
+        chunk = input_zip.fp.read(min(remaining, 1 << 20))
+        if not chunk:
+            raise zipfile.BadZipFile(f"Truncated member {item.filename}")
+        remaining -= len(chunk)
+        yield chunk
+
+def copy_member_raw(input_zip: zipfile.ZipFile, output_zip: zipfile.ZipFile, item: zipfile.ZipInfo) -> None:
+    """Copies a member's compressed bytes as they are: no decompression, no recompression, same CRC."""
+    zinfo = copy.copy(item)
+    zinfo.extra = zipfile._strip_extra(item.extra, (1,)) #FileHeader adds its own zip64 field if needed
+    write_member_raw(output_zip, zinfo, _compressed_chunks(input_zip, item))
+
+
+# ZipProcessor(workers=N): the pool workers read, transform and compress members themselves,
+# so only compressed bytes travel back to the one writer.
+class MemberBatch:
+    """Matching members that go to the pool as one task; future is set once it's submitted."""
+    def __init__(self) -> None:
+        self.items: List[zipfile.ZipInfo] = []
+        self.future: Optional["Future[List[TransformedMember]]"] = None
+
+class MemberReader:
+    """Reads members of one archive from any number of threads: each thread opens its own ZipFile once."""
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._local = threading.local()
+        self._opened: List[zipfile.ZipFile] = []
+        self._lock = threading.Lock()
+
+    def open(self, name: str) -> IO[bytes]:
+        archive = getattr(self._local, "archive", None)
+        if archive is None:
+            archive = self._local.archive = zipfile.ZipFile(self.path)
+            with self._lock:
+                self._opened.append(archive)
+        return archive.open(name)
+
+    def close(self) -> None:
+        with self._lock:
+            for archive in self._opened:
+                archive.close()
+            self._opened.clear()
+
+class ArchiveRef(NamedTuple):
+    """How a process pool task names its archive. The stat fields tell a rewritten or replaced
+    archive from the one the task was made for, even where mtimes are coarse."""
+    path: Path
+    mtime_ns: int
+    ino: int
+    size: int
+
+    @classmethod
+    def of(cls, path: Path) -> "ArchiveRef":
+        stat = path.stat()
+        return cls(path, stat.st_mtime_ns, stat.st_ino, stat.st_size)
+
+class ArchiveFile:
+    """A process pool task's archive, open for the task alone: members are read at the offsets in the
+    ZipInfos sent with the task, so the central directory isn't parsed again per task, and no worker
+    keeps an archive open after its tasks, which on Windows would stop the writer's os.replace."""
+    def __init__(self, archive: ArchiveRef, items: List[zipfile.ZipInfo]) -> None:
+        self.file = open(archive.path, "rb")
+        stat = os.fstat(self.file.fileno())
+        if ArchiveRef(archive.path, stat.st_mtime_ns, stat.st_ino, stat.st_size) != archive:
+            self.file.close()
+            raise zipfile.BadZipFile(f"{archive.path} changed after its members were submitted")
+        self.items = {item.filename: item for item in items}
+
+    def open(self, name: str) -> IO[bytes]:
+        """One member at a time: they share the file position."""
+        item = self.items[name]
+        _seek_to_data(self.file, item)
+        return zipfile.ZipExtFile(self.file, "r", item) #decompresses and checks the CRC, like ZipFile.open
+
+    def __enter__(self) -> "ArchiveFile":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.file.close()
+
+def make_pool(transformer: Transformer, workers: int) -> Executor:
+    """A pool of the transformer's kind for transform_members tasks."""
+    if transformer.pool == "process":
+        return ProcessPoolExecutor(workers)
+    return ThreadPoolExecutor(workers, thread_name_prefix="transform")
+
+class TransformedMember(NamedTuple):
+    data: bytes #compressed with compress_type when compressed is True; empty when spilled
+    crc: int
+    file_size: int
+    compressed: bool
+    spill: Optional[str] = None #a temporary file holding the data instead, for big members; the writer deletes it
+
+    @property
+    def size(self) -> int:
+        return os.path.getsize(self.spill) if self.spill is not None else len(self.data)
+
+    def chunks(self) -> Iterator[bytes]:
+        if self.spill is None:
+            yield self.data
+            return
+        with open(self.spill, "rb") as spilled:
+            for chunk in iter(lambda: spilled.read(1 << 20), b""):
+                yield chunk
+
+    def discard(self) -> None:
+        if self.spill is not None:
+            Path(self.spill).unlink(missing_ok=True)
+
+class SpillBuffer:
+    """Collects bytes in memory up to spool_size, then in a named temporary file, which unlike a
+    SpooledTemporaryFile can be handed from a worker process to the writer by its path."""
+    def __init__(self, spool_size: int) -> None:
+        self.spool_size = spool_size
+        self.memory = io.BytesIO()
+        self.file: Optional[IO[bytes]] = None
+        self.path: Optional[str] = None
+
+    def write(self, data: bytes) -> None:
+        if self.file is None and self.memory.tell() + len(data) > self.spool_size:
+            fd, self.path = tempfile.mkstemp(prefix="zipmember-")
+            self.file = os.fdopen(fd, "wb")
+            self.file.write(self.memory.getbuffer())
+            self.memory = io.BytesIO()
+        (self.file or self.memory).write(data)
+
+    def result(self) -> Tuple[bytes, Optional[str]]:
+        """(data, None) or, once spilled, (b"", path)."""
+        if self.file is None:
+            return self.memory.getvalue(), None
+        self.file.close()
+        return b"", self.path
+
+    def discard(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            Path(self.path or "").unlink(missing_ok=True)
+
+def transform_members(
+        source: Union[MemberReader, ArchiveRef], items: List[zipfile.ZipInfo], transformer: Transformer,
+        spool_size: int,
+) -> List[TransformedMember]:
+    """One pool task: transformer.batch_size members.
+    In a process pool the source is an ArchiveRef, and the worker opens the archive itself (see ArchiveFile)."""
+    if isinstance(source, ArchiveRef):
+        with ArchiveFile(source, items) as archive:
+            return [transform_member(archive, item.filename, transformer, item.compress_type, spool_size) for item in items]
+    return [transform_member(source, item.filename, transformer, item.compress_type, spool_size) for item in items]
+
+def transform_member(
+        reader: Union[MemberReader, ArchiveFile, zipfile.ZipFile], name: str, transformer: Transformer, compress_type: int,
+        spool_size: int,
+) -> TransformedMember:
+    """Transforms and compresses one member. The transformed bytes and the compressed ones each stay
+    in memory up to spool_size; beyond that they go to temporary files, and the result is spilled."""
+    output = SpillBuffer(spool_size)
+    try:
+        with tempfile.SpooledTemporaryFile(max_size=spool_size) as transformed:
+            with reader.open(name) as source:
+                transformer.transform_stream(source, transformed)
+            file_size = transformed.tell()
+            transformed.seek(0)
+            compressor = None
+            if compress_type == zipfile.ZIP_DEFLATED:
+                compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15) #what zipfile uses
+            crc = 0
+            for chunk in iter(lambda: transformed.read(1 << 20), b""):
+                crc = zlib.crc32(chunk, crc)
+                output.write(compressor.compress(chunk) if compressor else chunk)
+            if compressor:
+                output.write(compressor.flush())
+    except BaseException:
+        output.discard()
+        raise
+    data, spill = output.result()
+    compressed = compress_type in (zipfile.ZIP_DEFLATED, zipfile.ZIP_STORED) #others are compressed by the writer
+    return TransformedMember(data, crc, file_size, compressed, spill)
+
+def _discard_results(future: "Future[List[TransformedMember]]") -> None:
+    """For a batch that won't be written: removes its spilled members once it's done."""
+    if not future.cancelled() and future.exception() is None:
+        for member in future.result():
+            member.discard()
+
+
+# Rerunning a job over an archive where most members haven't changed: the transformed members of
+# earlier runs are kept on disk, compressed, and copied back without transforming them again.
+class TransformCache:
+    """A persistent, size bounded LRU cache of transformed members in directory.
+    A member is known by its CRC32 and size from the ZipInfo, and is cached per transformer
+    (Transformer.cache_identity) and compression. EX:
+        cache = TransformCache(Path("~/.cache/zip_transforms").expanduser(), max_bytes=2**30)
+        ZipProcessor(Path("archive.zip"), TextTransformer("xyzzy", "plover's egg"), "*.md", cache=cache).process_files()"""
+    def __init__(self, directory: Path, max_bytes: int = 1 << 30) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.index_path = directory / "index.json"
+        #digest -> [crc, file_size, compressed, stored bytes], least recently used first
+        self._index: Dict[str, list] = json.loads(self.index_path.read_text()) if self.index_path.exists() else {}
+        self.size = sum(entry[3] for entry in self._index.values())
+        self._lock = threading.Lock() #a ZipBatch writes several archives at once
+        self._remove_unindexed()
+        self.reset_stats()
+
+    def _remove_unindexed(self) -> None:
+        """Deletes entries a run put() but never saved in the index (it was killed), and leftover
+        temporary files: nothing would ever count or evict them."""
+        for path in self.directory.glob("??/*"):
+            if path.name not in self._index:
+                path.unlink(missing_ok=True)
+
+    def reset_stats(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, transformer_identity: str, item: zipfile.ZipInfo, compress_type: int) -> str:
+        source = f"{transformer_identity}\0{item.CRC}\0{item.file_size}\0{compress_type}"
+        return hashlib.sha256(source.encode()).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / key
+
+    def get(self, key: str, spool_size: int = 64 * 1024 * 1024) -> Optional[TransformedMember]:
+        """The cached member, read into memory, or copied to a spill file when it's over spool_size:
+        the cache's own file could be evicted before the member is written."""
+        with self._lock:
+            entry = self._index.get(key)
+            member = None
+            if entry is not None:
+                crc, file_size, compressed, size = entry
+                try:
+                    if size > spool_size:
+                        fd, spill = tempfile.mkstemp(prefix="zipmember-")
+                        os.close(fd)
+                        shutil.copyfile(self._path(key), spill)
+                        member = TransformedMember(b"", crc, file_size, compressed, spill)
+                    else:
+                        member = TransformedMember(self._path(key).read_bytes(), crc, file_size, compressed)
+                except FileNotFoundError: #removed by hand
+                    self.size -= self._index.pop(key)[3]
+            if member is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._index[key] = self._index.pop(key) #most recently used
+            return member
+
+    def put(self, key: str, member: TransformedMember) -> None:
+        size = member.size
+        if size > self.max_bytes:
+            return
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        temp = path.with_suffix(f".{threading.get_ident()}.tmp") #written outside the lock
+        if member.spill is not None:
+            shutil.copyfile(member.spill, temp)
+        else:
+            temp.write_bytes(member.data)
+        with self._lock:
+            os.replace(temp, path)
+            self._insert(key, member, size)
+
+    def _insert(self, key: str, member: TransformedMember, size: int) -> None:
+        if key in self._index:
+            self.size -= self._index.pop(key)[3]
+        self._index[key] = [member.crc, member.file_size, member.compressed, size]
+        self.size += size
+        while self.size > self.max_bytes:
+            oldest = next(iter(self._index))
+            self.size -= self._index.pop(oldest)[3]
+            self._path(oldest).unlink(missing_ok=True)
+            self.evictions += 1
+
+    def save(self) -> None:
+        """Writes the index; ZipProcessor calls this at the end of every run, failed or not."""
+        temp = self.index_path.with_suffix(".tmp")
+        with self._lock:
+            index = json.dumps(self._index)
+        temp.write_text(index)
+        os.replace(temp, self.index_path)
+
+    def stats(self) -> Dict[str, float]:
+        """Counters since reset_stats(), which ZipProcessor calls at the start of every run."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self._index),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+        }
+
+
+def _fsync_directory(directory: Path) -> None:
+    if os.name != "posix": #Windows can't open a directory; NTFS journals the rename
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+@contextmanager
+def atomic_output(archive_path: Path) -> Iterator[IO[bytes]]:
+    """A temporary file next to the archive that replaces it, in one os.replace, once it's
+    complete and on disk. If anything fails first, the archive is left as it was and the
+    temporary file is removed: no .old copy to clean up, and never a half written archive."""
+    directory = archive_path.parent
+    fd, temp_name = tempfile.mkstemp(dir=directory, prefix=f".{archive_path.name}.", suffix=".tmp")
+    temp_path = Path(temp_name)
+    try:
+        with os.fdopen(fd, "w+b") as output_file:
+            yield output_file
+            output_file.flush()
+            os.fsync(output_file.fileno())
+        shutil.copymode(archive_path, temp_path) #mkstemp creates it 0600
+        os.replace(temp_path, archive_path)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    _fsync_directory(directory) #makes the rename itself durable
+
 
 # The ZipProcessor now uses composition: it receives a transformer
 # to handle file-specific modifications.
 class ZipProcessor:
-    def __init__(self, archive: Path, transformer: Transformer, pattern: str) -> None:
+    spool_size = 64 * 1024 * 1024 #a transformed member bigger than this spills from memory to a temp file, on every path
+
+    def __init__(
+            self, archive: Path, transformer: Transformer, pattern: str, workers: int = 0,
+            cache: Optional[TransformCache] = None, verbose: bool = True,
+    ) -> None:
+        """workers=N transforms matching members on a pool of N (the transformer's pool kind);
+        0 transforms them one after another in this thread.
+        With a cache, members transformed by an earlier run are copied from it instead.
+        verbose prints a line per member."""
         self.archive_path = archive
         self.transformer = transformer
         self.pattern = pattern
+        self.workers = workers
+        self.cache = cache
+        self.verbose = verbose
+        self.counts: Dict[str, int] = {} #members per action of the last rewrite: Transform, Cached, Ignore
+        self._identity = transformer.cache_identity() if cache is not None else ""
 
     def process_files(self) -> None:
-        input_path, output_path = self.make_backup()
-        with zipfile.ZipFile(output_path, 'w') as output_zip:
-            with zipfile.ZipFile(input_path) as input_zip:
-                self.copy_and_transform(input_zip, output_zip)
-
-    def _make_backup(self) -> tuple[Path, Path]:
-        backup_path = self.archive_path.with_suffix(f"{self.archive_path.suffix}.old")
-        output_path = self.archive_path
-        self.archive_path.rename(backup_path)
-        return backup_path, output_path
+        if self.cache is not None:
+            self.cache.reset_stats()
+        try:
+            self.rewrite()
+        finally:
+            if self.cache is not None:
+                self.cache.save()
+        if self.cache is not None and self.verbose:
+            stats = self.cache.stats()
+            print(f"Cache     {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%}), "
+                  f"{stats['evictions']} evicted")
+
+    def _cached(self, item: zipfile.ZipInfo) -> Optional[TransformedMember]:
+        if self.cache is None:
+            return None
+        return self.cache.get(self.cache.key(self._identity, item, item.compress_type), self.spool_size)
+
+    def _write_transformed(self, output_zip: zipfile.ZipFile, item: zipfile.ZipInfo, member: TransformedMember) -> None:
+        """Writes the member and deletes its spill file, if it has one."""
+        zinfo = zipfile.ZipInfo(item.filename, item.date_time)
+        zinfo.compress_type = item.compress_type
+        zinfo.external_attr = item.external_attr
+        try:
+            if member.compressed:
+                zinfo.CRC, zinfo.file_size, zinfo.compress_size = member.crc, member.file_size, member.size
+                write_member_raw(output_zip, zinfo, member.chunks())
+            else:
+                zinfo.file_size = member.file_size
+                with output_zip.open(zinfo, 'w', force_zip64=member.file_size > zipfile.ZIP64_LIMIT) as target:
+                    for chunk in member.chunks():
+                        target.write(chunk)
+        finally:
+            member.discard()
+
+    def rewrite(self, pool: Optional[Executor] = None) -> None:
+        """Transforms the archive in place. pool is one shared with other archives (see ZipBatch),
+        from make_pool; without it, workers=N starts a pool for this archive alone."""
+        self.counts = dict.fromkeys(("Transform", "Cached", "Ignore"), 0)
+        with atomic_output(self.archive_path) as output_file:
+            with zipfile.ZipFile(output_file, 'w') as output_zip:
+                with zipfile.ZipFile(self.archive_path) as input_zip:
+                    if pool is not None:
+                        self._copy_and_transform_parallel(input_zip, output_zip, pool)
+                    elif self.workers:
+                        with make_pool(self.transformer, self.workers) as own_pool: #closed before the os.replace
+                            self._copy_and_transform_parallel(input_zip, output_zip, own_pool)
+                    else:
+                        self._copy_and_transform(input_zip, output_zip)
+
+    def _log(self, action: str, item: zipfile.ZipInfo) -> None:
+        self.counts[action] += 1
+        if self.verbose:
+            print(f"{action:<9} {item}")
 
     def _copy_and_transform(self, input_zip: zipfile.ZipFile, output_zip: zipfile.ZipFile) -> None:
+        """Nothing touches the disk but the two archives: matching members are read with ZipFile.open,
+        transformed into a spooled buffer and written with ZipFile.open('w');
+        the rest are copied still compressed."""
         for item in input_zip.infolist():
-            extracted = Path(input_zip.extract(item))
-            if self.matches(item):
-                print(f"Transform {item}")
-                self.transformer.transform(extracted)
+            if self._matches(item):
+                cached = self._cached(item)
+                if cached is not None:
+                    self._log("Cached", item)
+                    self._write_transformed(output_zip, item, cached)
+                    continue
+                self._log("Transform", item)
+                if self.cache is not None: #the cache stores the compressed result, so compress it here
+                    member = transform_member(input_zip, item.filename, self.transformer, item.compress_type, self.spool_size)
+                    self.cache.put(self.cache.key(self._identity, item, item.compress_type), member)
+                    self._write_transformed(output_zip, item, member)
+                else:
+                    self._transform_member(input_zip, output_zip, item)
             else:
-                print(f"Ignore    {item}")
-            output_zip.write(extracted, item.filename)
-            self.remove_under_cwd(extracted)
+                self._log("Ignore", item)
+                copy_member_raw(input_zip, output_zip, item)
+
+    def _transform_member(self, input_zip: zipfile.ZipFile, output_zip: zipfile.ZipFile, item: zipfile.ZipInfo) -> None:
+        with tempfile.SpooledTemporaryFile(max_size=self.spool_size) as buffer:
+            with input_zip.open(item) as source:
+                self.transformer.transform_stream(source, buffer)
+            size = buffer.tell()
+            buffer.seek(0)
+            zinfo = zipfile.ZipInfo(item.filename, item.date_time)
+            zinfo.compress_type = item.compress_type
+            zinfo.external_attr = item.external_attr
+            zinfo.file_size = size
+            with output_zip.open(zinfo, 'w', force_zip64=size > zipfile.ZIP64_LIMIT) as target:
+                shutil.copyfileobj(buffer, target, 1 << 20)
+
+    def _copy_and_transform_parallel(
+            self, input_zip: zipfile.ZipFile, output_zip: zipfile.ZipFile, pool: Executor,
+    ) -> None:
+        """Submits the matching members to the pool, transformer.batch_size per task, as it walks the archive,
+        and writes members in their original order from this thread, the only writer. At most 4 tasks
+        per worker are in flight, each of batch_size members, and a member over spool_size comes back
+        in a temporary file, so memory stays under about 4 * workers * batch_size * spool_size however
+        big the members are. Cache hits and ignored members are written as soon as nothing ahead of
+        them waits on a batch; the hits held behind one stay under about spool_size, and past that the
+        batch is submitted even if it isn't full and waited for. The pool is the caller's."""
+        reader = MemberReader(self.archive_path)
+        task_source: Union[MemberReader, ArchiveRef] = reader
+        if self.transformer.pool == "process":
+            task_source = ArchiveRef.of(self.archive_path)
+        #(member, its batch or None, index in the batch, or what's written instead of a batch result)
+        pending: Deque[Tuple[zipfile.ZipInfo, Optional[MemberBatch], int, Optional[TransformedMember]]] = deque()
+        batch = MemberBatch()
+        in_flight = 0
+        held = 0 #bytes of the cache hits in pending
+
+        def submit(batch: MemberBatch) -> None:
+            batch.future = pool.submit(transform_members, task_source, list(batch.items), self.transformer, self.spool_size)
+
+        try:
+            for item in input_zip.infolist():
+                cached = self._cached(item) if self._matches(item) else None
+                if cached is not None:
+                    self._log("Cached", item)
+                    pending.append((item, None, 0, cached))
+                    held += cached.size
+                elif self._matches(item):
+                    self._log("Transform", item)
+                    pending.append((item, batch, len(batch.items), None))
+                    batch.items.append(item)
+                    if len(batch.items) == self.transformer.batch_size:
+                        submit(batch)
+                        batch = MemberBatch()
+                        in_flight += 1
+                else:
+                    self._log("Ignore", item)
+                    pending.append((item, None, 0, None))
+                #the batch still being filled is always behind every submitted one in pending
+                while pending and (pending[0][1] is None or in_flight > 4 * self.workers or held > self.spool_size):
+                    if pending[0][1] is batch: #too many hits wait behind it
+                        submit(batch)
+                        batch = MemberBatch()
+                        in_flight += 1
+                    entry = pending.popleft()
+                    if entry[3] is not None:
+                        held -= entry[3].size
+                    in_flight -= self._write_pending(input_zip, output_zip, *entry)
+            if batch.items:
+                submit(batch)
+            while pending:
+                self._write_pending(input_zip, output_zip, *pending.popleft())
+        finally:
+            unwritten_batches = {}
+            for _, unwritten, _, cached in pending:
+                if cached is not None:
+                    cached.discard()
+                elif unwritten is not None and unwritten.future is not None:
+                    unwritten_batches[id(unwritten)] = unwritten.future
+            for future in unwritten_batches.values():
+                if not future.cancel():
+                    future.add_done_callback(_discard_results) #runs now if it's already done
+            reader.close()
+
+    def _write_pending(
+            self, input_zip: zipfile.ZipFile, output_zip: zipfile.ZipFile,
+            item: zipfile.ZipInfo, batch: Optional[MemberBatch], index: int, cached: Optional[TransformedMember],
+    ) -> bool:
+        """Writes one member; True when it was the last of its batch."""
+        if cached is not None:
+            self._write_transformed(output_zip, item, cached)
+            return False
+        if batch is None:
+            copy_member_raw(input_zip, output_zip, item)
+            return False
+        assert batch.future is not None
+        member = batch.future.result()[index]
+        if self.cache is not None:
+            self.cache.put(self.cache.key(self._identity, item, item.compress_type), member)
+        self._write_transformed(output_zip, item, member)
+        return index == len(batch.items) - 1
 
     def _matches(self, item: zipfile.ZipInfo) -> bool:
         return not item.is_dir() and fnmatch.fnmatch(item.filename, self.pattern)
 
-    def _remove_under_cwd(self, extracted: Path) -> None:
-        extracted.unlink()
-        for parent in extracted.parents:
-            if parent == Path.cwd():
-                break
-            try:
-                parent.rmdir()
-            except Exception:
-                # Directory might not be empty or removable; just skip.
-                pass
+# Many archives, one pool: the workers start once, not per archive, and while one archive's writer
+# is opening, copying raw members or fsyncing, the other writers keep the workers busy.
+class ZipBatch:
+    """Rewrites every archive with ZipProcessor on one shared pool of workers (the transformer's kind),
+    writers archives at a time, each written in order by its own thread. EX:
+        ZipBatch(Path("nightly").glob("**/*.zip"), ImageTransformer(), "*.jpg", workers=os.cpu_count() or 1).process_files()"""
+    def __init__(
+            self, archives: Iterable[Path], transformer: Transformer, pattern: str,
+            workers: int = os.cpu_count() or 1, writers: int = 4,
+            cache: Optional[TransformCache] = None, progress: bool = True,
+    ) -> None:
+        self.archives = list(archives)
+        self.transformer = transformer
+        self.pattern = pattern
+        self.workers = workers
+        self.writers = writers
+        self.cache = cache
+        self.progress = progress #a line per archive as it finishes
+        self.failed: List[Tuple[Path, Exception]] = []
+        self.totals: Dict[str, int] = {}
+        self.seconds = 0.0
+
+    def process_files(self) -> Dict[str, float]:
+        """Rewrites every archive; one that fails is reported in failed and left as it was."""
+        if self.cache is not None:
+            self.cache.reset_stats()
+        self.failed = []
+        self.totals = dict.fromkeys(("archives", "Transform", "Cached", "Ignore", "bytes"), 0)
+        start = time.perf_counter()
+        #each archive keeps 4 * window tasks in flight, so all writers together keep about 4 per worker
+        window = max(1, self.workers // self.writers)
+        processors = [
+            ZipProcessor(path, self.transformer, self.pattern, workers=window, cache=self.cache, verbose=False)
+            for path in self.archives
+        ]
+        try:
+            with make_pool(self.transformer, self.workers) as pool:
+                pool.submit(int).result() #starts the workers now: forking once the writer threads run is unsafe
+                with ThreadPoolExecutor(self.writers, thread_name_prefix="archive") as writers:
+                    futures = {writers.submit(self._rewrite, processor, pool): processor for processor in processors}
+                    for done, future in enumerate(as_completed(futures), 1):
+                        self._finished(done, futures[future], future)
+        finally:
+            if self.cache is not None:
+                self.cache.save()
+        self.seconds = time.perf_counter() - start
+        return self.stats()
+
+    def _rewrite(self, processor: ZipProcessor, pool: Executor) -> Tuple[int, float]:
+        size = processor.archive_path.stat().st_size
+        start = time.perf_counter()
+        processor.rewrite(pool)
+        return size, time.perf_counter() - start
+
+    def _finished(self, done: int, processor: ZipProcessor, future: "Future[Tuple[int, float]]") -> None:
+        prefix = f"[{done}/{len(self.archives)}] {processor.archive_path}"
+        try:
+            size, seconds = future.result()
+        except Exception as ex:
+            self.failed.append((processor.archive_path, ex))
+            print(f"{prefix}: FAILED {ex!r}")
+            return
+        self.totals["archives"] += 1
+        self.totals["bytes"] += size
+        for action, count in processor.counts.items():
+            self.totals[action] += count
+        if self.progress:
+            counts = processor.counts
+            print(f"{prefix}: {counts['Transform']} transformed, {counts['Cached']} cached, "
+                  f"{counts['Ignore']} copied in {seconds:.2f}s")
+
+    def stats(self) -> Dict[str, float]:
+        """Totals of the last process_files() and its throughput."""
+        totals = self.totals
+        members = totals.get("Transform", 0) + totals.get("Cached", 0) + totals.get("Ignore", 0)
+        seconds = self.seconds or float("inf")
+        stats: Dict[str, float] = {
+            "archives": totals.get("archives", 0),
+            "failed": len(self.failed),
+            "members": members,
+            "transformed": totals.get("Transform", 0),
+            "cached": totals.get("Cached", 0),
+            "copied": totals.get("Ignore", 0),
+            "bytes": totals.get("bytes", 0),
+            "seconds": self.seconds,
+            "archives_per_second": totals.get("archives", 0) / seconds,
+            "members_per_second": members / seconds,
+            "mb_per_second": totals.get("bytes", 0) / 2**20 / seconds,
+        }
+        if self.cache is not None:
+            stats["cache_hit_rate"] = self.cache.stats()["hit_rate"]
+        return stats
 
 # Usage examples:
 # For text files:
@@ -222,6 +996,10 @@ class ZipProcessor:
 # processor.process_files()
 
 # For images:
-# transformer = ImageTransformer()
-# processor = ZipProcessor(Path("archive.zip"), transformer, "*.png")
+# transformer = ImageTransformer(size=(640, 960), quality=85)
+# processor = ZipProcessor(Path("archive.zip"), transformer, "*.jpg", workers=os.cpu_count() or 1)
 # processor.process_files()
+
+# For a whole directory of archives (or see ch5_batch.py):
+# batch = ZipBatch(Path("archives").glob("**/*.zip"), ImageTransformer(), "*.jpg")
+# print(batch.process_files())
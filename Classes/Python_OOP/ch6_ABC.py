@@ -1,3 +1,10 @@
+from __future__ import annotations
+import abc
+import random
+from typing import Dict, Iterable, NamedTuple, Optional, Set, Tuple, Type, Union, cast
+
+import numpy as np
+
 class MediaLoader(abc.ABC):
     @abc.abstractmethod
     def play(self) -> None:
@@ -14,6 +21,8 @@ class MediaLoader(abc.ABC):
 import abc
 
 class Die(abc.ABC):
+    faces: Tuple[int, ...] #every face, equally likely; simulate() draws from these instead of calling roll()
+
     def __init__(self) -> None:
         self.face: int
         self.roll()
@@ -26,17 +35,21 @@ class Die(abc.ABC):
         return f"{self.face}"
     
     def __mul__(self, n:int) -> "DDice":
-        for _ in range(n):
-            DDice(type(self))
-            #TODO
+        """EX: D6() * 3 is DDice(D6, D6, D6)"""
+        return DDice(*[type(self)] * n)
+
     def __rmul__(self, n:int) -> "DDice":
-        #TODO
+        return self * n
     
 class D4(Die):
+    faces = (1, 2, 4, 5)
+
     def roll(self) -> None:
-        self.face = random.choice((1,2,4,5))
+        self.face = random.choice(self.faces)
 
 class D6(Die):
+    faces = (1, 2, 3, 4, 5, 6)
+
     def roll(self) -> None:
         self.face = random.randint(1,6)
 
@@ -59,7 +72,7 @@ class SimpleDice(Dice):
             d.roll()
 
 class YachtDice(Dice):
-     """EX: sd = YachtDice()
+    """EX: sd = YachtDice()
     sd.roll()
     sd.dice
     >>> [2,2,2,6,1]
@@ -128,6 +141,65 @@ class DDice:
             return NotImplemented
 
 
+############################################
+# Simulating a DDice many times at once.
+# roll() costs a random call and an attribute write per die (plus a log call with DieMeta);
+# simulate() draws every trial of every die as one NumPy array instead, from each class's faces.
+
+class DiceSimulation(NamedTuple):
+    totals: Optional[np.ndarray] #one total per trial, adjust included; None with keep_totals=False
+    values: np.ndarray #every possible total, lowest to highest
+    counts: np.ndarray #trials that came to each of values
+    faces: Dict[str, Dict[int, int]] #die class name -> face -> times rolled
+
+    def probabilities(self) -> Dict[int, float]:
+        trials = int(self.counts.sum())
+        return {int(v): int(c) / trials for v, c in zip(self.values, self.counts)}
+
+def simulate(
+        dice:DDice, trials:int, seed:Union[int, np.random.Generator, None]=None,
+        keep_totals:bool=True, chunk:int=1 << 20,
+) -> DiceSimulation:
+    """Rolls dice trials times. The same seed and chunk give the same results. The trials are drawn chunk
+    at a time, so with keep_totals=False memory doesn't grow with trials: only the histograms are kept.
+    EX: simulate(DDice(D6, D6, D4).plus(2), 10**8, seed=42, keep_totals=False).probabilities()"""
+    if trials < 1:
+        raise ValueError(f"trials must be at least 1, not {trials}")
+    rng = np.random.default_rng(seed)
+    groups: Dict[Type[Die], int] = {} #dice of one class are drawn together
+    for d in dice.dice:
+        groups[type(d)] = groups.get(type(d), 0) + 1
+    for die_class in groups:
+        if not getattr(die_class, "faces", None):
+            raise TypeError(f"{die_class.__name__} has no faces to simulate")
+    low = sum(min(dc.faces) * n for dc, n in groups.items()) + dice.adjust
+    high = sum(max(dc.faces) * n for dc, n in groups.items()) + dice.adjust
+    counts = np.zeros(high - low + 1, dtype=np.int64)
+    face_counts = {dc: np.zeros(len(dc.faces), dtype=np.int64) for dc in groups}
+    totals = np.empty(trials, dtype=np.int32) if keep_totals else None
+    for start in range(0, trials, chunk):
+        size = min(chunk, trials - start)
+        chunk_totals = np.full(size, dice.adjust - low, dtype=np.int32) #offset so the lowest total is 0
+        for die_class, n in groups.items():
+            faces = np.array(die_class.faces, dtype=np.int32)
+            #which face of each die, in the smallest type that indexes them all: uint8 up to 256 faces
+            drawn = rng.integers(0, len(faces), size=(n, size), dtype=np.min_scalar_type(len(faces) - 1))
+            face_counts[die_class] += np.bincount(drawn.ravel(), minlength=len(faces))
+            if np.array_equal(faces, np.arange(faces[0], faces[0] + len(faces))):
+                chunk_totals += drawn.sum(axis=0, dtype=np.int32) + faces[0] * n #D6: no lookup needed
+            else:
+                chunk_totals += faces[drawn].sum(axis=0, dtype=np.int32)
+        counts += np.bincount(chunk_totals, minlength=len(counts))
+        if totals is not None:
+            totals[start:start + size] = chunk_totals + low
+    rolled: Dict[str, Dict[int, int]] = {}
+    for dc, fc in face_counts.items():
+        by_face = rolled[dc.__name__] = {}
+        for face, count in zip(dc.faces, fc): #a face can appear more than once
+            by_face[face] = by_face.get(face, 0) + int(count)
+    return DiceSimulation(totals, np.arange(low, high + 1), counts, rolled)
+
+
 ############################################
 # Changing the metaclass of the Die implementations
 
@@ -182,9 +254,8 @@ class DieLog(metaclass=DieMeta):
 ######################################
 #######################################
 # Creating a new dict type that doesn't update keys once loaded in.
-from __future__ import annotations
 from typing import cast, Union, Tuple, Dict, Hashable, Any, Mapping, Iterable
-from collections import Hashable
+from collections.abc import Hashable
 
 DictInit = Union[
     Iterable[Tuple[Hashable, Any]],
@@ -0,0 +1,86 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+import zipfile
+from pathlib import Path
+
+from ch5_batch import archive_paths, main
+
+
+def run(*argv):
+    """main's exit code (argparse errors exit with 2), stdout and stderr."""
+    stdout, stderr = io.StringIO(), io.StringIO()
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        try:
+            code = main(argv)
+        except SystemExit as exit:
+            code = exit.code
+    return code, stdout.getvalue(), stderr.getvalue()
+
+
+class TestBatchCommand(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = Path(self.directory.name)
+        for name in ("a.zip", "sub/b.zip", "sub/deeper/c.zip"):
+            path = self.root / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with zipfile.ZipFile(path, "w") as archive:
+                archive.writestr("notes.md", "xyzzy")
+        (self.root / "sub" / "readme.txt").write_text("not an archive")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_archive_paths(self):
+        root = self.root
+        everything = [root / "a.zip", root / "sub/b.zip", root / "sub/deeper/c.zip"]
+        for sources, expected in (
+                ([str(root)], everything),
+                ([str(root / "sub"), str(root / "**/*.zip"), str(root / "a.zip")], everything), #each once
+                ([str(root / "*.zip"), str(root / "sub/b.zip")], everything[:2]),
+                ([str(root / "sub/*/*.zip")], everything[2:]),
+        ):
+            with self.subTest(sources=sources):
+                self.assertEqual(archive_paths(sources), (expected, []))
+        missing = [str(root / "sub/deeper/*.zp"), str(root / "nowhere"), str(root / "sub/deeper")]
+        self.assertEqual(archive_paths(missing), ([root / "sub/deeper/c.zip"], missing[:2]))
+        os.rename(root / "sub/deeper/c.zip", root / "sub/deeper/c.zap")
+        self.assertEqual(archive_paths([str(root / "sub/deeper")]), ([], [str(root / "sub/deeper")]))
+
+    def test_resize(self):
+        for good, expected in (("640x960", "(640, 960)"), ("20X10", "(20, 10)")):
+            with self.subTest(resize=good):
+                code, out, _ = run(str(self.root), "--pattern", "*.jpg", "--resize", good, "--workers", "1", "--quiet")
+                self.assertEqual(code, 0)
+                self.assertIn("3 archives (0 failed)", out)
+        for bad in ("640", "640x", "x960", "axb", "640x960x2", "0x960", "-5x10"):
+            with self.subTest(resize=bad):
+                code, _, err = run(str(self.root), "--pattern", "*.jpg", "--resize", bad)
+                self.assertEqual(code, 2)
+                self.assertIn("--resize", err)
+
+    def test_exit_codes(self):
+        args = ("--pattern", "*.md", "--find", "xyzzy", "--workers", "1", "--quiet")
+        code, out, err = run(str(self.root), *args, "--replace", "egg")
+        self.assertEqual((code, err), (0, ""))
+        self.assertIn("3 archives (0 failed)", out)
+        with zipfile.ZipFile(self.root / "sub/b.zip") as archive:
+            self.assertEqual(archive.read("notes.md"), b"egg")
+        code, out, err = run(str(self.root / "a.zip"), str(self.root / "typo/*.zip"), *args, "--replace", "egg")
+        self.assertEqual(code, 1)
+        self.assertIn("1 archives (0 failed)", out)
+        self.assertIn("typo/*.zip: no archives found", err)
+        (self.root / "sub/b.zip").write_bytes(b"not a zip")
+        code, out, _ = run(str(self.root), *args, "--replace", "egg")
+        self.assertEqual(code, 1)
+        self.assertIn("2 archives (1 failed)", out)
+        code, _, err = run(str(self.root), *args) #--find without --replace
+        self.assertEqual(code, 2)
+        self.assertIn("--find needs --replace", err)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,444 @@
+import contextlib
+import io
+import os
+import random
+import re
+import tempfile
+import unittest
+import zipfile
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from unittest import mock
+
+from PIL import Image
+
+from ch5_managers import (
+    ArchiveRef, ImgTweaker, TextTransformer, TextTweaker, TransformCache, TransformedMember, ZipBatch, ZipProcessor, _compressed_chunks, copy_member_raw, match_width, stream_sub, transform_members,
+)
+
+
+def jpeg(size, seed=0):
+    buffer = io.BytesIO()
+    Image.effect_noise(size, 32 + seed).convert("RGB").save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def quietly(run, *args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return run(*args)
+
+
+class ArchiveTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name) / "archive.zip"
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def members(self, path=None):
+        with zipfile.ZipFile(path or self.path) as archive:
+            self.assertIsNone(archive.testzip())
+            return {item.filename: archive.read(item) for item in archive.infolist()}
+
+
+def mixed_archive(path, members=12):
+    """Text members in every compression zipfile writes, with some binary ones between them."""
+    kinds = (zipfile.ZIP_DEFLATED, zipfile.ZIP_STORED, zipfile.ZIP_BZIP2, zipfile.ZIP_LZMA)
+    with zipfile.ZipFile(path, "w") as archive:
+        for n in range(members):
+            info = zipfile.ZipInfo(f"dir{n % 3}/text{n}.txt", (2020, 1, 2, 3, 4, 6))
+            info.external_attr = 0o640 << 16
+            archive.writestr(info, f"{n} xyzzy plugh\n" * (n * 500), compress_type=kinds[n % len(kinds)])
+            archive.writestr(f"bin{n}.dat", bytes(range(256)) * n, compress_type=kinds[(n + 1) % len(kinds)])
+
+
+class TestStreamSub(unittest.TestCase):
+    patterns = [
+        r"xyzzy", r"ab", r"a.c", r"\bab\b", r"a?", r"x{2,5}", r"(ab|c)d", r"^ab", r"ab$", r"(?m)^ab", r"(?m)b$",
+        r"", r"a|", r"\w{3}", r"(a)(b)?", r"\r\n",
+    ]
+
+    def test_matches_re_sub_across_buffer_boundaries(self):
+        rng = random.Random(1)
+        for find in self.patterns:
+            pattern = re.compile(find)
+            for replace in ("Z", r"<\g<0>>", ""):
+                for buffer_size in (1, 2, 3, 5, 8):
+                    text = "".join(rng.choice("abcdx \r\n") for _ in range(300))
+                    target = io.StringIO()
+                    stream_sub(pattern, replace, io.StringIO(text), target, match_width(pattern), buffer_size)
+                    with self.subTest(find=find, replace=replace, buffer_size=buffer_size):
+                        self.assertEqual(target.getvalue(), pattern.sub(replace, text))
+
+    def test_match_width(self):
+        widths = {"xyzzy": 5, "x{2,5}": 5, "a+": None, "(?=a)b": None, "(?<=a)b": None, "": 0}
+        for find, width in widths.items():
+            with self.subTest(find=find):
+                self.assertEqual(match_width(re.compile(find)), width)
+
+    def test_text_transformer_streams_bytes(self):
+        text = "é xyzzy\r\n" * 1000
+        target = io.BytesIO()
+        TextTransformer("x{2}y|z+y", "~", buffer_size=10).transform_stream(io.BytesIO(text.encode()), target)
+        self.assertEqual(target.getvalue().decode(), re.sub("x{2}y|z+y", "~", text))
+        self.assertFalse(target.closed)
+
+
+class TestSpilling(ArchiveTestCase):
+    def setUp(self):
+        super().setUp()
+        self.spills = Path(self.directory.name) / "spills"
+        self.spills.mkdir()
+        self.tempdir, tempfile.tempdir = tempfile.tempdir, str(self.spills)
+
+    def tearDown(self):
+        tempfile.tempdir = self.tempdir
+        super().tearDown()
+
+    def test_members_over_spool_size_spill_and_are_cleaned_up(self):
+        mixed_archive(self.path)
+        expected = self.path.with_name("expected.zip")
+        expected.write_bytes(self.path.read_bytes())
+        quietly(ZipProcessor(expected, TextTransformer("xyzzy", "egg"), "*.txt").process_files)
+        for workers in (0, 2):
+            path = self.path.with_name(f"spilled{workers}.zip")
+            path.write_bytes(self.path.read_bytes())
+            processor = ZipProcessor(path, TextTransformer("xyzzy", "egg"), "*.txt", workers=workers)
+            processor.spool_size = 512
+            with mock.patch("tempfile.mkstemp", wraps=tempfile.mkstemp) as mkstemp:
+                quietly(processor.process_files)
+            with self.subTest(workers=workers):
+                self.assertGreater(mkstemp.call_count, 1 if workers else 0) #the archive's own temp file, then spills
+                self.assertEqual(self.members(path), self.members(expected))
+                self.assertEqual(list(self.spills.iterdir()), [])
+
+
+class TestRawCopy(ArchiveTestCase):
+    def test_round_trip(self):
+        mixed_archive(self.path)
+        copy = self.path.with_name("copy.zip")
+        with zipfile.ZipFile(self.path) as source, zipfile.ZipFile(copy, "w") as target:
+            for n, item in enumerate(source.infolist()):
+                copy_member_raw(source, target, item)
+                if n == 3:
+                    target.writestr("between.txt", "written the usual way") #raw and normal writes mix
+        self.assertEqual(self.members(copy), dict(self.members(), **{"between.txt": b"written the usual way"}))
+        with zipfile.ZipFile(self.path) as source, zipfile.ZipFile(copy) as target:
+            for item in source.infolist():
+                copied = target.getinfo(item.filename)
+                with self.subTest(member=item.filename):
+                    self.assertEqual(
+                        (copied.CRC, copied.compress_type, copied.compress_size, copied.file_size, copied.date_time, copied.external_attr),
+                        (item.CRC, item.compress_type, item.compress_size, item.file_size, item.date_time, item.external_attr),
+                    )
+                    self.assertEqual(b"".join(_compressed_chunks(target, copied)), b"".join(_compressed_chunks(source, item)))
+
+    def test_unmatched_members_are_not_recompressed(self):
+        mixed_archive(self.path)
+        with zipfile.ZipFile(self.path) as source:
+            before = {item.filename: b"".join(_compressed_chunks(source, item)) for item in source.infolist()}
+        quietly(ZipProcessor(self.path, TextTransformer("xyzzy", "egg"), "*.none").process_files)
+        with zipfile.ZipFile(self.path) as target:
+            after = {item.filename: b"".join(_compressed_chunks(target, item)) for item in target.infolist()}
+        self.assertEqual(after, before)
+
+
+class ProcessTextTransformer(TextTransformer):
+    pool = "process"
+    batch_size = 3
+
+
+class TestParallel(ArchiveTestCase):
+    def rewritten(self, transformer, workers, name):
+        path = self.path.with_name(name)
+        path.write_bytes(self.path.read_bytes())
+        quietly(ZipProcessor(path, transformer, "*.txt", workers=workers).process_files)
+        return path.read_bytes()
+
+    def test_serial_and_parallel_archives_are_identical(self):
+        mixed_archive(self.path, members=20)
+        serial = self.rewritten(TextTransformer("xyzzy", "plover's egg"), 0, "serial.zip")
+        for transformer, workers in (
+                (TextTransformer("xyzzy", "plover's egg"), 1),
+                (TextTransformer("xyzzy", "plover's egg"), 3),
+                (ProcessTextTransformer("xyzzy", "plover's egg"), 2),
+        ):
+            with self.subTest(pool=transformer.pool, workers=workers):
+                self.assertEqual(self.rewritten(transformer, workers, f"parallel{workers}.zip"), serial)
+        self.assertIn(b"3 plover's egg plugh", self.members(self.path.with_name("serial.zip"))["dir0/text3.txt"])
+
+    def test_process_workers_close_the_archive(self):
+        mixed_archive(self.path)
+        with ProcessPoolExecutor(1) as pool:
+            worker = pool.submit(os.getpid).result() #started before any archive is open, like ZipBatch does
+            for _ in range(2): #the second run reads the archive the first one replaced
+                ZipProcessor(self.path, ProcessTextTransformer("xyzzy", "egg"), "*.txt", workers=1, verbose=False).rewrite(pool)
+            descriptors = Path(f"/proc/{worker}/fd")
+            if descriptors.is_dir(): #Linux
+                opened = [os.readlink(fd) for fd in descriptors.iterdir() if fd.is_symlink()]
+                self.assertFalse([name for name in opened if "archive.zip" in name])
+        self.assertIn(b"3 egg plugh", self.members()["dir0/text3.txt"])
+
+    def test_tasks_refuse_a_replaced_archive(self):
+        mixed_archive(self.path)
+        ref = ArchiveRef.of(self.path)
+        with zipfile.ZipFile(self.path) as archive:
+            items = [archive.getinfo("dir0/text3.txt")]
+        self.assertEqual(transform_members(ref, items, TextTransformer("xyzzy", "egg"), 1 << 20)[0].file_size, len("3 egg plugh\n") * 3 * 500)
+        os.utime(self.path, ns=(ref.mtime_ns, ref.mtime_ns)) #same mtime, as on a coarse filesystem
+        with open(self.path, "ab") as archive:
+            archive.write(b"\0")
+        os.utime(self.path, ns=(ref.mtime_ns, ref.mtime_ns))
+        with self.assertRaises(zipfile.BadZipFile):
+            transform_members(ref, items, TextTransformer("xyzzy", "egg"), 1 << 20)
+
+
+class TestTransformCache(ArchiveTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache_path = Path(self.directory.name) / "cache"
+
+    def test_lru_eviction(self):
+        cache = TransformCache(self.cache_path, max_bytes=300)
+        for key in "abc":
+            cache.put(key * 64, TransformedMember(key.encode() * 100, 1, 100, True))
+        self.assertIsNotNone(cache.get("a" * 64)) #a is now the most recently used
+        cache.put("d" * 64, TransformedMember(b"d" * 100, 1, 100, True))
+        self.assertIsNone(cache.get("b" * 64))
+        self.assertEqual(cache.get("a" * 64).data, b"a" * 100)
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertEqual((cache.stats()["entries"], cache.stats()["bytes"]), (3, 300))
+        self.assertFalse((self.cache_path / "bb" / ("b" * 64)).exists())
+        cache.put("e" * 64, TransformedMember(b"e" * 301, 1, 301, True)) #bigger than the whole cache
+        self.assertIsNone(cache.get("e" * 64))
+
+    def test_persists_and_survives_missing_files(self):
+        cache = TransformCache(self.cache_path)
+        cache.put("a" * 64, TransformedMember(b"compressed", 7, 20, True))
+        cache.put("b" * 64, TransformedMember(b"other", 8, 5, False))
+        cache.save()
+        (self.cache_path / "bb" / ("b" * 64)).unlink()
+        again = TransformCache(self.cache_path)
+        self.assertEqual(again.get("a" * 64), TransformedMember(b"compressed", 7, 20, True))
+        self.assertIsNone(again.get("b" * 64))
+        self.assertEqual((again.hits, again.misses, again.stats()["entries"]), (1, 1, 1))
+
+    def test_failed_runs_keep_the_cache_accounted_for(self):
+        mixed_archive(self.path)
+        with self.assertRaises(RuntimeError):
+            quietly(ZipProcessor(self.path, FailingTransformer("xyzzy", "egg"), "*.txt", cache=TransformCache(self.cache_path)).process_files)
+        files = [path for path in self.cache_path.glob("??/*")]
+        reopened = TransformCache(self.cache_path)
+        self.assertEqual(reopened.stats()["entries"], 7) #text0 to text6, put before text7 failed
+        self.assertEqual((len(files), reopened.size), (7, sum(path.stat().st_size for path in files)))
+        killed = TransformCache(self.cache_path) #put, then the process dies before save()
+        killed.put("a" * 64, TransformedMember(b"lost", 1, 4, True))
+        (self.cache_path / "bb").mkdir()
+        (self.cache_path / "bb" / ("b" * 64 + ".123.tmp")).write_bytes(b"half written")
+        reopened = TransformCache(self.cache_path)
+        self.assertEqual(sorted(path.name for path in self.cache_path.glob("??/*")), sorted(path.name for path in files))
+        self.assertEqual(reopened.stats()["entries"], 7)
+
+    def test_large_hits_come_back_spilled(self):
+        cache = TransformCache(self.cache_path)
+        cache.put("a" * 64, TransformedMember(b"x" * 1000, 7, 1000, True))
+        member = cache.get("a" * 64, spool_size=100)
+        self.assertEqual((member.data, b"".join(member.chunks())), (b"", b"x" * 1000))
+        member.discard()
+        self.assertFalse(Path(member.spill).exists())
+
+    def test_processor_runs(self):
+        mixed_archive(self.path)
+        original = self.path.read_bytes()
+        def run(transformer, workers=0):
+            self.path.write_bytes(original)
+            processor = ZipProcessor(self.path, transformer, "*.txt", workers=workers, cache=TransformCache(self.cache_path))
+            quietly(processor.process_files)
+            return processor.cache.stats(), self.members()
+        first, expected = run(TextTransformer("xyzzy", "egg"))
+        self.assertEqual((first["hits"], first["misses"]), (0, 12))
+        for workers in (0, 2):
+            stats, members = run(TextTransformer("xyzzy", "egg"), workers)
+            with self.subTest(workers=workers):
+                self.assertEqual((stats["hits"], stats["misses"], stats["hit_rate"]), (12, 0, 1.0))
+                self.assertEqual(members, expected)
+        tuned, _ = run(TextTransformer("xyzzy", "egg", buffer_size=100)) #only changes memory use
+        self.assertEqual((tuned["hits"], tuned["misses"]), (12, 0))
+        other, _ = run(TextTransformer("xyzzy", "EGG")) #other parameters, other entries
+        self.assertEqual((other["hits"], other["misses"]), (0, 12))
+
+    def test_quiet_runs_print_nothing(self):
+        mixed_archive(self.path)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            ZipProcessor(self.path, TextTransformer("xyzzy", "egg"), "*.txt", cache=TransformCache(self.cache_path), verbose=False).process_files()
+        self.assertEqual(output.getvalue(), "")
+
+
+    def test_pooled_reruns_write_hits_as_they_go(self):
+        mixed_archive(self.path)
+        original = self.path.read_bytes()
+        quietly(ZipProcessor(self.path, TextTransformer("xyzzy", "egg"), "*.txt", cache=TransformCache(self.cache_path)).process_files)
+        expected = self.members()
+        self.path.write_bytes(original)
+        processor = HitCountingProcessor(self.path, TextTransformer("xyzzy", "egg"), "*.txt", workers=2, cache=TransformCache(self.cache_path))
+        quietly(processor.process_files)
+        self.assertEqual((processor.counts["Cached"], processor.most_held), (12, 1))
+        self.assertEqual(self.members(), expected)
+        with zipfile.ZipFile(self.path.with_name("new.zip"), "w") as archive: #one new member ahead of all the hits
+            archive.writestr("new.txt", "xyzzy")
+            with zipfile.ZipFile(io.BytesIO(original)) as old:
+                for item in old.infolist():
+                    archive.writestr(item, old.read(item))
+        self.path.write_bytes(original)
+        quietly(ZipProcessor(self.path, BatchedTextTransformer("xyzzy", "egg"), "*.txt", cache=TransformCache(self.cache_path)).process_files)
+        processor = HitCountingProcessor(
+            self.path.with_name("new.zip"), BatchedTextTransformer("xyzzy", "egg"), "*.txt", workers=2,
+            cache=TransformCache(self.cache_path),
+        )
+        processor.spool_size = 1000 #its batch isn't full, but the hits behind it are over spool_size
+        quietly(processor.process_files)
+        self.assertEqual((processor.counts["Transform"], processor.counts["Cached"]), (1, 12))
+        self.assertLessEqual(processor.most_held, 2)
+        self.assertEqual(self.members(self.path.with_name("new.zip")), dict(expected, **{"new.txt": b"egg"}))
+
+
+class BatchedTextTransformer(TextTransformer):
+    batch_size = 8
+
+
+class HitCountingProcessor(ZipProcessor):
+    """Records the most cache hits ever looked up and not yet written."""
+    looked_up = written = most_held = 0
+
+    def _cached(self, item):
+        member = super()._cached(item)
+        if member is not None:
+            self.looked_up += 1
+            self.most_held = max(self.most_held, self.looked_up - self.written)
+        return member
+
+    def _write_pending(self, input_zip, output_zip, item, batch, index, cached):
+        if cached is not None:
+            self.written += 1
+        return super()._write_pending(input_zip, output_zip, item, batch, index, cached)
+
+
+class FailingTransformer(TextTransformer):
+    def transform_stream(self, source, target):
+        if b"7 xyzzy" in source.read(16): #fails partway through the archive
+            raise RuntimeError("transform failed")
+        target.write(b"done")
+
+
+class ProcessFailingTransformer(FailingTransformer):
+    pool = "process"
+
+
+class TestAtomicRewrite(ArchiveTestCase):
+    def test_failed_rewrite_keeps_the_original(self):
+        mixed_archive(self.path)
+        self.path.chmod(0o640)
+        original = self.path.read_bytes()
+        for workers in (0, 2):
+            with self.subTest(workers=workers):
+                with self.assertRaisesRegex(RuntimeError, "transform failed"):
+                    quietly(ZipProcessor(self.path, FailingTransformer("x", "y"), "*.txt", workers=workers).process_files)
+                self.assertEqual(self.path.read_bytes(), original)
+                self.assertEqual(os.listdir(self.directory.name), ["archive.zip"]) #no temporary file, no .old
+
+    def test_rewrite_replaces_in_place(self):
+        mixed_archive(self.path)
+        self.path.chmod(0o640)
+        quietly(ZipProcessor(self.path, TextTransformer("xyzzy", "egg"), "*.txt").process_files)
+        self.assertEqual(os.listdir(self.directory.name), ["archive.zip"])
+        self.assertEqual(self.path.stat().st_mode & 0o777, 0o640)
+        self.assertIn(b"egg", self.members()["dir0/text3.txt"])
+
+
+class TestZipBatch(ArchiveTestCase):
+    def test_failures_are_isolated(self):
+        directory = Path(self.directory.name)
+        archives = []
+        for n in range(6):
+            path = directory / f"a{n}.zip"
+            mixed_archive(path, members=n + 2)
+            archives.append(path)
+        corrupt = directory / "corrupt.zip"
+        corrupt.write_bytes(b"not a zip")
+        failing = directory / "failing.zip"
+        mixed_archive(failing, members=9) #text7 makes FailingTransformer raise
+        untouched = {path: path.read_bytes() for path in (corrupt, failing)}
+        expected = {}
+        for path in archives:
+            copy = directory / f"expected_{path.name}"
+            copy.write_bytes(path.read_bytes())
+            quietly(ZipProcessor(copy, FailingTransformer("x", "y"), "*.txt").process_files)
+            expected[path] = self.members(copy)
+
+        for transformer in (FailingTransformer("x", "y"), ProcessFailingTransformer("x", "y")):
+            for n, path in enumerate(archives): #fresh copies for each pool
+                mixed_archive(path, members=n + 2)
+            batch = ZipBatch([corrupt, *archives, failing], transformer, "*.txt", workers=2, writers=3, progress=False)
+            stats = quietly(batch.process_files)
+            with self.subTest(pool=transformer.pool):
+                self.assertEqual(sorted(path.name for path, _ in batch.failed), ["corrupt.zip", "failing.zip"])
+                self.assertEqual((stats["archives"], stats["failed"]), (6, 2))
+                self.assertEqual(stats["transformed"], sum(n + 2 for n in range(6)))
+                for path in archives:
+                    self.assertEqual(self.members(path), expected[path])
+                for path, data in untouched.items():
+                    self.assertEqual(path.read_bytes(), data)
+        self.assertEqual(sorted(p.name for p in directory.iterdir() if not p.name.startswith("expected_")),
+                         ["a0.zip", "a1.zip", "a2.zip", "a3.zip", "a4.zip", "a5.zip", "corrupt.zip", "failing.zip"])
+
+
+class TestTweakers(ArchiveTestCase):
+    """The inheritance version extracts matching members, into a temporary directory rather than the current one."""
+    def setUp(self):
+        super().setUp()
+        self.cwd = os.getcwd()
+        os.chdir(self.directory.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        super().tearDown()
+
+    def test_text_tweaker(self):
+        text = "line xyzzy\r\n" * 500
+        with zipfile.ZipFile(self.path, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("docs/", "")
+            archive.writestr("docs/a.md", text)
+            archive.writestr("b.txt", "xyzzy")
+        tweaker = TextTweaker(self.path, buffer_size=7).find_and_replace(r"x\w{4}", "plover's egg")
+        quietly(tweaker.process_files, "*.md")
+        self.assertEqual(self.members(), {
+            "docs/": b"", "docs/a.md": text.replace("xyzzy", "plover's egg").encode(), "b.txt": b"xyzzy",
+        })
+        self.assertEqual(os.listdir(), ["archive.zip"]) #nothing extracted here, no .old backup, no temporary file
+        with zipfile.ZipFile(self.path) as archive:
+            self.assertEqual([item.compress_type for item in archive.infolist()], [zipfile.ZIP_DEFLATED] * 3)
+
+    def test_failed_tweak_keeps_the_original(self):
+        with zipfile.ZipFile(self.path, "w") as archive:
+            archive.writestr("a.md", "xyzzy")
+            archive.writestr("b.md", b"\xff not utf-8")
+        original = self.path.read_bytes()
+        with self.assertRaises(UnicodeDecodeError):
+            quietly(TextTweaker(self.path).find_and_replace("xyzzy", "egg").process_files, "*.md")
+        self.assertEqual(self.path.read_bytes(), original)
+        self.assertEqual(os.listdir(), ["archive.zip"])
+
+    def test_img_tweaker(self):
+        with zipfile.ZipFile(self.path, "w") as archive:
+            archive.writestr("big.jpg", jpeg((1300, 2000))) #big enough for a JPEG draft at 1/2 scale
+            archive.writestr("small.jpg", jpeg((100, 150)))
+        quietly(ImgTweaker(self.path).process_files, "*.jpg")
+        for name, data in self.members().items():
+            with Image.open(io.BytesIO(data)) as image:
+                self.assertEqual((name, image.format, image.size), (name, "JPEG", (640, 960)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+from collections import Counter
+from itertools import product
+
+import numpy as np
+
+from ch6_ABC import D4, D6, DDice, Die, simulate
+
+
+class D1000(Die):
+    faces = tuple(range(1, 1001))
+
+    def roll(self):
+        pass
+
+
+class Shuffled(Die):
+    """Faces out of order, one of them twice."""
+    faces = (9, -2, 4, 0, 4)
+
+    def roll(self):
+        pass
+
+
+def exact(*faces, adjust=0):
+    """The exact distribution of the total, by enumerating every roll."""
+    counts = Counter(sum(roll) + adjust for roll in product(*faces))
+    rolls = sum(counts.values())
+    return {total: n / rolls for total, n in counts.items()}
+
+
+class TestSimulate(unittest.TestCase):
+    def test_2d6_matches_the_exact_distribution(self):
+        simulation = simulate(DDice(D6, D6), 400_000, seed=7)
+        probabilities = simulation.probabilities()
+        self.assertEqual(set(probabilities), set(range(2, 13)))
+        for total, p in exact(D6.faces, D6.faces).items():
+            with self.subTest(total=total):
+                self.assertIs(type(probabilities[total]), float)
+                self.assertAlmostEqual(probabilities[total], p, delta=0.003)
+
+    def test_d4_faces_and_adjust(self):
+        simulation = simulate(DDice(D4, D6, D4).plus(3), 200_000, seed=1, chunk=30_000)
+        expected = exact(D4.faces, D6.faces, D4.faces, adjust=3)
+        for total, p in simulation.probabilities().items():
+            with self.subTest(total=total):
+                self.assertAlmostEqual(p, expected.get(total, 0.0), delta=0.003)
+        self.assertEqual(set(simulation.faces["D4"]), {1, 2, 4, 5})
+        self.assertEqual(sum(simulation.faces["D4"].values()), 400_000)
+        self.assertEqual(np.bincount(simulation.totals - simulation.values[0]).tolist(), simulation.counts.tolist())
+
+    def test_big_and_unordered_dice(self):
+        simulation = simulate(DDice(D1000, Shuffled, Shuffled), 300_000, seed=5, chunk=70_000)
+        self.assertEqual((simulation.values[0], simulation.values[-1]), (1 - 4, 1000 + 18))
+        self.assertEqual(sorted(simulation.faces["D1000"]), list(range(1, 1001)))
+        self.assertAlmostEqual(max(simulation.faces["D1000"].values()) / 300_000, 0.001, delta=0.0005)
+        shuffled = simulation.faces["Shuffled"]
+        self.assertEqual(sum(shuffled.values()), 600_000)
+        for face, p in exact(Shuffled.faces).items():
+            with self.subTest(face=face):
+                self.assertAlmostEqual(shuffled[face] / 600_000, p, delta=0.003)
+        self.assertAlmostEqual(float(simulation.totals.mean()), 500.5 + 2 * 3.0, delta=2.0)
+        small = simulate(DDice(Shuffled, Shuffled).plus(1), 200_000, seed=2).probabilities()
+        for total, p in exact(Shuffled.faces, Shuffled.faces, adjust=1).items():
+            with self.subTest(total=total):
+                self.assertAlmostEqual(small[total], p, delta=0.003)
+
+    def test_seeded_and_streaming(self):
+        dice = DDice(D6, D4)
+        first = simulate(dice, 10_000, seed=3)
+        self.assertTrue(np.array_equal(first.totals, simulate(dice, 10_000, seed=3).totals))
+        streamed = simulate(dice, 10_000, seed=3, keep_totals=False)
+        self.assertIsNone(streamed.totals)
+        self.assertEqual(streamed.counts.tolist(), first.counts.tolist())
+
+    def test_rejects_no_trials(self):
+        for trials in (0, -5):
+            with self.subTest(trials=trials):
+                with self.assertRaises(ValueError):
+                    simulate(DDice(D6), trials)
+
+
+if __name__ == "__main__":
+    unittest.main()